@@ -1,11 +1,36 @@
 # Import Library
 
-from googleapiclient import discovery
 from datetime import datetime, timezone, timedelta
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, g, jsonify, request, render_template
 from flask_cors import CORS
 from script.function import *
+from script.snapshot import build_snapshot
+from script.bulk_update import compartment_targets, partial_update_to_patch, patch_resources
+from script.patient_index import read_patient_ndjson
+from script.terminology import TerminologyError, TerminologyService
+from script.jsonio import FastJSONProvider, loads
+from script.payload import (
+    MIN_COMPRESS_SIZE, choose_encoding, compress_body, compress_response, parse_fields, project_bundle, upstream_params
+)
+from script.profiling import (
+    ProfileStore, StackSampler, begin_request, current_profile, end_request, format_spans, server_timing, span
+)
+from script.prefetch import PrefetchScheduler, parse_window, read_mrn_file
+from script.write_queue import WriteBehindFlusher, WriteQueue
+from script.tenants import (
+    DEFAULT_TENANT, Tenant, TenantBusyError, TenantRegistry, UnknownTenantError, load_tenants
+)
+from script.invalidation import (
+    InvalidationHandler,
+    file_notification_feed,
+    pubsub_notification_feed,
+    start_invalidation_worker,
+)
+from functools import partial
 import logging
+import os
+import threading
+import time
 from logging.handlers import RotatingFileHandler
 
 # Variables
@@ -15,20 +40,35 @@ dataset_id = 'patient-dataset-demo'
 fhir_store_id = 'fhir-patient-datastore'
 version = 'R4'
 
-fhir_store_parent = (
-    f"projects/{project_id}/locations/{location}/datasets/{dataset_id}"
+# --- Tenants ---
+# The store above is the default tenant. More FHIR stores (one per hospital) are
+# configured in TENANTS_FILE (see script/tenants.py) and picked per request with
+# the X-Tenant-ID header or ?tenant=. Each tenant has its own client and
+# connection pool, patient cache and index, rate limit and metrics.
+default_tenant = Tenant(
+    DEFAULT_TENANT,
+    project_id,
+    location,
+    dataset_id,
+    fhir_store_id,
+    rate_per_second=float(os.environ["TENANT_RATE_LIMIT"]) if os.environ.get("TENANT_RATE_LIMIT") else None,
+    max_concurrency=int(os.environ.get("TENANT_MAX_CONCURRENCY", 32)),
+    cache_ttl_seconds=float(os.environ.get("PATIENT_CACHE_TTL_SECONDS", 300)),
+    cache_max_entries=int(os.environ.get("PATIENT_CACHE_MAX_ENTRIES", 1024)),
+    snapshot_ttl_seconds=float(os.environ["SNAPSHOT_TTL_SECONDS"]) if os.environ.get("SNAPSHOT_TTL_SECONDS") else None,
+    notification_subscription=os.environ.get("FHIR_NOTIFICATION_SUBSCRIPTION"),
 )
-fhir_store_name = f"{fhir_store_parent}/fhirStores/{fhir_store_id}"
-
-api_version = "v1"
-service_name = "healthcare"
-healthcare_client = discovery.build(service_name, api_version)
+tenants = TenantRegistry(default_tenant)
+if os.environ.get("TENANTS_FILE"):
+    for _tenant in load_tenants(os.environ["TENANTS_FILE"]):
+        tenants.add(_tenant)
 
 
 gmt7_timezone = timezone(timedelta(hours=7))
 current_time = datetime.now(gmt7_timezone).isoformat()
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # --- Logging Configuration ---
@@ -53,8 +93,254 @@ app.logger.setLevel(logging.INFO) # Set the base level for the app logger
 # This removes the default Flask handler to avoid duplicate logs in the console.
 app.logger.removeHandler(app.logger.handlers[0])
 
+# The script.* modules log through their own module loggers; send those to the same handlers.
+script_logger = logging.getLogger('script')
+script_logger.addHandler(file_handler)
+script_logger.addHandler(console_handler)
+script_logger.setLevel(logging.INFO)
+
 app.logger.info("Flask application starting up...")
 
+# --- Patient Cache ---
+# Cached $everything bundles and timeline indexes are invalidated from FHIR store
+# change notifications, so the TTL can be long. Set FHIR_NOTIFICATION_SUBSCRIPTION
+# (or "notification_subscription" per tenant) to a Pub/Sub subscription path, or
+# FHIR_NOTIFICATION_FILE to an NDJSON file of notifications for local testing.
+# Pub/Sub hands each message to only one subscriber and the cache is per process,
+# so run a single worker per subscription (e.g. gunicorn --workers 1 --threads N),
+# or give each worker process its own subscription on the notification topic.
+patient_cache = default_tenant.cache
+
+def _invalidation_handler(tenant):
+    return InvalidationHandler(
+        tenant.cache,
+        fetch_resource=lambda resource_type, resource_id: get_resource(
+            tenant.fhir_store_id, resource_type, resource_id, tenant.fhir_store_parent, tenant.client
+        ),
+        refresh=partial(tenant.fetch_everything, raw=True) if os.environ.get("CACHE_REFRESH_ON_CHANGE") else None,
+    )
+
+def _apply_create(tenant, patient_id, resource):
+    """
+    Drops the patient's bundle-derived cache entries after a create and applies
+    the new resource to their clinical snapshot, which stays cached.
+    """
+    tenant.cache.apply_create(patient_id, resource.get("resourceType"), resource.get("id"), resource)
+
+invalidation_handlers = {tenant.name: _invalidation_handler(tenant) for tenant in tenants}
+for _tenant in tenants:
+    if _tenant.notification_subscription:
+        app.logger.info(f"Invalidating {_tenant.name} cache from Pub/Sub subscription {_tenant.notification_subscription}")
+        start_invalidation_worker(
+            partial(pubsub_notification_feed, _tenant.notification_subscription), invalidation_handlers[_tenant.name]
+        )
+if os.environ.get("FHIR_NOTIFICATION_FILE") and not default_tenant.notification_subscription:
+    app.logger.info(f"Invalidating cache from notification file {os.environ['FHIR_NOTIFICATION_FILE']}")
+    start_invalidation_worker(
+        partial(file_notification_feed, os.environ["FHIR_NOTIFICATION_FILE"]), invalidation_handlers[DEFAULT_TENANT]
+    )
+
+# --- Terminology ---
+# Code systems are loaded from local files (TERMINOLOGY_SNOMED_FILE,
+# TERMINOLOGY_LOINC_FILE, TERMINOLOGY_RXNORM_FILE). Codes of a loaded system are
+# validated on create and get their canonical display; other systems pass through.
+terminology = TerminologyService()
+for _system in ("snomed", "loinc", "rxnorm"):
+    _path = os.environ.get(f"TERMINOLOGY_{_system.upper()}_FILE")
+    if _path:
+        terminology.load(_system, _path)
+        app.logger.info(f"Loaded {_system} terminology from {_path}")
+
+# --- Patient Search Index ---
+# Built from Patient NDJSON bulk export files (PATIENT_INDEX_NDJSON, comma
+# separated) and kept current as patients are created through this app.
+patient_index = default_tenant.patient_index
+for _path in filter(None, os.environ.get("PATIENT_INDEX_NDJSON", "").split(",")):
+    _count = patient_index.add_all(read_patient_ndjson(_path))
+    app.logger.info(f"Indexed {_count} patients from {_path}")
+
+# --- Write-Behind Queue ---
+# With WRITE_BEHIND_QUEUE set to a SQLite file, create requests sent with
+# "Prefer: respond-async" (or all of them, with WRITE_BEHIND_ALL=1) are stored
+# locally and answered with 202 and a tracking id. A background flusher sends
+# them to the FHIR store in batch bundles; /api/writes/<id> reports the outcome.
+write_queue = WriteQueue(os.environ["WRITE_BEHIND_QUEUE"]) if os.environ.get("WRITE_BEHIND_QUEUE") else None
+
+def _after_queued_create(tenant, write, resource):
+    # Without an id (no location in the batch response) apply_create drops
+    # the patient's snapshot instead of patching it.
+    if write["patient_id"]:
+        _apply_create(tenant, write["patient_id"], resource)
+    if resource.get("resourceType") == "Patient" and resource.get("id"):
+        tenant.patient_index.add(resource)
+
+if write_queue is not None:
+    write_flusher = WriteBehindFlusher(
+        write_queue,
+        get_tenant=tenants.get,
+        batch_size=int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 100)),
+        interval=float(os.environ.get("WRITE_BEHIND_INTERVAL_MS", 200)) / 1000,
+        on_created=_after_queued_create,
+    )
+    write_flusher.start()
+    app.logger.info(f"Write-behind queue at {write_queue.path}: {write_queue.counts()}")
+
+def _write_behind():
+    """Whether the current create request should be queued instead of sent."""
+    if write_queue is None:
+        return False
+    return os.environ.get("WRITE_BEHIND_ALL") == "1" or "respond-async" in request.headers.get("Prefer", "")
+
+def _enqueue_create(resource, patient_id):
+    tracking_id = write_queue.enqueue(g.tenant.name, resource, patient_id)
+    app.logger.info(f"Queued {resource['resourceType']} for write-behind with tracking ID: {tracking_id}")
+    response = jsonify({"trackingId": tracking_id, "status": "queued", "resourceType": resource["resourceType"]})
+    response.headers["Location"] = f"/api/writes/{tracking_id}"
+    return response, 202
+
+# --- Background Prefetch ---
+# Warms the patient cache for upcoming patients during off-peak hours
+# (PREFETCH_WINDOW, e.g. "1-6"), pausing whenever interactive requests are in flight.
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+@app.before_request
+def _track_request_start():
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+
+@app.teardown_request
+def _track_request_end(exc):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+
+prefetcher = PrefetchScheduler(
+    patient_cache,
+    fetch_everything=default_tenant.fetch_everything,
+    rate_per_second=float(os.environ.get("PREFETCH_RATE", 2)),
+    ttl_seconds=float(os.environ.get("PREFETCH_TTL_SECONDS", 12 * 60 * 60)),
+    window=parse_window(os.environ.get("PREFETCH_WINDOW")),
+    is_busy=lambda: _in_flight > 0,
+)
+prefetcher.start()
+
+if os.environ.get("PREFETCH_MRN_FILE"):
+    queued = prefetcher.schedule(read_mrn_file(os.environ["PREFETCH_MRN_FILE"]))
+    app.logger.info(f"Scheduled {queued} patients for prefetch from {os.environ['PREFETCH_MRN_FILE']}")
+
+# --- Tenant Routing ---
+# Resolves the tenant of each request and admits it against that tenant's rate
+# limit and concurrency cap; over-limit requests get 429 without touching the
+# FHIR store, so one busy hospital cannot starve the others.
+@app.before_request
+def _resolve_tenant():
+    if request.endpoint == 'static':
+        return None
+    try:
+        tenant = tenants.get(request.headers.get('X-Tenant-ID') or request.args.get('tenant'))
+        tenant.admit()
+    except UnknownTenantError as e:
+        return jsonify({"error": str(e)}), 404
+    except TenantBusyError as e:
+        app.logger.warning(str(e))
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = str(max(1, round(e.retry_after)))
+        return response, 429
+    g.tenant = tenant
+    g.tenant_started = time.perf_counter()
+    return None
+
+@app.after_request
+def _record_tenant_status(response):
+    g.tenant_status = response.status_code
+    return response
+
+@app.teardown_request
+def _release_tenant(exc):
+    tenant = g.pop('tenant', None)
+    if tenant is None:
+        return
+    tenant.release()
+    tenant.release_client()
+    tenant.metrics.record(g.get('tenant_status', 500), (time.perf_counter() - g.tenant_started) * 1000)
+
+# --- Profiling ---
+# Opt-in with PROFILING=1. Every request then gets per-phase timings (auth,
+# upstream, parse, serialize, ...) in the request log and a Server-Timing
+# header. Requests sent with "X-Profile: 1" are stack-sampled; with
+# PROFILE_SLOW_MS set, all requests are sampled and those slower than the
+# threshold are kept. Collapsed stacks per route are served by /api/profiles.
+profiling_enabled = os.environ.get("PROFILING") == "1"
+profile_store = ProfileStore()
+profile_sampler = StackSampler(interval=float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", 10)) / 1000)
+profile_slow_ms = float(os.environ["PROFILE_SLOW_MS"]) if os.environ.get("PROFILE_SLOW_MS") else None
+
+if profiling_enabled:
+    @app.before_request
+    def _start_profile():
+        forced = request.headers.get("X-Profile") == "1"
+        begin_request(profile_sampler if forced or profile_slow_ms is not None else None)
+
+    @app.after_request
+    def _add_server_timing(response):
+        # Registered before compression, so this runs after it and sees its span.
+        profile = current_profile()
+        if profile is not None:
+            response.headers["Server-Timing"] = server_timing(dict(profile.spans, total=profile.elapsed_ms()))
+            profile.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        profile = end_request(profile_sampler)
+        if profile is None:
+            return
+        elapsed = profile.elapsed_ms()
+        route = request.url_rule.rule if request.url_rule else request.path
+        status = profile.status or 500
+        app.logger.info(f"{request.method} {request.path} {status} {elapsed:.1f}ms {format_spans(profile.spans)}")
+        forced = request.headers.get("X-Profile") == "1"
+        if profile.sampled and (forced or elapsed >= profile_slow_ms):
+            profile_store.add(route, profile, {
+                "route": route,
+                "path": request.path,
+                "method": request.method,
+                "status": status,
+                "duration_ms": round(elapsed, 1),
+                "spans": {name: round(ms, 1) for name, ms in profile.spans.items()},
+                "samples": sum(profile.samples.values()),
+                "forced": forced,
+            })
+
+# --- Response Compression ---
+# gzip, or brotli when the optional brotli package is installed, for JSON and
+# rendered HTML responses. Cached $everything bytes are compressed once per
+# encoding and reused. Set RESPONSE_COMPRESSION=0 to leave compression to a
+# fronting proxy.
+compression_enabled = os.environ.get("RESPONSE_COMPRESSION", "1") != "0"
+
+def _raw_everything_response(cache, patient_id, raw):
+    """Serves upstream $everything bytes, compressed from the cache when the client accepts it."""
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", "")) if compression_enabled else None
+    body = None
+    if encoding is not None and len(raw) >= MIN_COMPRESS_SIZE:
+        with span("compress"):
+            body = cache.get_encoded_raw(patient_id, encoding, compress_body)
+    if body is None:
+        return Response(raw, mimetype="application/json")
+    response = Response(body, mimetype="application/json")
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+if compression_enabled:
+    @app.after_request
+    def _compress_response(response):
+        with span("compress"):
+            return compress_response(response, request.headers.get("Accept-Encoding", ""))
+
 @app.route('/')
 def index():
     app.logger.info("Serving the 'Create Resource' page (index.html).")
@@ -72,15 +358,21 @@ def api_create_patient():
     data = request.get_json()
     app.logger.info(f"Received request to create patient with MRN: {data.get('mrn')}")
     try:
-        response = create_patient(
+        fields = dict(
             family_name=data['family_name'],
             given_name=data['given_name'],
             gender=data['gender'],
             birth_date=data['birth_date'],
             mrn=data['mrn'],
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name
         )
+        if _write_behind():
+            return _enqueue_create(build_patient(**fields), None)
+        response = create_patient(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
+        )
+        g.tenant.patient_index.add(response)
         app.logger.info(f"Successfully created Patient. New resource ID: {response.get('id')}")
         return jsonify(response)
     except Exception as e:
@@ -92,13 +384,19 @@ def api_create_encounter():
     data = request.get_json()
     app.logger.info(f"Received request to create encounter for Patient ID: {data.get('patient_id')}")
     try:
-        response = create_encounter(
+        fields = dict(
             patient_id=data['patient_id'],
             encounter_status=data['encounter_status'],
             encounter_text=data['encounter_text'],
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name
         )
+        if _write_behind():
+            return _enqueue_create(build_encounter(**fields), data['patient_id'])
+        response = create_encounter(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
+        )
+        _apply_create(g.tenant, data['patient_id'], response)
         app.logger.info(f"Successfully created Encounter. New resource ID: {response.get('id')}")
         return jsonify(response)
     except Exception as e:
@@ -111,17 +409,25 @@ def api_create_condition():
     try:
         # The onset_datetime should be in ISO 8601 format
         onset_datetime = datetime.now(gmt7_timezone).isoformat()
-        response = create_condition(
+        fields = dict(
             patient_id=data['patient_id'],
             clinical_status=data['clinical_status'],
             verification_status=data['verification_status'],
             snomed_code=data['snomed_code'],
-            condition_display=data['condition_display'],
+            condition_display=terminology.canonical_display('snomed', data['snomed_code'], data['condition_display']),
             onset_datetime=onset_datetime,
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name,
         )
+        if _write_behind():
+            return _enqueue_create(build_condition(**fields), data['patient_id'])
+        response = create_condition(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
+        )
+        _apply_create(g.tenant, data['patient_id'], response)
         return jsonify(response)
+    except TerminologyError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -130,19 +436,27 @@ def api_create_procedure():
     data = request.get_json()
     try:
         current_time_iso = datetime.now(gmt7_timezone).isoformat()
-        response = create_procedure(
+        fields = dict(
             patient_id=data['patient_id'],
             encounter_id=data['encounter_id'],
             procedure_status=data['procedure_status'],
             snomed_code=data['snomed_code'],
-            procedure_display=data['procedure_display'],
+            procedure_display=terminology.canonical_display('snomed', data['snomed_code'], data['procedure_display']),
             start_time=current_time_iso,
             end_time=current_time_iso, # Or handle separate end time
             reason_text=data['reason_text'],
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name
         )
+        if _write_behind():
+            return _enqueue_create(build_procedure(**fields), data['patient_id'])
+        response = create_procedure(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
+        )
+        _apply_create(g.tenant, data['patient_id'], response)
         return jsonify(response)
+    except TerminologyError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -150,12 +464,17 @@ def api_create_procedure():
 def api_create_practitioner():
     data = request.get_json()
     try:
-        response = create_practitioner(
+        fields = dict(
             npi=data['npi'],
             family_name=data['family_name'],
             given_name=data['given_name'],
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name
+        )
+        if _write_behind():
+            return _enqueue_create(build_practitioner(**fields), None)
+        response = create_practitioner(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
         )
         return jsonify(response)
     except Exception as e:
@@ -165,19 +484,27 @@ def api_create_practitioner():
 def api_create_medication_request():
     data = request.get_json()
     try:
-        response = create_medication_request(
+        fields = dict(
             patient_id=data['patient_id'],
             practitioner_id=data['practitioner_id'],
             medication_status=data['medication_status'],
             medication_intent=data['medication_intent'],
             rxnorm_code=data['rxnorm_code'],
-            medication_display=data['medication_display'],
+            medication_display=terminology.canonical_display('rxnorm', data['rxnorm_code'], data['medication_display']),
             practitioner_display=data['practitioner_display'],
             dosage_text=data['dosage_text'],
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name
         )
+        if _write_behind():
+            return _enqueue_create(build_medication_request(**fields), data['patient_id'])
+        response = create_medication_request(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
+        )
+        _apply_create(g.tenant, data['patient_id'], response)
         return jsonify(response)
+    except TerminologyError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -185,18 +512,26 @@ def api_create_medication_request():
 def api_create_diagnostic_report():
     data = request.get_json()
     try:
-        response = create_diagnostic_report(
+        fields = dict(
             patient_id=data['patient_id'],
             encounter_id=data['encounter_id'],
             practitioner_id=data['practitioner_id'],
             report_status=data['report_status'],
             loinc_code=data['loinc_code'],
-            report_display=data['report_display'],
+            report_display=terminology.canonical_display('loinc', data['loinc_code'], data['report_display']),
             conclusion=data['conclusion'],
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name
         )
+        if _write_behind():
+            return _enqueue_create(build_diagnostic_report(**fields), data['patient_id'])
+        response = create_diagnostic_report(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
+        )
+        _apply_create(g.tenant, data['patient_id'], response)
         return jsonify(response)
+    except TerminologyError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -205,56 +540,108 @@ def api_create_observation():
     data = request.get_json()
     try:
         current_time_iso = datetime.now(gmt7_timezone).isoformat()
-        response = create_observation(
+        fields = dict(
             patient_id=data['patient_id'],
             encounter_id=data['encounter_id'],
             observation_status=data['observation_status'],
             loinc_code=data['loinc_code'],
-            observation_display=data['observation_display'],
+            observation_display=terminology.canonical_display('loinc', data['loinc_code'], data['observation_display']),
             observation_value=float(data['observation_value']),
             observation_unit=data['observation_unit'],
-            healthcare_client=healthcare_client,
-            fhir_store_name=fhir_store_name,
-            current_time=current_time_iso
+            current_time=current_time_iso,
+        )
+        if _write_behind():
+            return _enqueue_create(build_observation(**fields), data['patient_id'])
+        response = create_observation(
+            **fields,
+            healthcare_client=g.tenant.client,
+            fhir_store_name=g.tenant.fhir_store_name
         )
+        _apply_create(g.tenant, data['patient_id'], response)
         return jsonify(response)
+    except TerminologyError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/search/patient/mrn/<mrn>', methods=['GET'])
 def api_search_patient_by_mrn(mrn):
-    """API endpoint to search for a patient by their MRN."""
+    """
+    API endpoint to search for a patient by their MRN.
+
+    Supports FHIR _elements/_summary passthrough and a server-side fields= projection.
+    """
     app.logger.info(f"Received request to search for patient by MRN: {mrn}")
     try:
         bundle = search_patient_by_mrn(
-            project_id=project_id,
-            location=location,
-            dataset_id=dataset_id,
-            fhir_store_id=fhir_store_id,
-            mrn=mrn
+            **g.tenant.store_args(),
+            mrn=mrn,
+            params=upstream_params(request.args),
+            session=g.tenant.session
         )
         app.logger.info(f"Search for MRN {mrn} returned {bundle.get('total', 0)} results.")
-        return jsonify(bundle)
+        return jsonify(project_bundle(bundle, parse_fields(request.args.get('fields'))))
     except Exception as e:
         app.logger.exception(f"Error occurred during patient search for MRN: {mrn}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/search/patient', methods=['GET'])
+def api_search_patient_index():
+    """
+    API endpoint for front-desk patient search from the local index.
+
+    q may mix MRN, family/given name (prefix, phonetic or one typo) and birth
+    date, e.g. ?q=smith jo 1970-01. Optional gender= and limit=.
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = int(request.args.get('limit', 20))
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = min(limit, 100)
+    results = g.tenant.patient_index.search(query, gender=request.args.get('gender'), limit=limit)
+    app.logger.info(f"Patient index search for {query!r} returned {len(results)} results.")
+    return jsonify({"total": len(results), "results": results})
+
 @app.route('/api/patient/everything/mrn/<mrn>', methods=['GET'])
 def api_get_patient_everything_by_mrn(mrn):
     """
     API endpoint to find a patient by MRN and get all their related data.
+
+    _elements/_summary are passed through to the FHIR store (and bypass the
+    cache, since the result is partial). fields= trims the resources server-side,
+    e.g. ?fields=code,status,subject,Observation.valueQuantity.
     """
     app.logger.info(f"Received request to get all records for patient with MRN: {mrn}")
     try:
-        bundle = get_patient_everything_by_mrn(
-            project_id=project_id,
-            location=location,
-            dataset_id=dataset_id,
-            fhir_store_id=fhir_store_id,
-            mrn=mrn
-        )
+        fields = parse_fields(request.args.get('fields'))
+        params = upstream_params(request.args)
+        if params:
+            bundle = g.tenant.fetch_everything(mrn, params=params)
+            return jsonify(project_bundle(bundle, fields))
+
+        patient_id = g.tenant.cache.patient_id_for_mrn(mrn)
+        bundle = g.tenant.cache.get("everything", patient_id)
+        if g.tenant is tenants.default:
+            prefetcher.record_request(mrn, hit=bundle is not None)
+        if bundle is not None:
+            app.logger.info(f"Serving cached $everything bundle for MRN: {mrn}")
+            raw = None if fields else g.tenant.cache.get("everything_raw", patient_id)
+            if raw is not None:
+                return _raw_everything_response(g.tenant.cache, patient_id, raw)
+            return jsonify(project_bundle(bundle, fields))
+
+        # Without a projection the upstream bytes are sent back unchanged.
+        raw = g.tenant.fetch_everything(mrn, raw=True)
+        with span("parse"):
+            bundle = loads(raw)
+        patient_id = g.tenant.cache.store_bundle(mrn, bundle, raw=raw)
         app.logger.info(f"Successfully retrieved $everything bundle for MRN: {mrn}. Total resources: {bundle.get('total', 0)}")
-        return jsonify(bundle)
+        if fields:
+            return jsonify(project_bundle(bundle, fields))
+        return _raw_everything_response(g.tenant.cache, patient_id, raw)
     except Exception as e:
         # Custom error handling for "not found"
         if "No patient found" in str(e):
@@ -262,7 +649,229 @@ def api_get_patient_everything_by_mrn(mrn):
              return jsonify({"error": str(e)}), 404
         app.logger.exception(f"Error occurred during $everything operation for MRN: {mrn}")
         return jsonify({"error": str(e)}), 500
-                    
+
+@app.route('/api/patient/timeline/mrn/<mrn>', methods=['GET'])
+def api_get_patient_timeline_by_mrn(mrn):
+    """API endpoint to get a patient's records as a date-ordered timeline."""
+    app.logger.info(f"Received request to get timeline for patient with MRN: {mrn}")
+    try:
+        timeline = g.tenant.cache.get("timeline", g.tenant.cache.patient_id_for_mrn(mrn))
+        if timeline is None:
+            g.tenant.load_everything(mrn)
+            timeline = g.tenant.cache.get("timeline", g.tenant.cache.patient_id_for_mrn(mrn)) or []
+        return jsonify({"mrn": mrn, "timeline": timeline})
+    except Exception as e:
+        if "No patient found" in str(e):
+             app.logger.warning(f"Could not find patient for timeline with MRN: {mrn}")
+             return jsonify({"error": str(e)}), 404
+        app.logger.exception(f"Error occurred while building timeline for MRN: {mrn}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patient/<mrn>/snapshot', methods=['GET'])
+def api_get_patient_snapshot(mrn):
+    """
+    API endpoint for a patient's current clinical state: active conditions,
+    active medications, latest vitals and recent reports.
+
+    The snapshot is cached per patient and kept current as resources are
+    created, so a hit is a single lookup. ?refresh=1 rebuilds it from a fresh
+    $everything read.
+    """
+    app.logger.info(f"Received request to get snapshot for patient with MRN: {mrn}")
+    try:
+        cache = g.tenant.cache
+        if request.args.get('refresh') == '1':
+            cache.evict_patient(cache.patient_id_for_mrn(mrn))
+        snapshot = cache.get("snapshot", cache.patient_id_for_mrn(mrn))
+        if snapshot is None:
+            bundle = g.tenant.load_everything(mrn)
+            snapshot = cache.get("snapshot", cache.patient_id_for_mrn(mrn))
+            patient_id = cache.patient_id_for_mrn(mrn)
+            if snapshot is None and patient_id:
+                # The bundle was still cached but its snapshot had been evicted.
+                snapshot = build_snapshot(bundle, patient_id)
+                cache.set("snapshot", patient_id, snapshot, cache.snapshot_ttl_seconds)
+        return jsonify({"mrn": mrn, "snapshot": snapshot})
+    except Exception as e:
+        if "No patient found" in str(e):
+             app.logger.warning(f"Could not find patient for snapshot with MRN: {mrn}")
+             return jsonify({"error": str(e)}), 404
+        app.logger.exception(f"Error occurred while building snapshot for MRN: {mrn}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patch', methods=['POST'])
+def api_patch_resources():
+    """
+    API endpoint to patch many resources in batched round trips.
+
+    Accepts {"resources": [{"resourceType", "id", "patch" or "fields", "versionId"}]}.
+    "patch" is a JSON Patch list, "fields" a partial update such as
+    {"status": "inactive"}. With "versionId" the write only succeeds if the
+    resource is still at that version.
+    """
+    data = request.get_json()
+    try:
+        targets = []
+        for item in data['resources']:
+            patch = item['patch'] if 'patch' in item else partial_update_to_patch(item['fields'])
+            targets.append({
+                "resourceType": item['resourceType'],
+                "id": item['id'],
+                "patch": patch,
+                "versionId": item.get('versionId'),
+            })
+        results = patch_resources(g.tenant.client, g.tenant.fhir_store_name, targets)
+        for target in targets:
+            patient_id = g.tenant.cache.patient_id_for_reference(target['resourceType'], target['id'])
+            if patient_id:
+                g.tenant.cache.evict_patient(patient_id)
+        app.logger.info(f"Patched {len(targets)} resources in bulk.")
+        return jsonify({"results": results})
+    except Exception as e:
+        app.logger.exception("Error occurred during bulk patch.")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/patient/<mrn>/patch', methods=['POST'])
+def api_patch_patient_records(mrn):
+    """
+    API endpoint to apply one change to every record of a patient.
+
+    Accepts {"patch" or "fields", "resourceTypes": [...]}, e.g.
+    {"fields": {"status": "entered-in-error"}, "resourceTypes": ["Observation"]}.
+    Without resourceTypes only records that already have every patched
+    top-level element are changed. Each resource is written with If-Match on
+    the version last read.
+    """
+    data = request.get_json()
+    app.logger.info(f"Received request to patch records of patient with MRN: {mrn}")
+    try:
+        patch = data['patch'] if 'patch' in data else partial_update_to_patch(data['fields'])
+        bundle = g.tenant.load_everything(mrn)
+        targets = compartment_targets(bundle, patch, data.get('resourceTypes'))
+        results = patch_resources(g.tenant.client, g.tenant.fhir_store_name, targets)
+        g.tenant.cache.evict_patient(g.tenant.cache.patient_id_for_mrn(mrn))
+        conflicts = sum(result['status'].startswith('412') for result in results)
+        app.logger.info(f"Patched {len(targets)} records for MRN {mrn}, {conflicts} version conflicts.")
+        return jsonify({"results": results, "conflicts": conflicts})
+    except Exception as e:
+        if "No patient found" in str(e):
+             app.logger.warning(f"Could not find patient to patch with MRN: {mrn}")
+             return jsonify({"error": str(e)}), 404
+        app.logger.exception(f"Error occurred while patching records for MRN: {mrn}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/terminology/<system>/search', methods=['GET'])
+def api_search_terminology(system):
+    """API endpoint for code typeahead, e.g. /api/terminology/loinc/search?q=heart+ra"""
+    try:
+        limit = int(request.args.get('limit', 10))
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = min(limit, 100)
+    try:
+        return jsonify(terminology.search(system, request.args.get('q', ''), limit))
+    except TerminologyError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.route('/api/terminology/<system>/<code>', methods=['GET'])
+def api_lookup_terminology(system, code):
+    """API endpoint to validate a code and get its canonical display."""
+    if system not in terminology.systems:
+        return jsonify({"error": f"Code system {system} is not loaded"}), 404
+    display = terminology.systems[system].display(code)
+    if display is None:
+        return jsonify({"error": f"Unknown {system} code: {code}"}), 404
+    return jsonify({"system": terminology.systems[system].system, "code": code, "display": display})
+
+@app.route('/api/tenants', methods=['GET'])
+def api_tenants():
+    """API endpoint to report each tenant's store, limits, metrics and cache counters."""
+    return jsonify({tenant.name: tenant.describe() for tenant in tenants})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def api_cache_stats():
+    """API endpoint to report patient cache and invalidation counters."""
+    stats = g.tenant.cache.stats()
+    handler = invalidation_handlers[g.tenant.name]
+    stats["notifications_processed"] = handler.processed
+    stats["notifications_unmapped"] = handler.unmapped
+    stats["notification_feed_errors"] = handler.feed_errors
+    return jsonify(stats)
+
+@app.route('/api/prefetch', methods=['POST'])
+def api_schedule_prefetch():
+    """
+    API endpoint to queue patients for background prefetch.
+
+    Accepts {"mrns": [...]} or {"date": "YYYY-MM-DD"} to prefetch that day's
+    encounter census. Prefetch runs for the default tenant only.
+    """
+    if g.tenant is not tenants.default:
+        return jsonify({"error": "Prefetch is only available for the default tenant."}), 400
+    data = request.get_json()
+    try:
+        if data.get('date'):
+            mrns = search_scheduled_patient_mrns(
+                **g.tenant.store_args(),
+                date=data['date'],
+                session=g.tenant.session,
+            )
+        else:
+            mrns = data['mrns']
+        queued = prefetcher.schedule(mrns)
+        app.logger.info(f"Scheduled {queued} of {len(mrns)} patients for prefetch.")
+        return jsonify({"queued": queued, "requested": len(mrns)}), 202
+    except Exception as e:
+        app.logger.exception("Error occurred while scheduling prefetch.")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/prefetch', methods=['GET'])
+def api_prefetch_report():
+    """API endpoint to report prefetch progress and the warm-hit ratio."""
+    return jsonify(prefetcher.report())
+
+@app.route('/api/profiles', methods=['GET'])
+def api_profiles():
+    """API endpoint listing profiled routes and the most recent profiled requests."""
+    return jsonify(dict(profile_store.summary(), enabled=profiling_enabled, slow_ms=profile_slow_ms))
+
+@app.route('/api/profiles/collapsed', methods=['GET'])
+def api_profile_collapsed():
+    """
+    API endpoint returning a route's collapsed stacks for flamegraph.pl or
+    speedscope, e.g. ?route=/api/patient/everything/mrn/<mrn>.
+    """
+    collapsed = profile_store.collapsed(request.args.get('route', ''))
+    if not collapsed:
+        return jsonify({"error": "No profile for this route."}), 404
+    return Response(collapsed, mimetype="text/plain")
+
+@app.route('/api/profiles', methods=['DELETE'])
+def api_clear_profiles():
+    """API endpoint discarding collected profiles."""
+    profile_store.clear()
+    return jsonify({"cleared": True})
+
+@app.route('/api/writes/<tracking_id>', methods=['GET'])
+def api_write_status(tracking_id):
+    """
+    API endpoint to get the outcome of a queued create: "queued", "sending",
+    "created" (with the new resource id) or "failed" (with the error).
+    """
+    status = write_queue.status(tracking_id) if write_queue is not None else None
+    if status is None or status["tenant"] != g.tenant.name:
+        return jsonify({"error": f"No queued write with tracking ID: {tracking_id}"}), 404
+    return jsonify(status)
+
+@app.route('/api/writes', methods=['GET'])
+def api_write_queue_stats():
+    """API endpoint to count the current tenant's queued writes by status."""
+    if write_queue is None:
+        return jsonify({"error": "Write-behind is not enabled."}), 404
+    return jsonify(write_queue.counts(g.tenant.name))
+
 # --- Main Execution ---
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
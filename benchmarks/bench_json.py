@@ -0,0 +1,46 @@
+"""
+Compares JSON encode/decode paths for a large $everything bundle: the stdlib
+json module as jsonify uses it (sorted keys), compact stdlib, orjson through
+script.jsonio, and forwarding the upstream bytes untouched.
+
+Usage: python benchmarks/bench_json.py [number_of_observations]
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_payload import synthetic_bundle, timed
+from script import jsonio
+
+
+def main():
+    observations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bundle = synthetic_bundle(observations)
+    upstream = json.dumps(bundle).encode("utf-8")
+
+    print(f"Bundle with {observations + 1} resources, {len(upstream):,} bytes")
+    print(f"{'path':<36}{'encode ms':>12}{'decode ms':>12}")
+
+    _, encode_ms = timed(lambda: json.dumps(bundle, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    _, decode_ms = timed(lambda: json.loads(upstream))
+    print(f"{'stdlib json (jsonify defaults)':<36}{encode_ms:>12.1f}{decode_ms:>12.1f}")
+
+    _, encode_ms = timed(lambda: json.dumps(bundle, separators=(",", ":")).encode("utf-8"))
+    print(f"{'stdlib json, unsorted':<36}{encode_ms:>12.1f}{decode_ms:>12.1f}")
+
+    if jsonio.orjson is not None:
+        _, encode_ms = timed(lambda: jsonio.dumps_bytes(bundle))
+        _, decode_ms = timed(lambda: jsonio.loads(upstream))
+        print(f"{'orjson (script.jsonio)':<36}{encode_ms:>12.1f}{decode_ms:>12.1f}")
+    else:
+        print("orjson is not installed, skipping")
+
+    _, passthrough_ms = timed(lambda: bytes(memoryview(upstream)))
+    print(f"{'upstream bytes passed through':<36}{passthrough_ms:>12.1f}{'-':>12}")
+
+
+if __name__ == "__main__":
+    main()
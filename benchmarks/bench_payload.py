@@ -0,0 +1,91 @@
+"""
+Measures bytes on the wire and serialization time for a large $everything bundle,
+before and after fields= projection and gzip/brotli compression.
+
+Usage: python benchmarks/bench_payload.py [number_of_observations]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from script.payload import brotli, compress_body, parse_fields, project_bundle
+
+# The elements find.js renders (see EVERYTHING_FIELDS there).
+FIND_PAGE_FIELDS = (
+    "name,identifier,gender,birthDate,status,intent,code,reasonCode,clinicalStatus,"
+    "onsetDateTime,valueQuantity,valueCodeableConcept,effectiveDateTime,performedPeriod,"
+    "medicationCodeableConcept,authoredOn,dosageInstruction,requester,issued,conclusion"
+)
+
+
+def synthetic_bundle(observations: int) -> dict:
+    """An $everything-shaped bundle with meta, narrative and codings on every resource."""
+    entries = [{
+        "fullUrl": "https://healthcare.googleapis.com/v1/.../fhir/Patient/p1",
+        "resource": {
+            "resourceType": "Patient",
+            "id": "p1",
+            "meta": {"lastUpdated": "2024-05-01T08:00:00+07:00", "versionId": "MTcxNDUyNjQwMDAwMDAwMDAwMA"},
+            "text": {"status": "generated", "div": "<div xmlns=\"http://www.w3.org/1999/xhtml\">Jane Doe</div>"},
+            "name": [{"use": "official", "family": "Doe", "given": ["Jane"]}],
+            "gender": "female",
+            "birthDate": "1970-01-01",
+            "identifier": [{"use": "usual", "system": "urn:oid:1.2.36.146.595.217.0.1", "value": "MRN-1",
+                            "type": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/v2-0203", "code": "MR", "display": "Medical Record Number"}]}}],
+        },
+    }]
+    for i in range(observations):
+        entries.append({
+            "fullUrl": f"https://healthcare.googleapis.com/v1/.../fhir/Observation/o{i}",
+            "resource": {
+                "resourceType": "Observation",
+                "id": f"o{i}",
+                "meta": {"lastUpdated": "2024-05-01T08:00:00+07:00", "versionId": f"MTcxNDUyNjQwMDAwMDAw{i:06d}"},
+                "text": {"status": "generated", "div": f"<div xmlns=\"http://www.w3.org/1999/xhtml\">Heart rate {60 + i % 40} /min</div>"},
+                "status": "final",
+                "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/observation-category", "code": "vital-signs", "display": "Vital Signs"}]}],
+                "code": {"coding": [{"system": "http://loinc.org", "code": "8867-4", "display": "Heart rate"}], "text": "Heart rate"},
+                "subject": {"reference": "Patient/p1"},
+                "encounter": {"reference": "Encounter/e1"},
+                "effectiveDateTime": f"2024-05-01T{i % 24:02d}:00:00+07:00",
+                "valueQuantity": {"value": 60 + i % 40, "unit": "/min", "system": "http://unitsofmeasure.org", "code": "/min"},
+            },
+        })
+    return {"resourceType": "Bundle", "type": "searchset", "total": len(entries), "entry": entries}
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return result, best * 1000
+
+
+def main():
+    observations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bundle = synthetic_bundle(observations)
+    fields = parse_fields(FIND_PAGE_FIELDS)
+
+    print(f"Bundle with {observations + 1} resources")
+    print(f"{'variant':<28}{'bytes':>12}{'ms':>10}")
+    for label, source in (("full", bundle), ("fields=find page", None)):
+        if source is None:
+            source, project_ms = timed(lambda: project_bundle(bundle, fields))
+            print(f"{'  projection':<28}{'':>12}{project_ms:>10.1f}")
+        body, ms = timed(lambda: json.dumps(source, separators=(",", ":")).encode("utf-8"))
+        print(f"{label + ' json':<28}{len(body):>12,}{ms:>10.1f}")
+        for encoding in ("gzip", "br"):
+            if encoding == "br" and brotli is None:
+                continue
+            compressed, ms = timed(lambda: compress_body(body, encoding))
+            print(f"{label + ' ' + encoding:<28}{len(compressed):>12,}{ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Load time, memory and lookup latency of the terminology index on a synthetic
+code system roughly the size of SNOMED CT's active concepts.
+
+Usage: python benchmarks/bench_terminology.py [number_of_concepts]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from script.terminology import CodeSystemIndex
+
+WORDS = (
+    "acute chronic left right upper lower lobe pneumonia fracture of femur tibia heart rate blood pressure "
+    "systolic diastolic glucose serum plasma hemoglobin a1c kidney renal failure disease diabetes mellitus "
+    "type hypertension essential asthma bronchitis infection bacterial viral tablet oral mg injection "
+    "solution insulin metformin amoxicillin lisinopril atorvastatin structure finding procedure biopsy"
+).split()
+
+
+def synthetic_concepts(count, seed=7):
+    """Concepts whose words follow a Zipf-like distribution over a ~30k word vocabulary."""
+    rng = random.Random(seed)
+    syllables = ["ab", "cor", "der", "em", "fi", "gas", "hep", "ir", "lym", "mo", "neu", "os", "pul", "ren", "sto", "tri", "ul", "vas"]
+    vocabulary = list(WORDS) + [
+        "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) + str(n) for n in range(30000)
+    ]
+    cum_weights = []
+    total = 0.0
+    for rank in range(len(vocabulary)):
+        total += 1.0 / (rank + 1)
+        cum_weights.append(total)
+    for number in range(count):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(2, 7))
+        yield str(100000 + number * 7), " ".join(words).capitalize()
+
+
+def latency_us(func, args_list):
+    """Returns (median, p95) latency in microseconds over the calls."""
+    timings = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 350000
+    concepts = list(synthetic_concepts(count))
+
+    started = time.perf_counter()
+    index = CodeSystemIndex("snomed", concepts)
+    load_s = time.perf_counter() - started
+    # Measured on a second build, since tracing slows the build down.
+    tracemalloc.start()
+    index = CodeSystemIndex("snomed", concepts)
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+    print(f"{count:,} concepts: built in {load_s:.2f}s, {memory_mb:.0f} MB (including the concept strings)")
+
+    rng = random.Random(1)
+    codes = [(rng.choice(index.codes),) for _ in range(10000)]
+    print(f"{'':<24}{'p50 us':>10}{'p95 us':>10}")
+    print("{:<24}{:>10.1f}{:>10.1f}".format("validate code", *latency_us(index.display, codes)))
+
+    # Typeahead as typed: two-word prefixes taken from real displays.
+    queries = []
+    for _ in range(2000):
+        words = rng.choice(index.displays).lower().split()
+        queries.append((" ".join(w[:rng.randint(2, 5)] for w in words[:2]), 10))
+    print("{:<24}{:>10.1f}{:>10.1f}".format("2-word prefix search", *latency_us(index.search, queries)))
+    single = [(rng.choice(index.displays).split()[0][:3], 10) for _ in range(2000)]
+    print("{:<24}{:>10.1f}{:>10.1f}".format("1-word prefix search", *latency_us(index.search, single)))
+    code_prefix = [(code[:4], 10) for (code,) in codes[:2000]]
+    print("{:<24}{:>10.1f}{:>10.1f}".format("code prefix search", *latency_us(index.search, code_prefix)))
+
+    started = time.perf_counter()
+    index.search("pnuemonia acute", 10)
+    print(f"first typo correction builds the trigram index: {(time.perf_counter() - started) * 1000:.0f} ms")
+    typos = [("hemoglobn", 10), ("diabetis mellitus", 10), ("amoxicilin", 10)] * 100
+    print("{:<24}{:>10.1f}{:>10.1f}".format("typo-corrected search", *latency_us(index.search, typos)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+A local, in-memory stand-in for the Cloud Healthcare API FHIR endpoints the
+app uses, for load tests and benchmarks without a real FHIR store.
+
+Supported: create, read, Patient search by identifier, Patient $everything
+(with paging), and batch bundles of POST/DELETE/PATCH entries. Every request
+can be delayed by a fixed latency to approximate the real upstream.
+
+Usage: python benchmarks/fhir_standin.py --port 8089 --patients 500 --latency-ms 40
+Then run the app with HEALTHCARE_API_ENDPOINT=http://127.0.0.1:8089 HEALTHCARE_API_ANONYMOUS=1.
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from script.cache import get_mrn, patient_id_for_resource
+from synthetic_data import ChartSizes, MRN_SYSTEM, iter_resources
+
+_FHIR_PATH = re.compile(r"^/v1/(?P<store>projects/[^/]+/locations/[^/]+/datasets/[^/]+/fhirStores/[^/]+)/fhir(?P<rest>/.*)?$")
+PAGE_SIZE = 100
+
+
+class FhirStore:
+    """Thread-safe in-memory FHIR resources, indexed by patient compartment and MRN."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.resources = {}
+        self.compartments = {}
+        self.patients_by_mrn = {}
+
+    def create(self, resource):
+        with self._lock:
+            resource = dict(resource)
+            resource["id"] = resource.get("id") or f"{next(self._ids):012x}"
+            resource["meta"] = {"versionId": "1", "lastUpdated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+            key = (resource["resourceType"], resource["id"])
+            self.resources[key] = resource
+            patient_id = patient_id_for_resource(resource)
+            if patient_id:
+                self.compartments.setdefault(patient_id, []).append(key)
+            if resource["resourceType"] == "Patient":
+                for identifier in resource.get("identifier", []):
+                    if identifier.get("system") == MRN_SYSTEM:
+                        self.patients_by_mrn[identifier["value"]] = resource["id"]
+            return resource
+
+    def read(self, resource_type, resource_id):
+        return self.resources.get((resource_type, resource_id))
+
+    def delete(self, resource_type, resource_id):
+        with self._lock:
+            return self.resources.pop((resource_type, resource_id), None) is not None
+
+    def patch(self, resource_type, resource_id, operations):
+        with self._lock:
+            resource = self.resources.get((resource_type, resource_id))
+            if resource is None:
+                return None
+            for operation in operations:
+                # Top-level add/replace/remove is all the app sends.
+                key = operation["path"].lstrip("/").split("/")[0]
+                if operation["op"] in ("add", "replace"):
+                    resource[key] = operation["value"]
+                elif operation["op"] == "remove":
+                    resource.pop(key, None)
+            resource["meta"] = dict(resource["meta"], versionId=str(int(resource["meta"]["versionId"]) + 1))
+            return resource
+
+    def everything(self, patient_id):
+        with self._lock:
+            keys = list(self.compartments.get(patient_id, []))
+        return [self.resources[key] for key in keys if key in self.resources]
+
+
+def searchset(resources, next_url=None):
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": len(resources),
+        "entry": [{"resource": resource} for resource in resources],
+    }
+    if next_url:
+        bundle["link"] = [{"relation": "next", "url": next_url}]
+    return bundle
+
+
+def _entry_response(status, resource):
+    version = resource["meta"]["versionId"]
+    return {
+        "status": status,
+        "location": f"{resource['resourceType']}/{resource['id']}/_history/{version}",
+        "etag": f'W/"{version}"',
+        "lastModified": resource["meta"]["lastUpdated"],
+    }
+
+
+def make_handler(store, latency_s):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/fhir+json;charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length)) if length else None
+
+        def _route(self):
+            if latency_s:
+                time.sleep(latency_s)
+            url = urlparse(self.path)
+            match = _FHIR_PATH.match(url.path)
+            if not match:
+                return None, None, None
+            rest = (match.group("rest") or "").strip("/")
+            return url, rest.split("/") if rest else [], parse_qs(url.query)
+
+        def do_GET(self):
+            url, parts, query = self._route()
+            if url is None:
+                return self._send(404, {"error": "not a FHIR path"})
+            if parts == ["Patient"] and "identifier" in query:
+                mrn = query["identifier"][0].split("|")[-1]
+                patient_id = store.patients_by_mrn.get(mrn)
+                patient = store.read("Patient", patient_id) if patient_id else None
+                return self._send(200, searchset([patient] if patient else []))
+            if len(parts) == 3 and parts[0] == "Patient" and parts[2] == "$everything":
+                resources = store.everything(parts[1])
+                if not resources:
+                    return self._send(404, {"issue": [{"diagnostics": "patient not found"}]})
+                offset = int(query.get("_page_token", ["0"])[0])
+                page = resources[offset:offset + PAGE_SIZE]
+                next_url = None
+                if offset + PAGE_SIZE < len(resources):
+                    next_url = f"http://{self.headers['Host']}{url.path}?_page_token={offset + PAGE_SIZE}"
+                return self._send(200, searchset(page, next_url))
+            if len(parts) == 2:
+                resource = store.read(*parts)
+                return self._send(200, resource) if resource else self._send(404, {"error": "not found"})
+            return self._send(501, {"error": f"unsupported GET {self.path}"})
+
+        def do_POST(self):
+            url, parts, _ = self._route()
+            if url is None:
+                return self._send(404, {"error": "not a FHIR path"})
+            body = self._body()
+            if len(parts) == 1:
+                return self._send(201, store.create(dict(body, resourceType=parts[0])))
+            if not parts and body.get("resourceType") == "Bundle":
+                return self._send(200, self._execute_bundle(body))
+            return self._send(501, {"error": f"unsupported POST {self.path}"})
+
+        def do_DELETE(self):
+            url, parts, _ = self._route()
+            if url is None or len(parts) != 2:
+                return self._send(501, {"error": f"unsupported DELETE {self.path}"})
+            store.delete(*parts)
+            return self._send(200, {})
+
+        def _execute_bundle(self, bundle):
+            # Like the real API, batch responses report each new location and
+            # version but do not echo the resources.
+            entries = []
+            for entry in bundle.get("entry", []):
+                request = entry["request"]
+                method, target = request["method"], request["url"].split("/")
+                if method == "POST":
+                    resource = store.create(entry["resource"])
+                    entries.append({"response": _entry_response("201 Created", resource)})
+                elif method == "DELETE":
+                    store.delete(*target)
+                    entries.append({"response": {"status": "200 OK"}})
+                elif method == "PATCH":
+                    current = store.read(*target)
+                    expected = request.get("ifMatch")
+                    if current and expected and expected != f'W/"{current["meta"]["versionId"]}"':
+                        entries.append({"response": {"status": "412 Precondition Failed"}})
+                        continue
+                    patch = json.loads(base64.b64decode(entry["resource"]["data"]))
+                    resource = store.patch(*target, patch)
+                    if resource is None:
+                        entries.append({"response": {"status": "404 Not Found"}})
+                        continue
+                    entries.append({"response": _entry_response("200 OK", resource)})
+                else:
+                    entries.append({"response": {"status": "501 Not Implemented"}})
+            return {"resourceType": "Bundle", "type": "batch-response", "entry": entries}
+
+    return Handler
+
+
+def seed(store, patients, observations_per_patient=40, encounters_per_patient=3, seed_value=42):
+    """
+    Fills the store with synthetic patient charts from synthetic_data.
+
+    The per-patient counts are medians; a few ICU patients get far more
+    observations, as in production.
+
+    Returns:
+        A list of {"mrn", "patient_id", "encounter_id"} dicts for load tests.
+    """
+    sizes = ChartSizes(
+        encounters_median=encounters_per_patient,
+        observations_per_encounter_median=max(1, observations_per_patient / encounters_per_patient),
+    )
+    seeds = []
+    for resource in iter_resources(patients, seed_value, sizes):
+        store.create(resource)
+        if resource["resourceType"] == "Patient":
+            seeds.append({"mrn": get_mrn(resource), "patient_id": resource["id"], "encounter_id": None})
+        elif resource["resourceType"] == "Encounter":
+            seeds[-1]["encounter_id"] = resource["id"]
+    return seeds
+
+
+def start_standin(port=0, latency_ms=0.0, store=None):
+    """Starts the stand-in on a daemon thread. Returns (server, store)."""
+    store = store or FhirStore()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(store, latency_ms / 1000.0))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fhir-standin", daemon=True).start()
+    return server, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local FHIR store stand-in.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--observations", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, store = start_standin(args.port, args.latency_ms)
+    seeds = seed(store, args.patients, args.observations)
+    print(f"Serving {len(store.resources)} resources for {len(seeds)} patients on http://127.0.0.1:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
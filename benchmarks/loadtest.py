@@ -0,0 +1,282 @@
+"""
+Load generator for the app with a configurable clinical traffic mix and
+regression gates against a stored baseline.
+
+By default it starts the FHIR stand-in and the app in-process, seeds synthetic
+patients, and replays the mix with N concurrent clinicians for a fixed time:
+
+    python benchmarks/loadtest.py --concurrency 32 --duration 30
+    python benchmarks/loadtest.py --save-baseline benchmarks/loadtest_baseline.json
+    python benchmarks/loadtest.py --baseline benchmarks/loadtest_baseline.json   # exits 1 on regression
+
+With --target the mix runs against an already running deployment instead;
+patients are then seeded through the app's own create endpoints.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fhir_standin import seed, start_standin
+
+# Relative weights of each scenario; override with --mix '{"everything": 50, ...}'.
+DEFAULT_MIX = {
+    "everything": 25,
+    "search_mrn": 20,
+    "timeline": 10,
+    "create_observation": 25,
+    "create_encounter": 10,
+    "create_patient": 5,
+    "patient_index_search": 5,
+}
+
+
+def scenario_request(name, rng, seeds):
+    """Returns (method, path, json_body) for one request of a scenario."""
+    patient = rng.choice(seeds)
+    if name == "everything":
+        return "GET", f"/api/patient/everything/mrn/{patient['mrn']}", None
+    if name == "search_mrn":
+        return "GET", f"/api/search/patient/mrn/{patient['mrn']}", None
+    if name == "timeline":
+        return "GET", f"/api/patient/timeline/mrn/{patient['mrn']}", None
+    if name == "patient_index_search":
+        return "GET", f"/api/search/patient?q=load{rng.randint(0, len(seeds))}", None
+    if name == "create_observation":
+        return "POST", "/api/observation", {
+            "patient_id": patient["patient_id"],
+            "encounter_id": patient["encounter_id"],
+            "observation_status": "final",
+            "loinc_code": "8867-4",
+            "observation_display": "Heart rate",
+            "observation_value": str(rng.randint(50, 120)),
+            "observation_unit": "/min",
+        }
+    if name == "create_encounter":
+        return "POST", "/api/encounter", {
+            "patient_id": patient["patient_id"],
+            "encounter_status": "in-progress",
+            "encounter_text": "Ward round",
+        }
+    if name == "create_patient":
+        return "POST", "/api/patient", {
+            "family_name": "Load",
+            "given_name": "New",
+            "gender": "female",
+            "birth_date": "1980-01-01",
+            "mrn": f"LTN{rng.randint(0, 10**9):09d}",
+        }
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def send(base_url, method, path, body, timeout=30):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(
+        base_url + path,
+        data=data,
+        method=method,
+        headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception:
+        return 0
+
+
+def seed_through_api(base_url, patients):
+    """Creates patients and encounters through the app when the store is not local."""
+    seeds = []
+    for number in range(patients):
+        mrn = f"LTA{int(time.time())}{number:05d}"
+        request = urllib.request.Request(
+            f"{base_url}/api/patient", method="POST",
+            data=json.dumps({"family_name": f"Load{number}", "given_name": "Test", "gender": "male",
+                             "birth_date": "1970-01-01", "mrn": mrn}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            patient_id = json.loads(response.read())["id"]
+        request = urllib.request.Request(
+            f"{base_url}/api/encounter", method="POST",
+            data=json.dumps({"patient_id": patient_id, "encounter_status": "finished",
+                             "encounter_text": "Load test"}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request) as response:
+            encounter_id = json.loads(response.read())["id"]
+        seeds.append({"mrn": mrn, "patient_id": patient_id, "encounter_id": encounter_id})
+    return seeds
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    return ordered[max(0, math.ceil(len(ordered) * fraction) - 1)]
+
+
+def route_stats(latencies, errors, elapsed):
+    """Summarizes one route's latencies (ms) and error count over `elapsed` seconds."""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "requests": count,
+        "throughput": count / elapsed,
+        "error_rate": errors / count,
+        "p50_ms": percentile(ordered, 0.50),
+        "p90_ms": percentile(ordered, 0.90),
+        "p99_ms": percentile(ordered, 0.99),
+    }
+
+
+def run_load(base_url, seeds, mix, concurrency, duration, seed_value=0):
+    """
+    Runs the mix with `concurrency` closed-loop clients for `duration` seconds.
+
+    Returns:
+        {"duration", "requests", "throughput", "routes": {name: stats}}.
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(number):
+        rng = random.Random(seed_value * 1000 + number)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, body = scenario_request(name, rng, seeds)
+            started = time.perf_counter()
+            status = send(base_url, method, path, body)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                samples[name].append(elapsed_ms)
+                if not 200 <= status < 300:
+                    errors[name] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    routes = {name: route_stats(latencies, errors[name], elapsed) for name, latencies in samples.items()}
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "duration": elapsed,
+        "concurrency": concurrency,
+        "requests": total,
+        "throughput": total / elapsed,
+        "error_rate": sum(errors.values()) / total if total else 0.0,
+        "routes": routes,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    Lists regressions against a baseline result.
+
+    A regression is overall throughput falling, or a route's p90 latency
+    rising, by more than `tolerance` (a fraction), an error rate more than
+    one percentage point above the baseline's, or a baseline route that got
+    no requests at all.
+    """
+    failures = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        failures.append(f"throughput {result['throughput']:.1f} req/s < baseline {baseline['throughput']:.1f} req/s")
+    for name, base in baseline["routes"].items():
+        route = result["routes"].get(name)
+        if route is None:
+            failures.append(f"{name}: no requests in this run")
+            continue
+        if route["p90_ms"] > base["p90_ms"] * (1 + tolerance):
+            failures.append(f"{name}: p90 {route['p90_ms']:.1f} ms > baseline {base['p90_ms']:.1f} ms")
+        if route["error_rate"] > base["error_rate"] + 0.01:
+            failures.append(f"{name}: error rate {route['error_rate']:.2%} > baseline {base['error_rate']:.2%}")
+    return failures
+
+
+def print_report(result):
+    print(f"{result['requests']} requests in {result['duration']:.1f}s with {result['concurrency']} clients: "
+          f"{result['throughput']:.1f} req/s, {result['error_rate']:.2%} errors")
+    print(f"{'route':<24}{'req':>8}{'req/s':>9}{'err':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    for name, route in sorted(result["routes"].items()):
+        print(f"{name:<24}{route['requests']:>8}{route['throughput']:>9.1f}{route['error_rate']:>8.1%}"
+              f"{route['p50_ms']:>9.1f}{route['p90_ms']:>9.1f}{route['p99_ms']:>9.1f}")
+
+
+def start_local_app(patients, observations, latency_ms):
+    """Starts the FHIR stand-in and the app in-process. Returns (base_url, seeds)."""
+    standin, store = start_standin(latency_ms=latency_ms)
+    seeds = seed(store, patients, observations)
+    os.environ["HEALTHCARE_API_ENDPOINT"] = f"http://127.0.0.1:{standin.server_port}"
+    os.environ["HEALTHCARE_API_ANONYMOUS"] = "1"
+
+    # Imported only now so app.py picks up the stand-in endpoint.
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    app_module.app.logger.setLevel("WARNING")
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="app-under-test", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", seeds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the clinical summarization API.")
+    parser.add_argument("--target", help="Base URL of a running deployment (default: start one in-process).")
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--observations", type=int, default=40, help="Observations per seeded patient.")
+    parser.add_argument("--upstream-latency-ms", type=float, default=30.0, help="Stand-in FHIR store latency.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--mix", help="JSON object of scenario weights.")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against; exit 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", help="Write this run's results to a baseline JSON file.")
+    args = parser.parse_args()
+
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    if args.target:
+        base_url = args.target.rstrip("/")
+        seeds = seed_through_api(base_url, args.patients)
+    else:
+        base_url, seeds = start_local_app(args.patients, args.observations, args.upstream_latency_ms)
+
+    result = run_load(base_url, seeds, mix, args.concurrency, args.duration)
+    print_report(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            failures = compare(result, json.load(f), args.tolerance)
+        if failures:
+            print("Performance regression:")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print("No regression against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Deterministic synthetic patient charts for benchmarks and load tests.
+
+Resources have the shape the create_* functions in script/function.py
+produce: Patient, Practitioner, Encounter, Condition, Procedure, Observation,
+MedicationRequest and DiagnosticReport. The same seed always gives the same
+output. Chart sizes are drawn from configurable distributions, with a small
+share of long-tail ICU patients carrying far more observations.
+
+Resources are rendered straight to JSON text from per-type templates, which is
+what makes a million resources take seconds; iter_resources() parses them back
+for callers that want dicts.
+
+Usage:
+    python benchmarks/synthetic_data.py --patients 20000 --out export/       # <Type>.ndjson files
+    python benchmarks/synthetic_data.py --patients 100 --format bundles > bundles.ndjson
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from script.jsonio import loads
+
+MRN_SYSTEM = "urn:oid:1.2.36.146.595.217.0.1"
+
+# JSON-escaped once here so templates can embed them directly.
+_q = json.dumps
+
+FAMILY_NAMES = [_q(n) for n in ("Santoso", "Wijaya", "Smith", "Nguyen", "Garcia", "Tan", "Lim", "Kumar", "Müller", "O'Brien", "Hidayat", "Putri")]
+GIVEN_NAMES = [_q(n) for n in ("Ahmad", "Siti", "John", "Mary", "Budi", "Dewi", "Wei", "Anna", "Rizky", "Maria", "David", "Ayu")]
+
+CONDITIONS = [(_q(code), _q(display)) for code, display in (
+    ("44054006", "Diabetes mellitus type 2"),
+    ("38341003", "Hypertensive disorder"),
+    ("195967001", "Asthma"),
+    ("233604007", "Pneumonia"),
+    ("49436004", "Atrial fibrillation"),
+    ("709044004", "Chronic kidney disease"),
+    ("84114007", "Heart failure"),
+    ("13645005", "Chronic obstructive lung disease"),
+)]
+PROCEDURES = [(_q(code), _q(display)) for code, display in (
+    ("80146002", "Appendectomy"),
+    ("387713003", "Surgical procedure"),
+    ("232717009", "Coronary artery bypass grafting"),
+    ("71388002", "Procedure"),
+    ("40617009", "Artificial respiration"),
+)]
+# (LOINC code, display, unit, low, high)
+OBSERVATIONS = [(_q(code), _q(display), _q(unit), low, high) for code, display, unit, low, high in (
+    ("8867-4", "Heart rate", "/min", 50, 130),
+    ("8480-6", "Systolic blood pressure", "mm[Hg]", 90, 180),
+    ("8462-4", "Diastolic blood pressure", "mm[Hg]", 50, 110),
+    ("8310-5", "Body temperature", "Cel", 35.5, 39.5),
+    ("9279-1", "Respiratory rate", "/min", 10, 30),
+    ("2708-6", "Oxygen saturation in Arterial blood", "%", 85, 100),
+    ("2339-0", "Glucose [Mass/volume] in Blood", "mg/dL", 70, 250),
+)]
+MEDICATIONS = [(_q(code), _q(display), _q(dosage)) for code, display, dosage in (
+    ("860975", "Metformin 500 MG Oral Tablet", "1 tablet twice daily"),
+    ("314076", "Lisinopril 10 MG Oral Tablet", "1 tablet daily"),
+    ("617312", "Atorvastatin 40 MG Oral Tablet", "1 tablet at night"),
+    ("308182", "Amoxicillin 500 MG Oral Capsule", "1 capsule three times daily"),
+    ("311040", "Insulin Lispro 100 UNT/ML Injectable Solution", "Sliding scale"),
+)]
+REPORTS = [(_q(code), _q(display), _q(conclusion)) for code, display, conclusion in (
+    ("58410-2", "CBC panel - Blood by Automated count", "Within normal limits."),
+    ("24323-8", "Comprehensive metabolic panel", "Mildly elevated creatinine."),
+    ("30746-2", "Chest X-ray", "No acute cardiopulmonary process."),
+)]
+ENCOUNTER_STATUSES = [_q(s) for s in ("finished", "finished", "finished", "in-progress", "planned")]
+
+
+class ChartSizes:
+    """
+    Per-patient resource count distributions.
+
+    Encounters and per-encounter observations are log-normal around the
+    given medians; icu_fraction of patients get icu_factor times the
+    observations of a regular patient.
+    """
+
+    def __init__(
+        self,
+        encounters_median=3,
+        observations_per_encounter_median=8,
+        conditions_max=4,
+        procedures_max=2,
+        medications_max=5,
+        reports_per_encounter=0.5,
+        icu_fraction=0.02,
+        icu_factor=40,
+    ):
+        self.encounters_median = encounters_median
+        self.observations_per_encounter_median = observations_per_encounter_median
+        self.conditions_max = conditions_max
+        self.procedures_max = procedures_max
+        self.medications_max = medications_max
+        self.reports_per_encounter = reports_per_encounter
+        self.icu_fraction = icu_fraction
+        self.icu_factor = icu_factor
+
+
+def _lognormal_count(rng, median, sigma=0.6):
+    return max(1, int(rng.lognormvariate(math.log(median), sigma)))
+
+
+def iter_json(patients, seed=42, sizes=None, practitioners=50, start=datetime(2024, 1, 1)):
+    """
+    Yields (resource_type, json_text) for a synthetic population.
+
+    Practitioners come first, then each patient followed by their chart, so a
+    consumer can stream resources in reference order.
+    """
+    rng = random.Random(seed)
+    sizes = sizes or ChartSizes()
+    rand = rng.random
+    choice = rng.choice
+
+    for number in range(practitioners):
+        yield "Practitioner", (
+            f'{{"resourceType":"Practitioner","id":"prac-{number}",'
+            f'"identifier":[{{"system":"http://hl7.org/fhir/sid/us-npi","value":"{1000000000 + number}"}}],'
+            f'"name":[{{"family":{choice(FAMILY_NAMES)},"given":[{choice(GIVEN_NAMES)}],"prefix":["Dr."]}}]}}'
+        )
+
+    serial = 0
+    for number in range(patients):
+        patient_id = f"pat-{number}"
+        subject = f'"subject":{{"reference":"Patient/{patient_id}"}}'
+        gender = '"female"' if rand() < 0.5 else '"male"'
+        yield "Patient", (
+            f'{{"resourceType":"Patient","id":"{patient_id}",'
+            f'"name":[{{"use":"official","family":{choice(FAMILY_NAMES)},"given":[{choice(GIVEN_NAMES)}]}}],'
+            f'"gender":{gender},"birthDate":"{1930 + int(rand() * 90)}-{1 + int(rand() * 12):02d}-{1 + int(rand() * 28):02d}",'
+            f'"identifier":[{{"use":"usual","type":{{"coding":[{{"system":"http://terminology.hl7.org/CodeSystem/v2-0203",'
+            f'"code":"MR","display":"Medical Record Number"}}]}},"system":"{MRN_SYSTEM}","value":"MRN{number:08d}"}}]}}'
+        )
+
+        is_icu = rand() < sizes.icu_fraction
+        day = start + timedelta(days=int(rand() * 365))
+        onset = day.isoformat() + "+07:00"
+        for _ in range(int(rand() * (sizes.conditions_max + 1))):
+            serial += 1
+            code, display = choice(CONDITIONS)
+            yield "Condition", (
+                f'{{"resourceType":"Condition","id":"cond-{serial}",{subject},'
+                f'"clinicalStatus":{{"coding":[{{"system":"http://terminology.hl7.org/CodeSystem/condition-clinical","code":"active","display":"Active"}}]}},'
+                f'"verificationStatus":{{"coding":[{{"system":"http://terminology.hl7.org/CodeSystem/condition-ver-status","code":"confirmed","display":"Confirmed"}}]}},'
+                f'"code":{{"coding":[{{"system":"http://snomed.info/sct","code":{code},"display":{display}}}],"text":{display}}},'
+                f'"onsetDateTime":"{onset}"}}'
+            )
+        for _ in range(int(rand() * (sizes.medications_max + 1))):
+            serial += 1
+            code, display, dosage = choice(MEDICATIONS)
+            prac = int(rand() * practitioners) if practitioners else 0
+            yield "MedicationRequest", (
+                f'{{"resourceType":"MedicationRequest","id":"med-{serial}","status":"active","intent":"order",'
+                f'"medicationCodeableConcept":{{"coding":[{{"system":"http://www.nlm.nih.gov/research/umls/rxnorm","code":{code},"display":{display}}}],"text":{display}}},'
+                f'{subject},"authoredOn":"{onset}",'
+                f'"requester":{{"reference":"Practitioner/prac-{prac}","display":"Dr. Practitioner {prac}"}},'
+                f'"dosageInstruction":[{{"text":{dosage}}}]}}'
+            )
+
+        encounters = _lognormal_count(rng, sizes.encounters_median)
+        for _ in range(encounters):
+            serial += 1
+            encounter_id = f"enc-{serial}"
+            encounter_ref = f'"encounter":{{"reference":"Encounter/{encounter_id}"}}'
+            day += timedelta(days=1 + int(rand() * 30))
+            yield "Encounter", (
+                f'{{"resourceType":"Encounter","id":"{encounter_id}","status":{choice(ENCOUNTER_STATUSES)},'
+                f'"class":{{"system":"http://hl7.org/fhir/v3/ActCode","code":"IMP","display":"inpatient encounter"}},'
+                f'"reasonCode":[{{"text":"Admission"}}],{subject}}}'
+            )
+
+            observations = _lognormal_count(rng, sizes.observations_per_encounter_median)
+            if is_icu:
+                observations *= sizes.icu_factor
+            for index in range(observations):
+                serial += 1
+                code, display, unit, low, high = choice(OBSERVATIONS)
+                # Spread the encounter's observations over its day, minute by minute.
+                effective = (day + timedelta(minutes=index % 1440)).isoformat() + "+07:00"
+                yield "Observation", (
+                    f'{{"resourceType":"Observation","id":"obs-{serial}",'
+                    f'"code":{{"coding":[{{"system":"http://loinc.org","code":{code},"display":{display}}}]}},'
+                    f'"status":"final",{subject},"effectiveDateTime":"{effective}",'
+                    f'"valueQuantity":{{"value":{round(low + rand() * (high - low), 1)},"unit":{unit}}},{encounter_ref}}}'
+                )
+
+            # About procedures_max / 2 procedures per patient, spread over encounters.
+            if rand() < sizes.procedures_max / encounters / 2:
+                serial += 1
+                code, display = choice(PROCEDURES)
+                when = day.isoformat() + "+07:00"
+                yield "Procedure", (
+                    f'{{"resourceType":"Procedure","id":"proc-{serial}","status":"completed",'
+                    f'"code":{{"coding":[{{"system":"http://snomed.info/sct","code":{code},"display":{display}}}],"text":{display}}},'
+                    f'{subject},{encounter_ref},"performedPeriod":{{"start":"{when}","end":"{when}"}},'
+                    f'"reasonCode":[{{"text":"Clinically indicated"}}]}}'
+                )
+            if rand() < sizes.reports_per_encounter:
+                serial += 1
+                code, display, conclusion = choice(REPORTS)
+                when = day.isoformat() + "+07:00"
+                prac = int(rand() * practitioners) if practitioners else 0
+                yield "DiagnosticReport", (
+                    f'{{"resourceType":"DiagnosticReport","id":"rep-{serial}","status":"final",'
+                    f'"code":{{"coding":[{{"system":"http://loinc.org","code":{code},"display":{display}}}],"text":{display}}},'
+                    f'{subject},{encounter_ref},"effectiveDateTime":"{when}","issued":"{when}",'
+                    f'"performer":[{{"reference":"Practitioner/prac-{prac}"}}],"conclusion":{conclusion}}}'
+                )
+
+
+def iter_resources(patients, seed=42, sizes=None, practitioners=50):
+    """Yields the synthetic resources as dicts."""
+    for _, text in iter_json(patients, seed, sizes, practitioners):
+        yield loads(text)
+
+
+def write_ndjson(resources, out_dir=None, stream=None):
+    """
+    Writes NDJSON, one <Type>.ndjson file per resource type in out_dir (the
+    layout of a FHIR bulk export/import), or everything to stream.
+
+    Returns:
+        The number of resources written per type.
+    """
+    counts = {}
+    files = {}
+    try:
+        for resource_type, text in resources:
+            if out_dir is not None:
+                f = files.get(resource_type)
+                if f is None:
+                    f = files[resource_type] = open(os.path.join(out_dir, f"{resource_type}.ndjson"), "w", encoding="utf-8", buffering=1 << 20)
+                f.write(text + "\n")
+            else:
+                stream.write(text + "\n")
+            counts[resource_type] = counts.get(resource_type, 0) + 1
+    finally:
+        for f in files.values():
+            f.close()
+    return counts
+
+
+def write_bundles(resources, stream):
+    """
+    Writes one transaction bundle per patient chart per line.
+
+    Entries are PUTs with the generated ids, so references resolve without
+    urn:uuid rewriting; the target FHIR store needs enableUpdateCreate.
+    """
+    entries = []
+    bundles = 0
+
+    def flush():
+        nonlocal bundles
+        if entries:
+            stream.write('{"resourceType":"Bundle","type":"transaction","entry":[' + ",".join(entries) + "]}\n")
+            bundles += 1
+            entries.clear()
+
+    for resource_type, text in resources:
+        # Practitioners share the first bundle; each patient starts a new one.
+        if resource_type == "Patient":
+            flush()
+        resource_id = text.split('"id":"', 1)[1].split('"', 1)[0]
+        entries.append(f'{{"resource":{text},"request":{{"method":"PUT","url":"{resource_type}/{resource_id}"}}}}')
+    flush()
+    return bundles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic FHIR patient charts.")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--practitioners", type=int, default=50)
+    parser.add_argument("--format", choices=("ndjson", "bundles"), default="ndjson")
+    parser.add_argument("--out", help="Directory for per-type NDJSON files (default: stdout).")
+    parser.add_argument("--encounters-median", type=float, default=3)
+    parser.add_argument("--observations-median", type=float, default=8, help="Observations per encounter.")
+    parser.add_argument("--icu-fraction", type=float, default=0.02)
+    parser.add_argument("--icu-factor", type=int, default=40)
+    args = parser.parse_args()
+
+    sizes = ChartSizes(
+        encounters_median=args.encounters_median,
+        observations_per_encounter_median=args.observations_median,
+        icu_fraction=args.icu_fraction,
+        icu_factor=args.icu_factor,
+    )
+    resources = iter_json(args.patients, args.seed, sizes, args.practitioners)
+    started = time.perf_counter()
+    if args.format == "bundles":
+        written = write_bundles(resources, sys.stdout)
+        summary = f"{written} bundles"
+    else:
+        if args.out:
+            os.makedirs(args.out, exist_ok=True)
+        counts = write_ndjson(resources, args.out, sys.stdout)
+        summary = f"{sum(counts.values()):,} resources {counts}"
+    print(f"Generated {summary} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
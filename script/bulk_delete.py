@@ -0,0 +1,245 @@
+"""
+Bulk deletion of FHIR resources by patient compartment or search query.
+
+Resources are deleted in dependency order (clinical resources, then
+Encounter, then Patient) so no delete is rejected for a dangling reference.
+Each tier is sent as batch bundles of DELETE entries, several bundles at a
+time, and history versions can optionally be purged afterwards.
+
+Usage:
+    python -m script.bulk_delete --project P --location L --dataset D --fhir-store S --mrn 12345 --dry-run
+    python -m script.bulk_delete ... --search "Observation?code=8867-4" --purge
+"""
+
+# Import Library
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import threading
+
+from google.auth.transport import requests
+
+from script.cache import patient_id_for_resource
+from script.function import HEALTHCARE_API_ENDPOINT, get_credentials, iter_bundle_pages
+from script.jsonio import dumps, loads
+
+BASE_URL = f"{HEALTHCARE_API_ENDPOINT}/v1"
+MRN_SYSTEM = "urn:oid:1.2.36.146.595.217.0.1"
+
+# Lower tiers are deleted first. Types not listed are treated as leaf resources.
+DELETE_TIERS = {
+    "Encounter": 1,
+    "Patient": 2,
+}
+
+_local = threading.local()
+
+
+def _session() -> requests.AuthorizedSession:
+    """Returns an authorized session for the current thread."""
+    if not hasattr(_local, "session"):
+        _local.session = requests.AuthorizedSession(get_credentials())
+    return _local.session
+
+
+def fhir_base_url(project_id: str, location: str, dataset_id: str, fhir_store_id: str) -> str:
+    return (
+        f"{BASE_URL}/projects/{project_id}/locations/{location}"
+        f"/datasets/{dataset_id}/fhirStores/{fhir_store_id}/fhir"
+    )
+
+
+def collect_compartment(fhir_url: str, mrn: str) -> List[Tuple[str, str]]:
+    """
+    Lists ("ResourceType", "id") for everything in the compartment of the patient with this MRN.
+
+    $everything also returns resources the patient only references, such as
+    Practitioners shared with other patients; those are left out.
+    """
+    search = next(iter_bundle_pages(f"{fhir_url}/Patient", {"identifier": f"{MRN_SYSTEM}|{mrn}"}, _session()))
+    if not search.get("entry"):
+        raise Exception(f"No patient found with MRN: {mrn}")
+    patient_id = search["entry"][0]["resource"]["id"]
+    return collect_search(
+        f"{fhir_url}/Patient/{patient_id}/$everything",
+        keep=lambda resource: patient_id_for_resource(resource) == patient_id,
+    )
+
+
+def collect_search(
+    url: str,
+    params: Optional[Dict[str, str]] = None,
+    keep: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> List[Tuple[str, str]]:
+    targets = []
+    seen = set()
+    for bundle in iter_bundle_pages(url, params, _session()):
+        for entry in bundle.get("entry", []):
+            resource = entry.get("resource", {})
+            if keep is not None and not keep(resource):
+                continue
+            key = (resource.get("resourceType"), resource.get("id"))
+            if all(key) and key not in seen:
+                seen.add(key)
+                targets.append(key)
+    return targets
+
+
+def order_by_dependency(targets: Iterable[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """Groups targets into tiers that must be deleted one after another."""
+    tiers = defaultdict(list)
+    for resource_type, resource_id in targets:
+        tiers[DELETE_TIERS.get(resource_type, 0)].append((resource_type, resource_id))
+    return [tiers[tier] for tier in sorted(tiers)]
+
+
+def _chunks(items: List[Any], size: int) -> Iterable[List[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def delete_batch(fhir_url: str, targets: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+    """
+    Deletes resources with one batch bundle.
+
+    Returns:
+        (resource_type, resource_id, status) for each entry, where status is
+        the HTTP status line the store reported for that entry.
+    """
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [
+            {"request": {"method": "DELETE", "url": f"{resource_type}/{resource_id}"}}
+            for resource_type, resource_id in targets
+        ],
+    }
+    response = _session().post(
+        fhir_url,
+        data=dumps(bundle),
+        headers={"Content-Type": "application/fhir+json;charset=utf-8"},
+    )
+    response.raise_for_status()
+    entries = loads(response.content).get("entry", [])
+    return [
+        (resource_type, resource_id, entry.get("response", {}).get("status", ""))
+        for (resource_type, resource_id), entry in zip(targets, entries)
+    ]
+
+
+def purge_history(fhir_url: str, resource_type: str, resource_id: str) -> None:
+    """Deletes all historical versions of a resource (the current version is untouched)."""
+    response = _session().delete(f"{fhir_url}/{resource_type}/{resource_id}/$purge")
+    response.raise_for_status()
+
+
+def bulk_delete(
+    fhir_url: str,
+    targets: List[Tuple[str, str]],
+    batch_size: int = 100,
+    workers: int = 4,
+    purge: bool = False,
+    dry_run: bool = False,
+    progress: Callable[[str], None] = print,
+) -> Dict[str, Any]:
+    """
+    Deletes the targets tier by tier with concurrent batch bundles.
+
+    Args:
+        fhir_url: The FHIR base URL of the store (see fhir_base_url).
+        targets: ("ResourceType", "id") pairs to delete.
+        batch_size: Number of DELETE entries per batch bundle.
+        workers: Number of bundles in flight at once.
+        purge: Also purge the history versions of every deleted resource.
+        dry_run: Only report what would be deleted.
+        progress: Called with a progress line after every bundle.
+
+    Returns:
+        A summary with the per-type counts and the failed entries.
+    """
+    counts = Counter(resource_type for resource_type, _ in targets)
+    summary = {"planned": dict(counts), "deleted": 0, "purged": 0, "failed": []}
+    tiers = order_by_dependency(targets)
+    if dry_run:
+        for number, tier in enumerate(tiers, 1):
+            tier_counts = Counter(resource_type for resource_type, _ in tier)
+            progress(f"[dry run] tier {number}: would delete {dict(tier_counts)}")
+        return summary
+
+    total = len(targets)
+    deleted = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for tier in tiers:
+            futures = [executor.submit(delete_batch, fhir_url, batch) for batch in _chunks(tier, batch_size)]
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    summary["failed"].append(("bundle", "", str(e)))
+                    continue
+                for resource_type, resource_id, status in results:
+                    if status.startswith("2"):
+                        deleted.append((resource_type, resource_id))
+                    else:
+                        summary["failed"].append((resource_type, resource_id, status))
+                summary["deleted"] = len(deleted)
+                progress(f"Deleted {len(deleted)}/{total} ({len(summary['failed'])} failed)")
+            # Stop before the next tier if anything it depends on is still there.
+            if summary["failed"]:
+                progress("Stopping: some deletes in this tier failed.")
+                return summary
+
+        if purge:
+            futures = {
+                executor.submit(purge_history, fhir_url, resource_type, resource_id): (resource_type, resource_id)
+                for resource_type, resource_id in deleted
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    summary["purged"] += 1
+                except Exception as e:
+                    summary["failed"].append((*futures[future], f"purge: {e}"))
+                if summary["purged"] % batch_size == 0:
+                    progress(f"Purged history of {summary['purged']}/{len(deleted)}")
+
+    progress(f"Done: deleted {summary['deleted']}, purged {summary['purged']}, failed {len(summary['failed'])}")
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Bulk delete FHIR resources in dependency order.")
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--location", required=True)
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--fhir-store", required=True)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--mrn", help="Delete the whole compartment of the patient with this MRN.")
+    target.add_argument("--search", help='Delete the results of a search, e.g. "Observation?code=8867-4".')
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--purge", action="store_true", help="Also purge history versions.")
+    parser.add_argument("--dry-run", action="store_true", help="Only print what would be deleted.")
+    args = parser.parse_args(argv)
+
+    fhir_url = fhir_base_url(args.project, args.location, args.dataset, args.fhir_store)
+    if args.mrn:
+        targets = collect_compartment(fhir_url, args.mrn)
+    else:
+        targets = collect_search(f"{fhir_url}/{args.search}")
+    print(f"Found {len(targets)} resources")
+
+    bulk_delete(
+        fhir_url,
+        targets,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        purge=args.purge,
+        dry_run=args.dry_run,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# Import Library
+
+from typing import Any, Dict, Iterable, List, Optional, Set
+import base64
+
+from script.jsonio import dumps_bytes
+
+# Resource types in a patient's compartment that can be bulk patched.
+PATCHABLE_TYPES = (
+    "Patient",
+    "Encounter",
+    "Condition",
+    "Procedure",
+    "Observation",
+    "MedicationRequest",
+    "DiagnosticReport",
+)
+
+
+def partial_update_to_patch(fields: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turns a partial update like {"status": "inactive"} into a JSON Patch.
+
+    "add" on an object member replaces it if present, so this works whether or
+    not the element already exists, and needs no read of the current resource.
+    """
+    return [
+        {"op": "add", "path": "/" + key.replace("~", "~0").replace("/", "~1"), "value": value}
+        for key, value in fields.items()
+    ]
+
+
+def patched_elements(patch: List[Dict[str, Any]]) -> Set[str]:
+    """Returns the top-level elements a JSON Patch writes to, e.g. {"status"} for /status."""
+    elements = set()
+    for operation in patch:
+        path = operation.get("path", "")
+        if path.startswith("/"):
+            elements.add(path[1:].split("/", 1)[0].replace("~1", "/").replace("~0", "~"))
+    return elements
+
+
+def etag(version_id: Optional[str]) -> Optional[str]:
+    """Formats a FHIR versionId as the weak ETag used in If-Match."""
+    return f'W/"{version_id}"' if version_id else None
+
+
+def version_from_etag(value: Optional[str]) -> Optional[str]:
+    """Reads the versionId back out of an ETag like W/"3"."""
+    if not value:
+        return None
+    return value[2:].strip('"') if value.startswith("W/") else value.strip('"')
+
+
+def build_patch_bundle(targets: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Builds a batch bundle of PATCH entries.
+
+    Args:
+        targets: Dicts with "resourceType", "id", "patch" (a JSON Patch list)
+            and optionally "versionId" for an If-Match precondition.
+
+    Returns:
+        A FHIR batch Bundle. Each patch is carried as a Binary resource, which
+        is how the Cloud Healthcare API accepts PATCH inside bundles.
+    """
+    entries = []
+    for target in targets:
+        request = {"method": "PATCH", "url": f"{target['resourceType']}/{target['id']}"}
+        if target.get("versionId"):
+            request["ifMatch"] = etag(target["versionId"])
+        entries.append(
+            {
+                "resource": {
+                    "resourceType": "Binary",
+                    "contentType": "application/json-patch+json",
+                    "data": base64.b64encode(dumps_bytes(target["patch"])).decode("ascii"),
+                },
+                "request": request,
+            }
+        )
+    return {"resourceType": "Bundle", "type": "batch", "entry": entries}
+
+
+def execute_bundle(
+    healthcare_client: Any,
+    fhir_store_name: str,
+    bundle: Dict[str, Any],
+) -> Dict[str, Any]:
+    request = (
+        healthcare_client.projects()
+        .locations()
+        .datasets()
+        .fhirStores()
+        .fhir()
+        .executeBundle(parent=fhir_store_name, body=bundle)
+    )
+    request.headers["content-type"] = "application/fhir+json;charset=utf-8"
+    return request.execute()
+
+
+def patch_resources(
+    healthcare_client: Any,
+    fhir_store_name: str,
+    targets: List[Dict[str, Any]],
+    batch_size: int = 100,
+) -> List[Dict[str, Any]]:
+    """
+    Applies JSON Patches to many resources, batch_size per round trip.
+
+    Returns:
+        One {"resourceType", "id", "status", "versionId"} dict per target. A
+        "412 Precondition Failed" status means the resource changed since the
+        versionId given for it was read.
+    """
+    results = []
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start:start + batch_size]
+        response = execute_bundle(healthcare_client, fhir_store_name, build_patch_bundle(batch))
+        for target, entry in zip(batch, response.get("entry", [])):
+            outcome = entry.get("response", {})
+            # Batch responses only carry the resource when asked to; the etag is always there.
+            version_id = entry.get("resource", {}).get("meta", {}).get("versionId") or version_from_etag(outcome.get("etag"))
+            results.append(
+                {
+                    "resourceType": target["resourceType"],
+                    "id": target["id"],
+                    "status": outcome.get("status", ""),
+                    "versionId": version_id,
+                }
+            )
+    print(
+        f"Patched {sum(r['status'].startswith('2') for r in results)} of {len(targets)} resources "
+        f"in {(len(targets) + batch_size - 1) // batch_size} bundles"
+    )
+    return results
+
+
+def compartment_targets(
+    bundle: Dict[str, Any],
+    patch: List[Dict[str, Any]],
+    resource_types: Optional[Iterable[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Builds patch targets for the resources of an $everything bundle.
+
+    With resource_types every resource of those types is patched. Without,
+    only resources of PATCHABLE_TYPES that already have every top-level
+    element the patch writes to are, so {"status": ...} is not sent to
+    Patient or Condition, which have no status element.
+
+    The versionId of every resource in the bundle becomes its If-Match
+    precondition, so changes made after the bundle was read are not overwritten.
+    """
+    wanted = set(resource_types or PATCHABLE_TYPES)
+    required = patched_elements(patch) if not resource_types else set()
+    targets = []
+    for entry in bundle.get("entry", []):
+        resource = entry.get("resource", {})
+        if (
+            resource.get("resourceType") in wanted
+            and resource.get("id")
+            and all(element in resource for element in required)
+        ):
+            targets.append(
+                {
+                    "resourceType": resource["resourceType"],
+                    "id": resource["id"],
+                    "patch": patch,
+                    "versionId": resource.get("meta", {}).get("versionId"),
+                }
+            )
+    return targets
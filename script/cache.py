@@ -0,0 +1,332 @@
+# Import Library
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from collections import OrderedDict
+import threading
+import time
+
+from script.snapshot import apply_resource, build_snapshot
+
+# Keys in the cache are (kind, patient_id). These are the kinds that live in the
+# patient compartment and are dropped together when that patient changes.
+# BUNDLE_KINDS are derived from one $everything read; the snapshot is also kept
+# current by applying newly created resources to it.
+ENCODED_RAW_KINDS = ("everything_raw_gzip", "everything_raw_br")
+BUNDLE_KINDS = ("everything", "everything_raw", "timeline", "summary") + ENCODED_RAW_KINDS
+PATIENT_CACHE_KINDS = BUNDLE_KINDS + ("snapshot",)
+
+# Fields that carry the clinically relevant date of each resource type we create.
+TIMELINE_DATE_FIELDS = (
+    "effectiveDateTime",
+    "onsetDateTime",
+    "authoredOn",
+    "issued",
+    "performedDateTime",
+)
+
+
+def reference_id(reference: Optional[Dict[str, Any]], resource_type: str) -> Optional[str]:
+    """Returns the logical id from a reference like {"reference": "Patient/123"}."""
+    if not reference:
+        return None
+    value = reference.get("reference", "")
+    # Full URLs and relative references both end in "<type>/<id>".
+    parts = value.rstrip("/").split("/")
+    if len(parts) >= 2 and parts[-2] == resource_type:
+        return parts[-1]
+    return None
+
+
+def patient_id_for_resource(resource: Dict[str, Any]) -> Optional[str]:
+    """Maps a FHIR resource to the id of the patient compartment it belongs to."""
+    if resource.get("resourceType") == "Patient":
+        return resource.get("id")
+    for field in ("subject", "patient"):
+        patient_id = reference_id(resource.get(field), "Patient")
+        if patient_id:
+            return patient_id
+    return None
+
+
+def get_mrn(patient: Dict[str, Any]) -> Optional[str]:
+    """Returns the MRN identifier value of a Patient resource, if any."""
+    for identifier in patient.get("identifier", []):
+        codings = identifier.get("type", {}).get("coding", [])
+        if any(coding.get("code") == "MR" for coding in codings):
+            return identifier.get("value")
+    return None
+
+
+def resource_date(resource: Dict[str, Any]) -> Optional[str]:
+    """Returns the ISO 8601 date a resource happened at, or None."""
+    for field in TIMELINE_DATE_FIELDS:
+        if resource.get(field):
+            return resource[field]
+    for field in ("performedPeriod", "period"):
+        if resource.get(field, {}).get("start"):
+            return resource[field]["start"]
+    return None
+
+
+def build_timeline_index(bundle: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Builds a date-ordered index of the resources in a patient bundle.
+
+    Args:
+        bundle: A FHIR bundle, typically the result of $everything.
+
+    Returns:
+        A list of {"date", "resourceType", "id", "display"} dicts, newest first.
+        Resources without a date are left out.
+    """
+    timeline = []
+    for entry in bundle.get("entry", []):
+        resource = entry.get("resource", {})
+        date = resource_date(resource)
+        if not date:
+            continue
+        code = resource.get("code") or resource.get("medicationCodeableConcept") or {}
+        display = code.get("text") or (code.get("coding") or [{}])[0].get("display")
+        timeline.append(
+            {
+                "date": date,
+                "resourceType": resource.get("resourceType"),
+                "id": resource.get("id"),
+                "display": display,
+            }
+        )
+    timeline.sort(key=lambda item: item["date"], reverse=True)
+    return timeline
+
+
+class PatientCache:
+    """
+    Thread-safe TTL cache of per-patient data (bundles, timelines, summaries,
+    clinical snapshots).
+
+    Besides the cached values it keeps two small indexes so that a change
+    notification can be mapped to the right entries without an upstream call:
+    MRN -> patient id, and "ResourceType/id" -> patient id for every resource
+    seen in a cached bundle. A patient's index entries are dropped once none of
+    their entries are cached any more, so the indexes stay as bounded as the
+    cache itself.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 1024, snapshot_ttl_seconds: Optional[float] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.snapshot_ttl_seconds = ttl_seconds if snapshot_ttl_seconds is None else snapshot_ttl_seconds
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._mrn_to_patient: Dict[str, str] = {}
+        self._patient_to_mrn: Dict[str, str] = {}
+        self._resource_to_patient: Dict[str, str] = {}
+        self._patient_resources: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, kind: str, patient_id: Optional[str]) -> Any:
+        if not patient_id:
+            return None
+        with self._lock:
+            item = self._entries.get((kind, patient_id))
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._entries[(kind, patient_id)]
+                    self._forget_if_uncached(patient_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end((kind, patient_id))
+            self.hits += 1
+            return item[1]
+
+    def set(self, kind: str, patient_id: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[(kind, patient_id)] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end((kind, patient_id))
+            self._trim()
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_entries:
+            (_, evicted_patient_id), _ = self._entries.popitem(last=False)
+            self._forget_if_uncached(evicted_patient_id)
+
+    def _index_resource(self, resource: Dict[str, Any], patient_id: str) -> None:
+        if resource.get("resourceType") and resource.get("id"):
+            key = f"{resource['resourceType']}/{resource['id']}"
+            self._resource_to_patient[key] = patient_id
+            self._patient_resources.setdefault(patient_id, set()).add(key)
+
+    def _unindex_resources(self, patient_id: str) -> None:
+        for key in self._patient_resources.pop(patient_id, ()):
+            if self._resource_to_patient.get(key) == patient_id:
+                del self._resource_to_patient[key]
+
+    def _forget_if_uncached(self, patient_id: str) -> None:
+        """Drops a patient's MRN and resource index entries once nothing of theirs is cached."""
+        if any((kind, patient_id) in self._entries for kind in PATIENT_CACHE_KINDS):
+            return
+        self._unindex_resources(patient_id)
+        mrn = self._patient_to_mrn.pop(patient_id, None)
+        if mrn is not None and self._mrn_to_patient.get(mrn) == patient_id:
+            del self._mrn_to_patient[mrn]
+
+    def remember_mrn(self, mrn: str, patient_id: str) -> None:
+        with self._lock:
+            self._mrn_to_patient[mrn] = patient_id
+            self._patient_to_mrn[patient_id] = mrn
+
+    def patient_id_for_mrn(self, mrn: str) -> Optional[str]:
+        with self._lock:
+            return self._mrn_to_patient.get(mrn)
+
+    def mrn_for_patient(self, patient_id: str) -> Optional[str]:
+        with self._lock:
+            return self._patient_to_mrn.get(patient_id)
+
+    def patient_id_for_reference(self, resource_type: str, resource_id: str) -> Optional[str]:
+        """Looks up the patient compartment of a resource seen in a cached bundle."""
+        if resource_type == "Patient":
+            return resource_id
+        with self._lock:
+            return self._resource_to_patient.get(f"{resource_type}/{resource_id}")
+
+    def store_bundle(
+        self,
+        mrn: str,
+        bundle: Dict[str, Any],
+        ttl_seconds: Optional[float] = None,
+        raw: Optional[bytes] = None,
+    ) -> Optional[str]:
+        """
+        Caches an $everything bundle together with its timeline index and
+        clinical snapshot.
+
+        When the upstream JSON bytes are given they are cached as well, so hits
+        can be served without serializing the bundle again.
+
+        Returns:
+            The patient id the bundle was stored under, or None if the bundle
+            does not contain the patient.
+        """
+        patient_id = None
+        for entry in bundle.get("entry", []):
+            resource = entry.get("resource", {})
+            if resource.get("resourceType") == "Patient" and get_mrn(resource) == mrn:
+                patient_id = resource.get("id")
+                break
+        if not patient_id:
+            return None
+
+        with self._lock:
+            self.remember_mrn(mrn, patient_id)
+            # The new bundle replaces what was indexed for this patient before.
+            self._unindex_resources(patient_id)
+            for entry in bundle.get("entry", []):
+                self._index_resource(entry.get("resource", {}), patient_id)
+            self.set("everything", patient_id, bundle, ttl_seconds)
+            if raw is not None:
+                self.set("everything_raw", patient_id, raw, ttl_seconds)
+            else:
+                # Never leave bytes from an older bundle next to a newer one.
+                self._entries.pop(("everything_raw", patient_id), None)
+            for kind in ENCODED_RAW_KINDS:
+                self._entries.pop((kind, patient_id), None)
+            self.set("timeline", patient_id, build_timeline_index(bundle), ttl_seconds)
+            self.set("snapshot", patient_id, build_snapshot(bundle, patient_id), self.snapshot_ttl_seconds)
+        return patient_id
+
+    def get_encoded_raw(
+        self,
+        patient_id: Optional[str],
+        encoding: str,
+        encode: Callable[[bytes, str], bytes],
+    ) -> Optional[bytes]:
+        """
+        Returns the patient's cached upstream bundle bytes in a content encoding
+        ("gzip" or "br"), encoding them on first use so later hits skip it.
+
+        Returns:
+            The encoded bytes, or None when no raw bundle is cached.
+        """
+        kind = f"everything_raw_{encoding}"
+        raw = self.get("everything_raw", patient_id)
+        if raw is None:
+            return None
+        with self._lock:
+            item = self._entries.get((kind, patient_id))
+            if item is not None and item[0] >= time.monotonic():
+                return item[1]
+        body = encode(raw, encoding)
+        with self._lock:
+            # Keep it only if the raw bytes were not replaced in the meantime,
+            # and let it expire with them.
+            item = self._entries.get(("everything_raw", patient_id))
+            if item is not None and item[1] is raw:
+                self._entries[(kind, patient_id)] = (item[0], body)
+                self._trim()
+        return body
+
+    def apply_create(
+        self,
+        patient_id: str,
+        resource_type: str,
+        resource_id: Optional[str],
+        resource: Optional[Dict[str, Any]] = None,
+    ) -> List[str]:
+        """
+        Invalidates a patient's entries after a resource was created.
+
+        The bundle-derived entries are always dropped. The snapshot stays when
+        the new resource is given and applied to it, or when it is already
+        reflected there (it was in the bundle or applied before); otherwise it
+        is dropped too. A patched snapshot keeps its expiry, so it is still
+        rebuilt from the store on schedule rather than living on patches.
+        Checking and updating under one lock means a store_bundle running at
+        the same time cannot be half-applied.
+
+        Returns:
+            The kinds that were evicted.
+        """
+        with self._lock:
+            keep = False
+            item = self._entries.get(("snapshot", patient_id))
+            if resource_id and item is not None and item[0] >= time.monotonic():
+                if resource is not None:
+                    self._index_resource(resource, patient_id)
+                    self._entries[("snapshot", patient_id)] = (item[0], apply_resource(item[1], resource))
+                    keep = True
+                else:
+                    keep = self._resource_to_patient.get(f"{resource_type}/{resource_id}") == patient_id
+            return self.evict_patient(patient_id, BUNDLE_KINDS if keep else PATIENT_CACHE_KINDS)
+
+    def evict_patient(self, patient_id: str, kinds: Tuple[str, ...] = PATIENT_CACHE_KINDS) -> List[str]:
+        """Drops the cached entries of one patient. Returns the kinds that were present."""
+        evicted = []
+        with self._lock:
+            for kind in kinds:
+                if self._entries.pop((kind, patient_id), None) is not None:
+                    evicted.append(kind)
+            self.evictions += len(evicted)
+            self._forget_if_uncached(patient_id)
+        return evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._mrn_to_patient.clear()
+            self._patient_to_mrn.clear()
+            self._resource_to_patient.clear()
+            self._patient_resources.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "indexed_resources": len(self._resource_to_patient),
+            }
@@ -1,22 +1,44 @@
 # Import Library
 
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, Optional
 import json
 from datetime import datetime, timezone, timedelta
+import logging
 import os
 from google.oauth2 import service_account
 from google.auth.transport import requests
 import google.auth
+from script.cache import get_mrn
+from script.jsonio import dumps_bytes, loads
+from script.profiling import span
+from google.auth.credentials import AnonymousCredentials
+
+logger = logging.getLogger(__name__)
+
+# The Cloud Healthcare API endpoint. Load tests point this at a local FHIR
+# stand-in (benchmarks/fhir_standin.py) and set HEALTHCARE_API_ANONYMOUS=1 so
+# no Google credentials are needed.
+HEALTHCARE_API_ENDPOINT = os.environ.get("HEALTHCARE_API_ENDPOINT", "https://healthcare.googleapis.com")
+
+def get_credentials():
+    """Returns the credentials used for Cloud Healthcare API calls."""
+    if os.environ.get("HEALTHCARE_API_ANONYMOUS"):
+        return AnonymousCredentials()
+    # Gets credentials from the environment.
+    with span("auth"):
+        credentials, _ = google.auth.default(
+            scopes=["https://www.googleapis.com/auth/cloud-platform"]
+        )
+    return credentials
 
-def create_patient(
+def build_patient(
     family_name: str ,
     given_name: str ,
     gender: str ,
     birth_date: str ,
     mrn: str,
-    healthcare_client: str,
-    fhir_store_name: str,
 ) -> Dict[str, Any]:
+    """Builds the patient resource that create_patient sends."""
     patient_body = {
         "name": [{"use": "official", "family": f"{family_name}", "given": [f"{given_name}"]}],
         "gender": f"{gender}",
@@ -43,6 +65,25 @@ def create_patient(
         "resourceType": "Patient",
     }
 
+    return patient_body
+
+def create_patient(
+    family_name: str ,
+    given_name: str ,
+    gender: str ,
+    birth_date: str ,
+    mrn: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+) -> Dict[str, Any]:
+    patient_body = build_patient(
+        family_name=family_name,
+        given_name=given_name,
+        gender=gender,
+        birth_date=birth_date,
+        mrn=mrn,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -53,19 +94,19 @@ def create_patient(
     )
     # Sets required application/fhir+json header on the googleapiclient.http.HttpRequest.
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
 
     print(f"Created Patient resource with ID {response['id']}")
     return response
 
 # Imports the types Dict and Any for runtime type hints.
-def create_encounter(
+def build_encounter(
     patient_id: str,
     encounter_status: str,
     encounter_text: str,
-    healthcare_client: str,
-    fhir_store_name: str,
 ) -> Dict[str, Any]:
+    """Builds the encounter resource that create_encounter sends."""
     encounter_body = {
         "status": encounter_status,
         "class": {
@@ -84,6 +125,21 @@ def create_encounter(
         "resourceType": "Encounter",
     }
 
+    return encounter_body
+
+def create_encounter(
+    patient_id: str,
+    encounter_status: str,
+    encounter_text: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+) -> Dict[str, Any]:
+    encounter_body = build_encounter(
+        patient_id=patient_id,
+        encounter_status=encounter_status,
+        encounter_text=encounter_text,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -94,21 +150,21 @@ def create_encounter(
     )
     # Sets required application/fhir+json header on the googleapiclient.http.HttpRequest.
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Created Encounter resource with ID {response['id']}")
 
     return response
 
-def create_condition(
+def build_condition(
     patient_id: str,
     clinical_status: str,
     verification_status: str,
     snomed_code: str,
     condition_display: str,
     onset_datetime: str,
-    healthcare_client: str,
-    fhir_store_name: str,
 ) -> Dict[str, Any]:
+    """Builds the condition resource that create_condition sends."""
     # The body of the FHIR Condition resource to be created.
     condition_body = {
         "resourceType": "Condition",
@@ -144,6 +200,27 @@ def create_condition(
         "onsetDateTime": onset_datetime,
     }
 
+    return condition_body
+
+def create_condition(
+    patient_id: str,
+    clinical_status: str,
+    verification_status: str,
+    snomed_code: str,
+    condition_display: str,
+    onset_datetime: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+) -> Dict[str, Any]:
+    condition_body = build_condition(
+        patient_id=patient_id,
+        clinical_status=clinical_status,
+        verification_status=verification_status,
+        snomed_code=snomed_code,
+        condition_display=condition_display,
+        onset_datetime=onset_datetime,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -154,12 +231,13 @@ def create_condition(
     )
     # Sets required application/fhir+json header on the googleapiclient.http.HttpRequest.
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Created Condition resource with ID {response['id']}")
 
     return response
 
-def create_procedure(
+def build_procedure(
     patient_id: str,
     encounter_id: str,
     procedure_status: str,
@@ -168,27 +246,8 @@ def create_procedure(
     start_time: str,
     end_time: str,
     reason_text: str,
-    healthcare_client: str,
-    fhir_store_name: str,
 ) -> Dict[str, Any]:
-    """Creates a new Procedure resource in a FHIR store.
-
-    This new Procedure will be linked to an existing Patient and Encounter resource.
-
-    Args:
-        patient_id: The "logical id" of the referenced Patient resource.
-        encounter_id: The "logical id" of the referenced Encounter resource during which the procedure was performed.
-        procedure_status: The status of the procedure (e.g., 'completed').
-        snomed_code: The SNOMED CT code for the procedure.
-        procedure_display: The human-readable name of the procedure.
-        start_time: The start time of the procedure (ISO 8601 format).
-        end_time: The end time of the procedure (ISO 8601 format).
-        reason_text: The text description for the reason for the procedure.
-
-    Returns:
-        A dict representing the created Procedure resource.
-    """
-
+    """Builds the procedure resource that create_procedure sends."""
     # The body of the FHIR Procedure resource to be created.
     procedure_body = {
         "resourceType": "Procedure",
@@ -212,6 +271,48 @@ def create_procedure(
         "reasonCode": [{"text": reason_text}],
     }
 
+    return procedure_body
+
+def create_procedure(
+    patient_id: str,
+    encounter_id: str,
+    procedure_status: str,
+    snomed_code: str,
+    procedure_display: str,
+    start_time: str,
+    end_time: str,
+    reason_text: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+) -> Dict[str, Any]:
+    """Creates a new Procedure resource in a FHIR store.
+
+    This new Procedure will be linked to an existing Patient and Encounter resource.
+
+    Args:
+        patient_id: The "logical id" of the referenced Patient resource.
+        encounter_id: The "logical id" of the referenced Encounter resource during which the procedure was performed.
+        procedure_status: The status of the procedure (e.g., 'completed').
+        snomed_code: The SNOMED CT code for the procedure.
+        procedure_display: The human-readable name of the procedure.
+        start_time: The start time of the procedure (ISO 8601 format).
+        end_time: The end time of the procedure (ISO 8601 format).
+        reason_text: The text description for the reason for the procedure.
+
+    Returns:
+        A dict representing the created Procedure resource.
+    """
+    procedure_body = build_procedure(
+        patient_id=patient_id,
+        encounter_id=encounter_id,
+        procedure_status=procedure_status,
+        snomed_code=snomed_code,
+        procedure_display=procedure_display,
+        start_time=start_time,
+        end_time=end_time,
+        reason_text=reason_text,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -222,18 +323,18 @@ def create_procedure(
     )
     # Sets required application/fhir+json header on the googleapiclient.http.HttpRequest.
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Created Procedure resource with ID {response['id']}")
 
     return response
 
-def create_practitioner(
+def build_practitioner(
     npi: str,
     family_name: str,
     given_name: str,
-    healthcare_client: str,
-    fhir_store_name: str,
 ) -> Dict[str, Any]:
+    """Builds the practitioner resource that create_practitioner sends."""
     practitioner_body = {
         "resourceType": "Practitioner",
         "identifier": [
@@ -245,6 +346,21 @@ def create_practitioner(
         "name": [{"family": family_name, "given": [given_name], "prefix": ["Dr."]}],
     }
 
+    return practitioner_body
+
+def create_practitioner(
+    npi: str,
+    family_name: str,
+    given_name: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+) -> Dict[str, Any]:
+    practitioner_body = build_practitioner(
+        npi=npi,
+        family_name=family_name,
+        given_name=given_name,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -254,12 +370,13 @@ def create_practitioner(
         .create(parent=fhir_store_name, type="Practitioner", body=practitioner_body)
     )
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Created Practitioner resource with ID {response['id']}")
 
     return response
 
-def create_medication_request(
+def build_medication_request(
     patient_id: str,
     practitioner_id: str,
     medication_status: str,
@@ -268,9 +385,8 @@ def create_medication_request(
     medication_display: str,
     practitioner_display: str,
     dosage_text: str,
-    healthcare_client: str,
-    fhir_store_name: str,
 ) -> Dict[str, Any]:
+    """Builds the medication request resource that create_medication_request sends."""
     current_time = datetime.now(timezone.utc).isoformat()
 
     # A more robust body for the FHIR MedicationRequest resource.
@@ -302,6 +418,31 @@ def create_medication_request(
         ],
     }
 
+    return medication_request_body
+
+def create_medication_request(
+    patient_id: str,
+    practitioner_id: str,
+    medication_status: str,
+    medication_intent: str,
+    rxnorm_code: str,
+    medication_display: str,
+    practitioner_display: str,
+    dosage_text: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+) -> Dict[str, Any]:
+    medication_request_body = build_medication_request(
+        patient_id=patient_id,
+        practitioner_id=practitioner_id,
+        medication_status=medication_status,
+        medication_intent=medication_intent,
+        rxnorm_code=rxnorm_code,
+        medication_display=medication_display,
+        practitioner_display=practitioner_display,
+        dosage_text=dosage_text,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -317,21 +458,21 @@ def create_medication_request(
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
 
 
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Created MedicationRequest resource with ID {response['id']}")
     return response
 
-def create_diagnostic_report(
+def build_diagnostic_report(
     report_status: str,
     loinc_code: str,
     report_display: str,
     conclusion: str,
-    healthcare_client: str,
-    fhir_store_name: str,
     patient_id: str,
     encounter_id: str,
     practitioner_id: str
 ) -> Dict[str, Any]:
+    """Builds the diagnostic report resource that create_diagnostic_report sends."""
     current_time = datetime.now(timezone.utc).isoformat()
 
     # The body for the FHIR DiagnosticReport resource.
@@ -358,6 +499,29 @@ def create_diagnostic_report(
         "conclusion": conclusion,
     }
 
+    return diagnostic_report_body
+
+def create_diagnostic_report(
+    report_status: str,
+    loinc_code: str,
+    report_display: str,
+    conclusion: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+    patient_id: str,
+    encounter_id: str,
+    practitioner_id: str
+) -> Dict[str, Any]:
+    diagnostic_report_body = build_diagnostic_report(
+        report_status=report_status,
+        loinc_code=loinc_code,
+        report_display=report_display,
+        conclusion=conclusion,
+        patient_id=patient_id,
+        encounter_id=encounter_id,
+        practitioner_id=practitioner_id,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -372,11 +536,12 @@ def create_diagnostic_report(
     )
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
 
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Created DiagnosticReport resource with ID {response['id']}")
     return response
 
-def create_observation(
+def build_observation(
     patient_id: str,
     encounter_id: str,
     observation_status: str,
@@ -384,10 +549,9 @@ def create_observation(
     observation_display: str,
     observation_value: float,
     observation_unit: str,
-    healthcare_client: str,
-    fhir_store_name: str,
     current_time: str
 ) -> Dict[str, Any]:
+    """Builds the observation resource that create_observation sends."""
     observation_body = {
         "resourceType": "Observation",
         "code": {
@@ -406,6 +570,31 @@ def create_observation(
         "encounter": {"reference": f"Encounter/{encounter_id}"},
     }
 
+    return observation_body
+
+def create_observation(
+    patient_id: str,
+    encounter_id: str,
+    observation_status: str,
+    loinc_code: str,
+    observation_display: str,
+    observation_value: float,
+    observation_unit: str,
+    healthcare_client: str,
+    fhir_store_name: str,
+    current_time: str
+) -> Dict[str, Any]:
+    observation_body = build_observation(
+        patient_id=patient_id,
+        encounter_id=encounter_id,
+        observation_status=observation_status,
+        loinc_code=loinc_code,
+        observation_display=observation_display,
+        observation_value=observation_value,
+        observation_unit=observation_unit,
+        current_time=current_time,
+    )
+
     request = (
         healthcare_client.projects()
         .locations()
@@ -420,7 +609,8 @@ def create_observation(
     )
     # Sets required application/fhir+json header on the googleapiclient.http.HttpRequest.
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Created Observation resource with ID {response['id']}")
 
     return response
@@ -436,14 +626,26 @@ def update_resource(
     resource_id: str,
     fhir_store_parent: str,
     healthcare_client: str,
+    body: Dict[str, Any] = None,
+    if_match: str = None,
 ) -> Dict[str, Any]:
+    """
+    Replaces a FHIR resource with a new version.
+
+    Args:
+        body: The new resource content. "resourceType" and "id" are filled in
+            from the arguments. Defaults to {"active": True}.
+        if_match: An ETag such as 'W/"<versionId>"'. The update is rejected with
+            412 Precondition Failed if the resource has changed since.
+
+    Returns:
+        A dict representing the updated resource.
+    """
     fhir_resource_path = f"{fhir_store_parent}/fhirStores/{fhir_store_id}/fhir/{resource_type}/{resource_id}"
 
-    patient_body = {
-        "resourceType": resource_type,
-        "active": True,
-        "id": resource_id,
-    }
+    resource_body = dict(body) if body is not None else {"active": True}
+    resource_body["resourceType"] = resource_type
+    resource_body["id"] = resource_id
 
     request = (
         healthcare_client.projects()
@@ -451,15 +653,18 @@ def update_resource(
         .datasets()
         .fhirStores()
         .fhir()
-        .update(name=fhir_resource_path, body=patient_body)
+        .update(name=fhir_resource_path, body=resource_body)
     )
     # Sets required application/fhir+json header on the googleapiclient.http.HttpRequest.
     request.headers["content-type"] = "application/fhir+json;charset=utf-8"
-    response = request.execute()
+    if if_match:
+        request.headers["if-match"] = if_match
+    with span("upstream"):
+        response = request.execute()
 
     print(
-        f"Updated {resource_type} resource with ID {resource_id}:\n"
-        f" {json.dumps(response, indent=2)}"
+        f"Updated {resource_type} resource with ID {resource_id}"
+        f" (version {response.get('meta', {}).get('versionId')})"
     )
 
     return response
@@ -471,11 +676,24 @@ def patch_resource(
     resource_type: str,
     resource_id: str,
     fhir_store_parent: str,
-    healthcare_client: str
+    healthcare_client: str,
+    patch: list = None,
+    if_match: str = None,
 ) -> Dict[str, Any]:
+    """
+    Applies a JSON Patch (RFC 6902) to a FHIR resource.
+
+    Args:
+        patch: The JSON Patch operations. Defaults to setting "active" to False.
+        if_match: An ETag such as 'W/"<versionId>"' for optimistic concurrency.
+
+    Returns:
+        A dict representing the patched resource.
+    """
     fhir_resource_path = f"{fhir_store_parent}/fhirStores/{fhir_store_id}/fhir/{resource_type}/{resource_id}"
 
-    patient_body = [{"op": "replace", "path": "/active", "value": False}]
+    if patch is None:
+        patch = [{"op": "replace", "path": "/active", "value": False}]
 
     request = (
         healthcare_client.projects()
@@ -483,18 +701,21 @@ def patch_resource(
         .datasets()
         .fhirStores()
         .fhir()
-        .patch(name=fhir_resource_path, body=patient_body)
+        .patch(name=fhir_resource_path, body=patch)
     )
 
     # Sets required application/json-patch+json header.
     # See https://tools.ietf.org/html/rfc6902 for more information.
     request.headers["content-type"] = "application/json-patch+json"
+    if if_match:
+        request.headers["if-match"] = if_match
 
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
 
     print(
-        f"Patched {resource_type} resource with ID {resource_id}:\n"
-        f" {json.dumps(response, indent=2)}"
+        f"Patched {resource_type} resource with ID {resource_id}"
+        f" (version {response.get('meta', {}).get('versionId')})"
     )
 
     return response
@@ -518,7 +739,8 @@ def get_resource(
         .fhir()
         .read(name=fhir_resource_path)
     )
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(
         f"Got contents of {resource_type} resource with ID {resource_id}:\n",
         json.dumps(response, indent=2),
@@ -532,6 +754,8 @@ def search_patient_by_mrn(
     dataset_id: str,
     fhir_store_id: str,
     mrn: str,
+    params: Dict[str, str] = None,
+    session: Any = None,
 ) -> Dict[str, Any]:
     """
     Searches for a Patient resource using their Medical Record Number (MRN).
@@ -542,20 +766,16 @@ def search_patient_by_mrn(
         dataset_id: The ID of the dataset.
         fhir_store_id: The ID of the FHIR store.
         mrn: The Medical Record Number to search for.
+        params: Extra FHIR search parameters, e.g. {"_elements": "name,gender"}.
+        session: A pooled AuthorizedSession to reuse; a new one is created if omitted.
 
     Returns:
         A dict representing the FHIR search bundle.
     """
-    import google.auth
-    
-    # Gets credentials from the environment.
-    credentials, _ = google.auth.default(
-        scopes=["https://www.googleapis.com/auth/cloud-platform"]
-    )
     # Creates a requests Session object with the credentials.
-    authed_session = requests.AuthorizedSession(credentials)
+    authed_session = session or requests.AuthorizedSession(get_credentials())
 
-    base_url = "https://healthcare.googleapis.com/v1"
+    base_url = f"{HEALTHCARE_API_ENDPOINT}/v1"
     fhir_store_path = (
         f"{base_url}/projects/{project_id}/locations/{location}"
         f"/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
@@ -572,10 +792,12 @@ def search_patient_by_mrn(
     headers = {"Content-Type": "application/fhir+json;charset=utf-8"}
     
     print(f"Searching for Patient with MRN at URL: {search_url}")
-    response = authed_session.get(search_url, headers=headers)
+    with span("upstream"):
+        response = authed_session.get(search_url, headers=headers, params=params)
     response.raise_for_status()
 
-    return response.json()
+    with span("parse"):
+        return loads(response.content)
 
 ## Getting all patient compartment resources
 
@@ -585,6 +807,9 @@ def get_patient_everything_by_mrn(
     dataset_id: str,
     fhir_store_id: str,
     mrn: str,
+    params: Dict[str, str] = None,
+    raw: bool = False,
+    session: Any = None,
 ) -> Dict[str, Any]:
     """
     Finds a patient by MRN and then retrieves all resources in their compartment
@@ -596,9 +821,13 @@ def get_patient_everything_by_mrn(
         dataset_id: The ID of the dataset.
         fhir_store_id: The ID of the FHIR store.
         mrn: The Medical Record Number to search for.
+        params: Extra parameters passed through to $everything, e.g. {"_elements": "code"}.
+        raw: Return the upstream response body as bytes instead of parsing it.
+        session: A pooled AuthorizedSession to reuse for both requests.
 
     Returns:
-        A dict representing the FHIR $everything bundle.
+        A dict representing the FHIR $everything bundle with every page merged,
+        or its JSON bytes if raw is set.
 
     Raises:
         Exception: If no patient is found for the given MRN.
@@ -606,7 +835,7 @@ def get_patient_everything_by_mrn(
     # STEP 1: Find the patient by MRN to get their internal FHIR ID.
     print(f"Searching for patient with MRN: {mrn}")
     patient_search_bundle = search_patient_by_mrn(
-        project_id, location, dataset_id, fhir_store_id, mrn
+        project_id, location, dataset_id, fhir_store_id, mrn, session=session
     )
 
     if (
@@ -628,27 +857,56 @@ def get_patient_everything_by_mrn(
     print(f"Fetching all records for patient ID: {patient_id}")
     # Note: We are now calling the existing get_patient_everything function
     everything_bundle = get_patient_everything(
-        project_id, location, dataset_id, fhir_store_id, patient_id
+        project_id, location, dataset_id, fhir_store_id, patient_id, params, raw, session
     )
 
     return everything_bundle
 
+def _next_page_url(bundle: Dict[str, Any]) -> Optional[str]:
+    return next((link["url"] for link in bundle.get("link", []) if link.get("relation") == "next"), None)
+
+
+def iter_bundle_pages(
+    url: str,
+    params: Optional[Dict[str, str]] = None,
+    session: Any = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yields every page of a search or $everything result by following "next" links.
+
+    Args:
+        url: The search or operation URL of the first page.
+        params: Query parameters for the first page; later pages' links already carry them.
+        session: A pooled AuthorizedSession to reuse; a new one is created if omitted.
+    """
+    authed_session = session or requests.AuthorizedSession(get_credentials())
+    headers = {"Content-Type": "application/fhir+json;charset=utf-8"}
+    while url:
+        with span("upstream"):
+            response = authed_session.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        with span("parse"):
+            bundle = loads(response.content)
+        yield bundle
+        params = None
+        url = _next_page_url(bundle)
+
+
 def get_patient_everything(
     project_id,
     location,
     dataset_id,
     fhir_store_id,
     resource_id,
+    params=None,
+    raw=False,
+    session=None,
 ):  
-    # Gets credentials from the environment.
-    credentials, _ = google.auth.default(
-        scopes=["https://www.googleapis.com/auth/cloud-platform"]
-    )
-    # Creates a requests Session object with the credentials.
-    authed_session = requests.AuthorizedSession(credentials)
+    # Creates a requests Session object with the credentials, unless a pooled one is given.
+    authed_session = session or requests.AuthorizedSession(get_credentials())
 
     # URL to the Cloud Healthcare API endpoint and version
-    base_url = "https://healthcare.googleapis.com/v1"
+    base_url = f"{HEALTHCARE_API_ENDPOINT}/v1"
 
     url = f"{base_url}/projects/{project_id}/locations/{location}"
 
@@ -660,13 +918,30 @@ def get_patient_everything(
     # Sets required application/fhir+json header on the request
     headers = {"Content-Type": "application/fhir+json;charset=utf-8"}
 
-    response = authed_session.get(resource_path, headers=headers)
+    with span("upstream"):
+        response = authed_session.get(resource_path, headers=headers, params=params)
     response.raise_for_status()
 
-    resource = response.json()
+    # A single-page result is forwarded as-is, so skip parsing it here.
+    if raw and b'"next"' not in response.content:
+        return response.content
+
+    with span("parse"):
+        resource = loads(response.content)
 
-    print(json.dumps(resource, indent=2))
+    # Large compartments are paged; merge every page into the first bundle.
+    next_url = _next_page_url(resource)
+    if next_url:
+        entries = resource.setdefault("entry", [])
+        for page in iter_bundle_pages(next_url, session=authed_session):
+            entries.extend(page.get("entry", []))
+        resource["link"] = [link for link in resource["link"] if link.get("relation") != "next"]
 
+    logger.info("Fetched $everything for Patient/%s: %d entries", resource_id, len(resource.get("entry", [])))
+
+    if raw:
+        with span("serialize"):
+            return dumps_bytes(resource)
     return resource
 
 ## Deleting a FHIR resource
@@ -688,7 +963,8 @@ def delete_resource(
         .fhir()
         .delete(name=fhir_resource_path)
     )
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(f"Deleted {resource_type} resource with ID {resource_id}.")
 
     return response
@@ -710,9 +986,61 @@ def delete_resource_purge(
         .fhir()
         .Resource_purge(name=fhir_resource_path)
     )
-    response = request.execute()
+    with span("upstream"):
+        response = request.execute()
     print(
         f"Deleted all versions of {resource_type} resource with ID"
         f" {resource_id} (excluding current version)."
     )
-    return response
\ No newline at end of file
+    return response
+
+
+## Finding scheduled patients
+
+def search_scheduled_patient_mrns(
+    project_id: str,
+    location: str,
+    dataset_id: str,
+    fhir_store_id: str,
+    date: str,
+    session: Any = None,
+) -> list:
+    """
+    Lists the MRNs of patients with a planned or in-progress encounter on a date.
+
+    Args:
+        project_id: The ID of the Google Cloud project.
+        location: The Cloud location of the dataset.
+        dataset_id: The ID of the dataset.
+        fhir_store_id: The ID of the FHIR store.
+        date: The census date (YYYY-MM-DD).
+        session: A pooled AuthorizedSession to reuse; a new one is created if omitted.
+
+    Returns:
+        A list of MRNs, in the order the encounters were returned.
+    """
+    base_url = f"{HEALTHCARE_API_ENDPOINT}/v1"
+    fhir_store_path = (
+        f"{base_url}/projects/{project_id}/locations/{location}"
+        f"/datasets/{dataset_id}/fhirStores/{fhir_store_id}"
+    )
+    # _include pulls the referenced Patient resources into the same bundle.
+    params = {
+        "date": date,
+        "status": "planned,arrived,in-progress",
+        "_include": "Encounter:subject",
+        "_count": "1000",
+    }
+
+    mrns = []
+    for bundle in iter_bundle_pages(f"{fhir_store_path}/fhir/Encounter", params, session):
+        for entry in bundle.get("entry", []):
+            resource = entry.get("resource", {})
+            if resource.get("resourceType") != "Patient":
+                continue
+            mrn = get_mrn(resource)
+            if mrn and mrn not in mrns:
+                mrns.append(mrn)
+
+    logger.info("Found %d scheduled patients for %s", len(mrns), date)
+    return mrns
@@ -0,0 +1,283 @@
+# Import Library
+
+from typing import Any, Callable, Dict, Iterator, Optional
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+try:
+    from google.api_core.exceptions import DeadlineExceeded
+    from google.cloud import pubsub_v1
+except ImportError:  # google-cloud-pubsub is only needed for the Pub/Sub feed.
+    pubsub_v1 = None
+
+from script.cache import PatientCache, patient_id_for_resource
+from script.jsonio import loads
+
+logger = logging.getLogger(__name__)
+
+# Cloud Healthcare API FHIR store notifications carry the resource name as the
+# message data, e.g. "projects/p/locations/l/datasets/d/fhirStores/s/fhir/Observation/123",
+# or the full resource JSON when the store is configured with sendFullResource.
+# The attributes include "action" (CreateResource, UpdateResource, PatchResource,
+# DeleteResource) and "resourceType".
+
+
+def parse_notification(data: Any, attributes: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Normalises a FHIR store change notification.
+
+    Args:
+        data: The message payload, either a resource name or a resource (as JSON
+            text, bytes or an already decoded dict).
+        attributes: The Pub/Sub message attributes.
+
+    Returns:
+        A dict with "action", "resource_type", "resource_id" and "resource"
+        (the full resource, or None for name-only notifications).
+    """
+    attributes = attributes or {}
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+
+    resource = None
+    if isinstance(data, dict):
+        resource = data
+    elif data.lstrip().startswith("{"):
+        resource = json.loads(data)
+
+    if resource is not None:
+        resource_type = resource.get("resourceType")
+        resource_id = resource.get("id")
+    else:
+        parts = data.strip().rstrip("/").split("/")
+        resource_type, resource_id = parts[-2], parts[-1]
+
+    return {
+        "action": attributes.get("action", "UpdateResource"),
+        "resource_type": attributes.get("resourceType", resource_type),
+        "resource_id": resource_id,
+        "resource": resource,
+    }
+
+
+class InvalidationHandler:
+    """
+    Applies change notifications to a PatientCache.
+
+    Each change is mapped to its patient compartment: the resource's own id for
+    Patient, its "subject"/"patient" reference when the full resource is in the
+    notification, otherwise the cache's reference index, and as a last resort
+    the optional fetch_resource callable. Only that patient's entries are
+    touched. With a refresh callable, which returns a patient's upstream
+    $everything bytes by MRN, the bundle is reloaded instead of just being
+    dropped.
+    """
+
+    def __init__(
+        self,
+        cache: PatientCache,
+        fetch_resource: Optional[Callable[[str, str], Dict[str, Any]]] = None,
+        refresh: Optional[Callable[[str], bytes]] = None,
+    ):
+        self.cache = cache
+        self.fetch_resource = fetch_resource
+        self.refresh = refresh
+        self.processed = 0
+        self.unmapped = 0
+        self.feed_errors = 0
+
+    def resolve_patient_id(self, change: Dict[str, Any]) -> Optional[str]:
+        if change["resource"] is not None:
+            patient_id = patient_id_for_resource(change["resource"])
+            if patient_id:
+                return patient_id
+        patient_id = self.cache.patient_id_for_reference(change["resource_type"], change["resource_id"])
+        if patient_id:
+            return patient_id
+        # A deleted resource can no longer be read upstream.
+        if self.fetch_resource is not None and change["action"] != "DeleteResource":
+            try:
+                return patient_id_for_resource(
+                    self.fetch_resource(change["resource_type"], change["resource_id"])
+                )
+            except Exception as e:
+                logger.warning(f"Could not read {change['resource_type']}/{change['resource_id']}: {e}")
+        return None
+
+    def handle(self, change: Dict[str, Any]) -> Optional[str]:
+        """Invalidates the entries affected by one change. Returns the patient id, if mapped."""
+        self.processed += 1
+        patient_id = self.resolve_patient_id(change)
+        if not patient_id:
+            self.unmapped += 1
+            logger.info(f"Change to {change['resource_type']}/{change['resource_id']} is not in any cached compartment.")
+            return None
+
+        # Looked up first: evicting a patient's last entry also forgets their MRN.
+        mrn = self.cache.mrn_for_patient(patient_id)
+        if change["action"] == "CreateResource":
+            # The snapshot can stay if the new resource is applied to it, or
+            # already was (writes made through this app are applied when they
+            # succeed). Updates and deletes always drop it.
+            evicted = self.cache.apply_create(
+                patient_id, change["resource_type"], change["resource_id"], change["resource"]
+            )
+        else:
+            evicted = self.cache.evict_patient(patient_id)
+        refreshed = False
+        if self.refresh is not None and "everything" in evicted and mrn:
+            try:
+                raw = self.refresh(mrn)
+                self.cache.store_bundle(mrn, loads(raw), raw=raw)
+                refreshed = True
+            except Exception as e:
+                logger.warning(f"Refresh of patient {patient_id} failed, entry stays evicted: {e}")
+
+        logger.info(
+            f"{change['action']} {change['resource_type']}/{change['resource_id']} -> "
+            f"Patient/{patient_id}: evicted {evicted or 'nothing'}{' (refreshed)' if refreshed else ''}"
+        )
+        return patient_id
+
+
+## Notification feeds
+#
+# A feed is any iterator of (data, attributes) tuples. It blocks until the
+# next message is available and stops when it is exhausted or stopped.
+
+
+def file_notification_feed(
+    path: str,
+    stop_event: Optional[threading.Event] = None,
+    poll_interval: float = 1.0,
+) -> Iterator[tuple]:
+    """
+    Tails an NDJSON file of notifications, a local stand-in for Pub/Sub.
+
+    Each line is {"data": <resource name or resource>, "attributes": {...}}.
+    Lines appended while the feed is running are picked up on the next poll.
+    """
+    stop_event = stop_event or threading.Event()
+    position = 0
+    while not stop_event.is_set():
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                f.seek(position)
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        # Partially written line, read it again next time.
+                        break
+                    position = f.tell()
+                    if line.strip():
+                        try:
+                            message = json.loads(line)
+                        except ValueError:
+                            logger.warning(f"Skipping malformed notification line in {path}: {line.strip()!r}")
+                            continue
+                        yield message["data"], message.get("attributes", {})
+        stop_event.wait(poll_interval)
+
+
+def queue_notification_feed(
+    notifications: "queue.Queue",
+    stop_event: Optional[threading.Event] = None,
+) -> Iterator[tuple]:
+    """Yields (data, attributes) tuples put on an in-process queue."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            yield notifications.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+
+def pubsub_notification_feed(
+    subscription_path: str,
+    stop_event: Optional[threading.Event] = None,
+) -> Iterator[tuple]:
+    """
+    Yields notifications pulled from a Pub/Sub subscription.
+
+    The client is created and the subscription looked up before this returns,
+    so a missing package, subscription or permission fails at startup instead
+    of on the worker thread.
+
+    Pub/Sub delivers each message to one subscriber only, while the patient
+    cache lives in each process. Every process that caches (each gunicorn
+    worker) therefore needs a subscription of its own.
+
+    Raises:
+        ImportError: When the google-cloud-pubsub package is not installed.
+    """
+    if pubsub_v1 is None:
+        raise ImportError("Reading FHIR notifications from Pub/Sub requires the google-cloud-pubsub package.")
+    subscriber = pubsub_v1.SubscriberClient()
+    try:
+        subscriber.get_subscription(request={"subscription": subscription_path})
+    except Exception:
+        subscriber.close()
+        raise
+    return _pull_pubsub(subscriber, subscription_path, stop_event or threading.Event())
+
+
+def _pull_pubsub(subscriber: Any, subscription_path: str, stop_event: threading.Event) -> Iterator[tuple]:
+    with subscriber:
+        while not stop_event.is_set():
+            try:
+                response = subscriber.pull(
+                    request={"subscription": subscription_path, "max_messages": 100},
+                    timeout=30,
+                )
+            except DeadlineExceeded:
+                # Nothing arrived within the timeout on an idle subscription.
+                continue
+            ack_ids = []
+            for received in response.received_messages:
+                yield received.message.data, dict(received.message.attributes)
+                ack_ids.append(received.ack_id)
+            if ack_ids:
+                subscriber.acknowledge(
+                    request={"subscription": subscription_path, "ack_ids": ack_ids}
+                )
+
+
+def start_invalidation_worker(
+    open_feed: Callable[[], Iterator[tuple]],
+    handler: InvalidationHandler,
+    retry_interval: float = 5.0,
+) -> threading.Thread:
+    """
+    Consumes a notification feed on a daemon thread.
+
+    The feed is opened once before the thread starts, so anything open_feed
+    checks up front (see pubsub_notification_feed) fails at startup. If the feed breaks later, the error
+    is logged and the feed is opened again after retry_interval seconds rather
+    than leaving the cache on TTLs alone.
+    """
+    first_feed = open_feed()
+
+    def run():
+        feed = first_feed
+        while True:
+            try:
+                if feed is None:
+                    feed = open_feed()
+                for data, attributes in feed:
+                    try:
+                        handler.handle(parse_notification(data, attributes))
+                    except Exception as e:
+                        logger.warning(f"Could not process notification {data!r}: {e}")
+                return
+            except Exception as e:
+                handler.feed_errors += 1
+                logger.error(f"Notification feed failed, reopening in {retry_interval}s: {e}")
+                feed = None
+                time.sleep(retry_interval)
+
+    worker = threading.Thread(target=run, name="cache-invalidation", daemon=True)
+    worker.start()
+    return worker
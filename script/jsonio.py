@@ -0,0 +1,97 @@
+# Import Library
+
+from typing import Any, Union
+import json
+
+from flask.json.provider import DefaultJSONProvider
+from googleapiclient.model import JsonModel
+
+from script.profiling import span
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib json module is the fallback.
+    orjson = None
+
+
+def dumps_bytes(obj: Any, default: Any = None) -> bytes:
+    """Serializes to compact UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any, default: Any = None) -> str:
+    return dumps_bytes(obj, default).decode("utf-8")
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    """Parses JSON text or bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that uses orjson for jsonify() and request.get_json().
+
+    Output follows the default provider's settings: keys are sorted when
+    sort_keys is set, dates use the same HTTP date format, and responses end
+    with a newline. The differences are that non-ASCII characters are written
+    as UTF-8 rather than \\u escapes, and dumps() output is always compact.
+    Calls with extra json.dumps arguments and pretty-printed (debug or
+    compact=False) responses are left to the default provider.
+    """
+
+    def _dumps_bytes(self, obj: Any) -> bytes:
+        if orjson is None:
+            return json.dumps(
+                obj, default=self.default, ensure_ascii=self.ensure_ascii,
+                sort_keys=self.sort_keys, separators=(",", ":"),
+            ).encode("utf-8")
+        # Dates go through self.default, like with the default provider.
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj).decode("utf-8")
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Any:
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        with span("serialize"):
+            body = self._dumps_bytes(obj) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class FastJsonModel(JsonModel):
+    """googleapiclient request/response model that (de)serializes with orjson."""
+
+    def serialize(self, body_value: Any) -> str:
+        if isinstance(body_value, dict) and "data" not in body_value and self._data_wrapper:
+            body_value = {"data": body_value}
+        return dumps(body_value)
+
+    def deserialize(self, content: Union[str, bytes]) -> Any:
+        """Like JsonModel.deserialize, a body that is not JSON is returned as text."""
+        try:
+            with span("parse"):
+                body = loads(content)
+        except ValueError:
+            if isinstance(content, bytes):
+                content = content.decode("utf-8")
+            return content
+        if self._data_wrapper and isinstance(body, dict) and "data" in body:
+            body = body["data"]
+        return body
@@ -0,0 +1,263 @@
+# Import Library
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from bisect import bisect_left, insort
+import heapq
+import re
+import threading
+
+from script.cache import get_mrn
+from script.jsonio import loads
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_DATE = re.compile(r"^\d{4}(-\d{2}(-\d{2})?)?$")
+
+# Score of a query token matching a name token, by match kind.
+EXACT, PREFIX, PHONETIC, FUZZY = 4, 3, 2, 1
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(token: str) -> str:
+    """American Soundex, e.g. "Robert" and "Rupert" -> "R163"."""
+    token = "".join(c for c in token.lower() if c.isalpha())
+    if not token:
+        return ""
+    code = token[0].upper()
+    previous = _SOUNDEX_CODES.get(token[0], "")
+    for c in token[1:]:
+        digit = _SOUNDEX_CODES.get(c, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # "h" and "w" do not separate letters with the same code; vowels do.
+        if c not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def _deletes(token: str) -> Set[str]:
+    """All strings one deletion away from token, for edit-distance-1 lookups."""
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def patient_record(patient: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a Patient resource the index keeps and returns."""
+    name = (patient.get("name") or [{}])[0]
+    return {
+        "id": patient.get("id"),
+        "mrn": get_mrn(patient),
+        "family": name.get("family", ""),
+        "given": " ".join(name.get("given", [])),
+        "birthDate": patient.get("birthDate", ""),
+        "gender": patient.get("gender", ""),
+    }
+
+
+class PatientIndex:
+    """
+    Local index of patient demographics for front-desk search.
+
+    Name tokens are indexed four ways: exactly, by prefix (a sorted token list
+    searched with bisect), by Soundex code, and by single-character deletions
+    so that a one-letter typo still matches. MRNs match exactly or by prefix
+    and birth dates by prefix ("1970", "1970-01").
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._by_token: Dict[str, Set[str]] = {}
+        self._sorted_tokens: List[str] = []
+        self._by_soundex: Dict[str, Set[str]] = {}
+        self._by_delete: Dict[str, Set[str]] = {}
+        self._by_mrn: Dict[str, str] = {}
+        self._sorted_mrns: List[str] = []
+        self._sorted_births: List[Tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def add(self, patient: Dict[str, Any], keep_sorted: bool = True) -> None:
+        """
+        Adds or replaces a Patient resource.
+
+        add_all passes keep_sorted=False and sorts once at the end, which is
+        much faster than inserting into the sorted lists one by one.
+        """
+        insert = insort if keep_sorted else list.append
+        record = patient_record(patient)
+        if not record["id"]:
+            return
+        with self._lock:
+            if record["id"] in self._records:
+                self.remove(record["id"])
+            self._records[record["id"]] = record
+            for token in set(_tokens(f"{record['family']} {record['given']}")):
+                if token not in self._by_token:
+                    self._by_token[token] = set()
+                    insert(self._sorted_tokens, token)
+                    for deleted in _deletes(token) | {token}:
+                        self._by_delete.setdefault(deleted, set()).add(token)
+                self._by_token[token].add(record["id"])
+                self._by_soundex.setdefault(soundex(token), set()).add(token)
+            if record["birthDate"]:
+                insert(self._sorted_births, (record["birthDate"], record["id"]))
+            if record["mrn"]:
+                mrn = record["mrn"].lower()
+                self._by_mrn[mrn] = record["id"]
+                insert(self._sorted_mrns, mrn)
+
+    def remove(self, patient_id: str) -> None:
+        with self._lock:
+            record = self._records.pop(patient_id, None)
+            if record is None:
+                return
+            for token in set(_tokens(f"{record['family']} {record['given']}")):
+                self._by_token.get(token, set()).discard(patient_id)
+            # Tokens stay in the prefix/phonetic/typo indexes; they only lead to
+            # candidates that are checked against _by_token.
+            if record["birthDate"]:
+                self._sorted_births.pop(bisect_left(self._sorted_births, (record["birthDate"], patient_id)))
+            mrn = (record["mrn"] or "").lower()
+            if mrn and self._by_mrn.get(mrn) == patient_id:
+                del self._by_mrn[mrn]
+                self._sorted_mrns.pop(bisect_left(self._sorted_mrns, mrn))
+
+    def _sort(self) -> None:
+        self._sorted_tokens.sort()
+        self._sorted_births.sort()
+        self._sorted_mrns.sort()
+
+    def add_all(self, patients: Iterable[Dict[str, Any]]) -> int:
+        count = 0
+        with self._lock:
+            for patient in patients:
+                if patient.get("resourceType") != "Patient":
+                    continue
+                if patient.get("id") in self._records:
+                    # Replacing a patient bisects the sorted lists, so sort
+                    # what was appended so far first.
+                    self._sort()
+                self.add(patient, keep_sorted=False)
+                count += 1
+            self._sort()
+        return count
+
+    def _name_matches(self, token: str) -> Dict[str, int]:
+        """Maps indexed name tokens matching a query token to their best score."""
+        matches: Dict[str, int] = {}
+        start = bisect_left(self._sorted_tokens, token)
+        while start < len(self._sorted_tokens) and self._sorted_tokens[start].startswith(token):
+            name_token = self._sorted_tokens[start]
+            matches[name_token] = EXACT if name_token == token else PREFIX
+            start += 1
+        for name_token in self._by_soundex.get(soundex(token), ()):
+            matches.setdefault(name_token, PHONETIC)
+        if len(token) >= 4:
+            for deleted in _deletes(token) | {token}:
+                for name_token in self._by_delete.get(deleted, ()):
+                    matches.setdefault(name_token, FUZZY)
+        return matches
+
+    def _born(self, prefix: str) -> Set[str]:
+        """Ids of patients whose birthDate starts with prefix."""
+        start = bisect_left(self._sorted_births, (prefix,))
+        end = bisect_left(self._sorted_births, (prefix + "\uffff",), start)
+        return {patient_id for _, patient_id in self._sorted_births[start:end]}
+
+    def search(self, query: str, gender: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Searches by any mix of MRN, name tokens and birth date, e.g. "smith jo 1970".
+
+        Every name token in the query must match; results are ranked by how
+        closely they matched (exact, prefix, phonetic, then typo).
+        """
+        with self._lock:
+            # For each query token, the matching patients grouped by match score.
+            # Sets are combined with C-level unions/intersections so only the
+            # final candidates are scored one by one.
+            token_levels: List[Dict[int, Set[str]]] = []
+            birth_prefixes = []
+            for token in query.lower().split():
+                if _DATE.match(token):
+                    birth_prefixes.append(token)
+                    continue
+                levels: Dict[int, Set[str]] = {}
+                # MRNs match exactly or by prefix.
+                start = bisect_left(self._sorted_mrns, token)
+                while start < len(self._sorted_mrns) and self._sorted_mrns[start].startswith(token):
+                    mrn = self._sorted_mrns[start]
+                    levels.setdefault(EXACT + 1 if mrn == token else PREFIX, set()).add(self._by_mrn[mrn])
+                    start += 1
+                for part in _tokens(token):
+                    for name_token, score in self._name_matches(part).items():
+                        levels.setdefault(score, set()).update(self._by_token.get(name_token, ()))
+                token_levels.append(levels)
+
+            born: Optional[Set[str]] = None
+            for prefix in birth_prefixes:
+                born = self._born(prefix) if born is None else born & self._born(prefix)
+            if born is not None:
+                for levels in token_levels:
+                    for level in levels:
+                        levels[level] &= born
+
+            if token_levels:
+                candidates = set().union(*token_levels[0].values())
+                for levels in token_levels[1:]:
+                    candidates.intersection_update(set().union(*levels.values()))
+            else:
+                # Only a birth date (or nothing) was given.
+                candidates = born or set()
+
+            def matching(patient_ids):
+                for patient_id in patient_ids:
+                    record = self._records.get(patient_id)
+                    if record is None:
+                        continue
+                    if gender and record["gender"] != gender:
+                        continue
+                    yield patient_id, record
+
+            results = []
+            if len(token_levels) == 1:
+                # One token: its levels are already the ranking, so stop at the
+                # first level that fills the page.
+                seen: Set[str] = set()
+                for level in sorted(token_levels[0], reverse=True):
+                    ids = token_levels[0][level] - seen
+                    seen |= ids
+                    results.extend((level, record) for _, record in matching(ids))
+                    if len(results) >= limit:
+                        break
+            else:
+                for patient_id, record in matching(candidates):
+                    score = sum(
+                        max(level for level, ids in levels.items() if patient_id in ids)
+                        for levels in token_levels
+                    )
+                    results.append((score, record))
+            results = heapq.nsmallest(
+                limit, results, key=lambda item: (-item[0], item[1]["family"], item[1]["given"])
+            )
+            return [dict(record, score=score) for score, record in results]
+
+def read_patient_ndjson(path: str) -> Iterable[Dict[str, Any]]:
+    """Reads Patient resources from an NDJSON bulk export file."""
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
@@ -0,0 +1,124 @@
+# Import Library
+
+from typing import Any, Dict, Iterable, Optional
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available.
+    brotli = None
+
+# Elements every projected resource keeps so the client can still identify it.
+ALWAYS_KEPT_ELEMENTS = ("resourceType", "id")
+
+# Responses smaller than this are not worth the CPU to compress.
+MIN_COMPRESS_SIZE = 1024
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/fhir+json", "text/html", "text/css", "application/javascript")
+
+
+def parse_fields(value: Optional[str]) -> Optional[Dict[str, set]]:
+    """
+    Parses a fields= projection, e.g. "code,subject,Observation.valueQuantity".
+
+    Returns:
+        A dict of resource type (or "*" for all types) to the set of top-level
+        element names to keep, or None when no projection was requested.
+    """
+    if not value:
+        return None
+    fields: Dict[str, set] = {"*": set()}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "." in item:
+            resource_type, element = item.split(".", 1)
+            fields.setdefault(resource_type, set()).add(element)
+        else:
+            fields["*"].add(item)
+    return fields
+
+
+def project_resource(resource: Dict[str, Any], fields: Dict[str, set]) -> Dict[str, Any]:
+    """Trims a resource to the requested top-level elements."""
+    keep = fields["*"] | fields.get(resource.get("resourceType"), set())
+    return {
+        key: value
+        for key, value in resource.items()
+        if key in keep or key in ALWAYS_KEPT_ELEMENTS
+    }
+
+
+def project_bundle(bundle: Dict[str, Any], fields: Optional[Dict[str, set]]) -> Dict[str, Any]:
+    """
+    Applies a fields= projection to a resource or to every resource in a bundle.
+
+    The input is not modified, so cached bundles can be projected safely.
+    """
+    if not fields:
+        return bundle
+    if bundle.get("resourceType") != "Bundle":
+        return project_resource(bundle, fields)
+    projected = {key: value for key, value in bundle.items() if key != "entry"}
+    if "entry" in bundle:
+        projected["entry"] = [
+            {**entry, "resource": project_resource(entry["resource"], fields)}
+            if "resource" in entry else entry
+            for entry in bundle["entry"]
+        ]
+    return projected
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks "br" or "gzip" from an Accept-Encoding header, preferring brotli."""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(token.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        # Quality 5 is much faster than the default 11 for a small size cost.
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def compress_response(response: Any, accept_encoding: str) -> Any:
+    """
+    Compresses a Flask response in place when the client accepts it.
+
+    Streamed, already encoded, small and non-text responses are left untouched.
+    """
+    if (
+        response.direct_passthrough
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    encoding = choose_encoding(accept_encoding or "")
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(compress_body(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    response.headers["Content-Length"] = str(len(response.get_data()))
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def upstream_params(args: Any, names: Iterable[str] = ("_elements", "_summary")) -> Dict[str, str]:
+    """Collects the FHIR search parameters that are passed through to the store."""
+    return {name: args[name] for name in names if args.get(name)}
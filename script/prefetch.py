@@ -0,0 +1,190 @@
+# Import Library
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import threading
+import time
+
+from script.cache import PatientCache
+from script.jsonio import loads
+
+logger = logging.getLogger(__name__)
+
+
+def read_mrn_file(path: str) -> List[str]:
+    """Reads one MRN per line, skipping blank lines and '#' comments."""
+    mrns = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                mrns.append(line)
+    return mrns
+
+
+def parse_window(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parses an off-peak window like "1-6" (01:00 to 06:00 local time)."""
+    if not value:
+        return None
+    start, end = value.split("-", 1)
+    return int(start), int(end)
+
+
+def in_window(window: Optional[Tuple[int, int]], now: Optional[datetime] = None) -> bool:
+    if window is None:
+        return True
+    hour = (now or datetime.now()).hour
+    start, end = window
+    if start <= end:
+        return start <= hour < end
+    # Windows may wrap past midnight, e.g. "22-5".
+    return hour >= start or hour < end
+
+
+class PrefetchScheduler:
+    """
+    Warms the PatientCache for a list of upcoming patients.
+
+    MRNs are fetched one at a time on a daemon thread, no faster than
+    rate_per_second, only inside the off-peak window, and never while
+    is_busy() reports interactive requests in flight. Requests served later
+    are reported back with record_request() so the warm-hit ratio (the share
+    of requests for prefetched patients that found a warm cache) can be tuned.
+
+    fetch_everything(mrn, raw=True) must return the upstream $everything
+    bytes; they are cached with the parsed bundle so hits need no serializing.
+
+    The prefetched MRNs are remembered for the warm-hit ratio only until the
+    next off-peak window opens, and never more than max_tracked of them.
+    """
+
+    def __init__(
+        self,
+        cache: PatientCache,
+        fetch_everything: Callable[..., bytes],
+        rate_per_second: float = 2.0,
+        ttl_seconds: Optional[float] = None,
+        window: Optional[Tuple[int, int]] = None,
+        is_busy: Optional[Callable[[], bool]] = None,
+        summarize: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        max_tracked: int = 10000,
+    ):
+        self.cache = cache
+        self.fetch_everything = fetch_everything
+        self.rate_per_second = rate_per_second
+        self.ttl_seconds = ttl_seconds
+        self.window = window
+        self.is_busy = is_busy or (lambda: False)
+        self.summarize = summarize
+        self.max_tracked = max_tracked
+        self._lock = threading.Lock()
+        self._pending: List[str] = []
+        self._queued = set()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.prefetched: "OrderedDict[str, None]" = OrderedDict()
+        self.stats = {
+            "scheduled": 0,
+            "prefetched": 0,
+            "failed": 0,
+            "warm_hits": 0,
+            "cold_misses": 0,
+        }
+
+    def schedule(self, mrns: Iterable[str]) -> int:
+        """Queues MRNs for prefetching. Returns how many were newly queued."""
+        added = 0
+        with self._lock:
+            for mrn in mrns:
+                if mrn not in self._queued:
+                    self._queued.add(mrn)
+                    self._pending.append(mrn)
+                    added += 1
+            self.stats["scheduled"] += added
+        self._wakeup.set()
+        return added
+
+    def prefetch_one(self, mrn: str) -> bool:
+        """Fetches and caches one patient's bundle, timeline and summary."""
+        if self.cache.get("everything", self.cache.patient_id_for_mrn(mrn)) is not None:
+            self._mark_prefetched(mrn)
+            return True
+        try:
+            raw = self.fetch_everything(mrn, raw=True)
+            bundle = loads(raw)
+            patient_id = self.cache.store_bundle(mrn, bundle, self.ttl_seconds, raw=raw)
+            if self.summarize is not None and patient_id:
+                self.cache.set("summary", patient_id, self.summarize(bundle), self.ttl_seconds)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.warning(f"Prefetch failed for MRN {mrn}: {e}")
+            return False
+        self._mark_prefetched(mrn)
+        self.stats["prefetched"] += 1
+        return True
+
+    def _mark_prefetched(self, mrn: str) -> None:
+        with self._lock:
+            self.prefetched[mrn] = None
+            self.prefetched.move_to_end(mrn)
+            while len(self.prefetched) > self.max_tracked:
+                self.prefetched.popitem(last=False)
+
+    def record_request(self, mrn: str, hit: bool) -> None:
+        """Reports an interactive request so warm hits can be counted."""
+        with self._lock:
+            if mrn not in self.prefetched:
+                return
+            self.stats["warm_hits" if hit else "cold_misses"] += 1
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            report = dict(self.stats)
+            report["pending"] = len(self._pending)
+        served = report["warm_hits"] + report["cold_misses"]
+        report["warm_hit_ratio"] = report["warm_hits"] / served if served else None
+        return report
+
+    def _next(self) -> Optional[str]:
+        with self._lock:
+            if not self._pending:
+                self._wakeup.clear()
+                return None
+            mrn = self._pending.pop(0)
+            self._queued.discard(mrn)
+            return mrn
+
+    def run(self) -> None:
+        interval = 1.0 / self.rate_per_second if self.rate_per_second > 0 else 0
+        window_open = False
+        while not self._stop.is_set():
+            was_open, window_open = window_open, in_window(self.window)
+            if window_open and not was_open and self.window is not None:
+                # A new off-peak window: the last one's patients have had their day.
+                with self._lock:
+                    self.prefetched.clear()
+            if not window_open or self.is_busy():
+                # Interactive traffic and peak hours always win; check again shortly.
+                self._stop.wait(1.0)
+                continue
+            mrn = self._next()
+            if mrn is None:
+                self._wakeup.wait(5.0)
+                continue
+            started = time.monotonic()
+            self.prefetch_one(mrn)
+            self._stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+    def start(self) -> threading.Thread:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="patient-prefetch", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
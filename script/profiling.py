@@ -0,0 +1,205 @@
+# Import Library
+
+from typing import Any, Dict, List, Optional
+from collections import Counter, deque
+from contextlib import nullcontext
+import os
+import sys
+import threading
+import time
+
+_local = threading.local()
+_NO_SPAN = nullcontext()
+
+
+class RequestProfile:
+    """Phase timings and stack samples collected for one request."""
+
+    def __init__(self, sampled: bool = False):
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.spans: Dict[str, float] = {}
+        self.samples: Counter = Counter()
+        self.open_spans: List["_Span"] = []
+        self.status: Optional[int] = None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+
+class _Span:
+    __slots__ = ("profile", "name", "started", "nested")
+
+    def __init__(self, profile: RequestProfile, name: str):
+        self.profile = profile
+        self.name = name
+        self.nested = 0.0
+
+    def __enter__(self):
+        self.profile.open_spans.append(self)
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        open_spans = self.profile.open_spans
+        open_spans.pop()
+        if open_spans:
+            open_spans[-1].nested += elapsed
+        # Spans are exclusive: time in a nested span only counts for that span.
+        self.profile.spans[self.name] = self.profile.spans.get(self.name, 0.0) + elapsed - self.nested
+        return False
+
+
+def span(name: str):
+    """
+    Times a phase of the current request, e.g. `with span("upstream"): ...`.
+
+    Repeated phases add up, and a nested span's time is taken out of the
+    enclosing one, so phases add up to at most the request time. Outside a
+    profiled request this returns a shared no-op context manager, so
+    instrumented code costs one attribute lookup when profiling is off.
+    """
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return _NO_SPAN
+    return _Span(profile, name)
+
+
+def begin_request(sampler: Optional["StackSampler"] = None) -> RequestProfile:
+    """Starts profiling the current thread's request, stack-sampling it if a sampler is given."""
+    profile = RequestProfile(sampled=sampler is not None)
+    _local.profile = profile
+    if sampler is not None:
+        sampler.register(threading.get_ident(), profile)
+    return profile
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return getattr(_local, "profile", None)
+
+
+def end_request(sampler: Optional["StackSampler"] = None) -> Optional[RequestProfile]:
+    profile = getattr(_local, "profile", None)
+    _local.profile = None
+    if profile is not None and profile.sampled and sampler is not None:
+        sampler.unregister(threading.get_ident())
+    return profile
+
+
+def _frame_name(code: Any) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(samples: Counter) -> List[str]:
+    """Formats stack samples as collapsed stacks ("root;...;leaf count"), as read by flamegraph.pl and speedscope."""
+    lines = []
+    for stack, count in samples.most_common():
+        lines.append(";".join(_frame_name(code) if not isinstance(code, str) else code for code in reversed(stack)) + f" {count}")
+    return lines
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of registered request threads at a fixed interval.
+
+    One background thread reads sys._current_frames() for all registered
+    threads, so the cost is bounded by the interval rather than by traffic,
+    and it sleeps without waking while no thread is registered.
+    Stacks are kept as tuples of code objects and only formatted on export.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._targets: Dict[int, RequestProfile] = {}
+        self._thread: Optional[threading.Thread] = None
+        # Set while any thread is registered; the sampler sleeps on it otherwise.
+        self._active = threading.Event()
+
+    def register(self, thread_id: int, profile: RequestProfile) -> None:
+        with self._lock:
+            self._targets[thread_id] = profile
+            self._active.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def unregister(self, thread_id: int) -> None:
+        with self._lock:
+            self._targets.pop(thread_id, None)
+            if not self._targets:
+                self._active.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                targets = list(self._targets.items())
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for thread_id, profile in targets:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if stack:
+                    profile.samples[tuple(stack)] += 1
+
+
+class ProfileStore:
+    """
+    Collapsed-stack profiles per route plus the most recent slow requests.
+
+    Each route keeps at most max_stacks distinct stacks; further new stacks
+    are counted under a single "[other]" entry so memory stays bounded.
+    """
+
+    def __init__(self, max_stacks: int = 5000, max_requests: int = 100):
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._stacks: Dict[str, Counter] = {}
+        self._profiled: Counter = Counter()
+        self.requests: deque = deque(maxlen=max_requests)
+
+    def add(self, route: str, profile: RequestProfile, record: Dict[str, Any]) -> None:
+        with self._lock:
+            stacks = self._stacks.setdefault(route, Counter())
+            for stack, count in profile.samples.items():
+                if stack not in stacks and len(stacks) >= self.max_stacks:
+                    stack = ("[other]",)
+                stacks[stack] += count
+            self._profiled[route] += 1
+            self.requests.append(record)
+
+    def collapsed(self, route: str) -> str:
+        with self._lock:
+            samples = Counter(self._stacks.get(route, ()))
+        return "\n".join(collapse(samples)) + "\n" if samples else ""
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "routes": {
+                    route: {"profiled_requests": self._profiled[route], "samples": sum(stacks.values())}
+                    for route, stacks in self._stacks.items()
+                },
+                "recent": list(self.requests),
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self._profiled.clear()
+            self.requests.clear()
+
+
+def server_timing(spans: Dict[str, float]) -> str:
+    """Formats spans as a Server-Timing header value, so browser dev tools show them."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in spans.items())
+
+
+def format_spans(spans: Dict[str, float]) -> str:
+    return " ".join(f"{name}={ms:.1f}ms" for name, ms in spans.items())
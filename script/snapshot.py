@@ -0,0 +1,186 @@
+# Import Library
+
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# LOINC codes of the vital signs kept in a snapshot (the FHIR vital signs
+# profile set). Observations with the "vital-signs" category count as well.
+VITAL_SIGN_CODES = {
+    "8867-4",   # Heart rate
+    "9279-1",   # Respiratory rate
+    "8310-5",   # Body temperature
+    "2708-6",   # Oxygen saturation in arterial blood
+    "59408-5",  # Oxygen saturation by pulse oximetry
+    "8480-6",   # Systolic blood pressure
+    "8462-4",   # Diastolic blood pressure
+    "85354-9",  # Blood pressure panel
+    "29463-7",  # Body weight
+    "8302-2",   # Body height
+    "39156-5",  # Body mass index
+}
+
+# How many of the newest diagnostic reports a snapshot keeps.
+RECENT_REPORTS = 5
+
+ACTIVE_CONDITION_STATUSES = ("active", "recurrence", "relapse")
+EXCLUDED_VERIFICATION_STATUSES = ("refuted", "entered-in-error")
+EXCLUDED_RESULT_STATUSES = ("entered-in-error", "cancelled")
+
+_EARLIEST = datetime.min.replace(tzinfo=timezone.utc)
+
+
+@lru_cache(maxsize=4096)
+def _instant(value: Optional[str]) -> datetime:
+    """
+    Parses a FHIR date or dateTime into an aware datetime for ordering.
+
+    Times in different offsets compare by the instant they denote, which
+    string comparison gets wrong. Partial dates ("2024", "2024-05") count from
+    their start, times without an offset are taken as UTC, and missing or
+    invalid values sort before everything else.
+    """
+    if not value:
+        return _EARLIEST
+    if len(value) == 4:
+        value += "-01-01"
+    elif len(value) == 7:
+        value += "-01"
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return _EARLIEST
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def _first_coding(concept: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return ((concept or {}).get("coding") or [{}])[0]
+
+
+def _display(concept: Optional[Dict[str, Any]]) -> Optional[str]:
+    return (concept or {}).get("text") or _first_coding(concept).get("display")
+
+
+def empty_snapshot(patient: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    patient = patient or {}
+    name = (patient.get("name") or [{}])[0]
+    return {
+        "patient": {
+            "id": patient.get("id"),
+            "name": " ".join(name.get("given", []) + [name.get("family", "")]).strip(),
+            "gender": patient.get("gender"),
+            "birthDate": patient.get("birthDate"),
+        },
+        "active_conditions": [],
+        "active_medications": [],
+        "latest_vitals": {},
+        "recent_reports": [],
+    }
+
+
+def _without(items: List[Dict[str, Any]], resource_id: Optional[str]) -> List[Dict[str, Any]]:
+    return [item for item in items if item["id"] != resource_id]
+
+
+def apply_resource(snapshot: Dict[str, Any], resource: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the snapshot with one created or updated resource applied.
+
+    The input snapshot is not modified: only the section the resource belongs
+    to is copied, so readers holding the old snapshot never see a half-applied
+    change. Applying the same resource twice gives the same result.
+    """
+    resource_type = resource.get("resourceType")
+    resource_id = resource.get("id")
+    snapshot = dict(snapshot)
+
+    if resource_type == "Condition":
+        conditions = _without(snapshot["active_conditions"], resource_id)
+        clinical = _first_coding(resource.get("clinicalStatus")).get("code")
+        verification = _first_coding(resource.get("verificationStatus")).get("code")
+        if clinical in ACTIVE_CONDITION_STATUSES and verification not in EXCLUDED_VERIFICATION_STATUSES:
+            conditions.append({
+                "id": resource_id,
+                "code": _first_coding(resource.get("code")).get("code"),
+                "display": _display(resource.get("code")),
+                "onset": resource.get("onsetDateTime"),
+            })
+            conditions.sort(key=lambda item: _instant(item["onset"]), reverse=True)
+        snapshot["active_conditions"] = conditions
+
+    elif resource_type == "MedicationRequest":
+        medications = _without(snapshot["active_medications"], resource_id)
+        if resource.get("status") == "active":
+            medications.append({
+                "id": resource_id,
+                "code": _first_coding(resource.get("medicationCodeableConcept")).get("code"),
+                "display": _display(resource.get("medicationCodeableConcept")),
+                "dosage": ((resource.get("dosageInstruction") or [{}])[0]).get("text"),
+                "authoredOn": resource.get("authoredOn"),
+            })
+            medications.sort(key=lambda item: _instant(item["authoredOn"]), reverse=True)
+        snapshot["active_medications"] = medications
+
+    elif resource_type == "Observation":
+        code = _first_coding(resource.get("code")).get("code")
+        is_vital = code in VITAL_SIGN_CODES or any(
+            coding.get("code") == "vital-signs"
+            for category in resource.get("category", [])
+            for coding in category.get("coding", [])
+        )
+        if not is_vital:
+            return snapshot
+        vitals = snapshot["latest_vitals"]
+        current = vitals.get(code)
+        effective = resource.get("effectiveDateTime") or ""
+        if resource.get("status") in EXCLUDED_RESULT_STATUSES:
+            # Only a retraction of the vital currently shown changes the snapshot.
+            if current is None or current["id"] != resource_id:
+                return snapshot
+            vitals = dict(vitals)
+            del vitals[code]
+        elif current is None or current["id"] == resource_id or _instant(effective) >= _instant(current["effectiveDateTime"]):
+            quantity = resource.get("valueQuantity", {})
+            vitals = dict(vitals)
+            vitals[code] = {
+                "id": resource_id,
+                "display": _display(resource.get("code")),
+                "value": quantity.get("value"),
+                "unit": quantity.get("unit"),
+                "effectiveDateTime": effective or None,
+            }
+        snapshot["latest_vitals"] = vitals
+
+    elif resource_type == "DiagnosticReport":
+        reports = _without(snapshot["recent_reports"], resource_id)
+        if resource.get("status") not in EXCLUDED_RESULT_STATUSES:
+            reports.append({
+                "id": resource_id,
+                "code": _first_coding(resource.get("code")).get("code"),
+                "display": _display(resource.get("code")),
+                "status": resource.get("status"),
+                "conclusion": resource.get("conclusion"),
+                "issued": resource.get("issued") or resource.get("effectiveDateTime"),
+            })
+            reports.sort(key=lambda item: _instant(item["issued"]), reverse=True)
+            del reports[RECENT_REPORTS:]
+        snapshot["recent_reports"] = reports
+
+    elif resource_type == "Patient":
+        snapshot["patient"] = empty_snapshot(resource)["patient"]
+
+    return snapshot
+
+
+def build_snapshot(bundle: Dict[str, Any], patient_id: Optional[str] = None) -> Dict[str, Any]:
+    """Builds a patient's clinical snapshot from their $everything bundle."""
+    resources = [entry.get("resource", {}) for entry in bundle.get("entry", [])]
+    patient = next(
+        (r for r in resources if r.get("resourceType") == "Patient" and (patient_id is None or r.get("id") == patient_id)),
+        None,
+    )
+    snapshot = empty_snapshot(patient)
+    for resource in resources:
+        if resource.get("resourceType") != "Patient":
+            snapshot = apply_resource(snapshot, resource)
+    return snapshot
@@ -0,0 +1,301 @@
+# Import Library
+
+from typing import Any, Dict, List, Optional
+import json
+import os
+import threading
+import time
+
+from googleapiclient import discovery
+from google.auth.transport import requests
+from requests.adapters import HTTPAdapter
+
+from script.cache import PatientCache
+from script.function import HEALTHCARE_API_ENDPOINT, get_credentials, get_patient_everything_by_mrn
+from script.jsonio import FastJsonModel, loads
+from script.patient_index import PatientIndex
+from script.profiling import span
+
+DEFAULT_TENANT = "default"
+
+
+class UnknownTenantError(LookupError):
+    """Raised when a request names a tenant that is not configured."""
+
+
+class TenantBusyError(Exception):
+    """Raised when a tenant is over its rate limit or concurrency cap."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows rate_per_second requests on average, with bursts of up to burst."""
+
+    def __init__(self, rate_per_second: float, burst: Optional[float] = None):
+        self.rate = rate_per_second
+        self.burst = burst or max(1.0, rate_per_second)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """Takes a token. Returns 0 on success, else the seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class TenantMetrics:
+    """Request counters and latency for one tenant."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.client_errors = 0
+        self.server_errors = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, status: int, elapsed_ms: float) -> None:
+        with self._lock:
+            self.requests += 1
+            if 400 <= status < 500:
+                self.client_errors += 1
+            elif status >= 500:
+                self.server_errors += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "client_errors": self.client_errors,
+                "server_errors": self.server_errors,
+                "rejected": self.rejected,
+                "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+                "max_ms": round(self.max_ms, 1),
+            }
+
+
+class Tenant:
+    """
+    One FHIR store and everything the app keeps for it.
+
+    Each tenant has its own patient cache and patient index, so one hospital's
+    data never answers another's requests, and its own HTTP connection pool,
+    rate limit, concurrency cap and metrics, so a noisy tenant is throttled
+    without slowing the others down.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        project_id: str,
+        location: str,
+        dataset_id: str,
+        fhir_store_id: str,
+        rate_per_second: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_concurrency: int = 32,
+        pool_size: int = 16,
+        cache_ttl_seconds: float = 300,
+        cache_max_entries: int = 1024,
+        snapshot_ttl_seconds: Optional[float] = None,
+        notification_subscription: Optional[str] = None,
+    ):
+        self.name = name
+        self.project_id = project_id
+        self.location = location
+        self.dataset_id = dataset_id
+        self.fhir_store_id = fhir_store_id
+        self.fhir_store_parent = f"projects/{project_id}/locations/{location}/datasets/{dataset_id}"
+        self.fhir_store_name = f"{self.fhir_store_parent}/fhirStores/{fhir_store_id}"
+        self.notification_subscription = notification_subscription
+        self.pool_size = pool_size
+
+        self.cache = PatientCache(
+            ttl_seconds=cache_ttl_seconds,
+            max_entries=cache_max_entries,
+            snapshot_ttl_seconds=snapshot_ttl_seconds,
+        )
+        self.patient_index = PatientIndex()
+        self.metrics = TenantMetrics()
+        self.limiter = TokenBucket(rate_per_second, burst) if rate_per_second else None
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        self._local = threading.local()
+        self._idle_clients: List[Any] = []
+        self._clients_lock = threading.Lock()
+        self._credentials = None
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def credentials(self) -> Any:
+        """This store's credentials, resolved once and shared by its clients and session."""
+        if self._credentials is None:
+            with self._session_lock:
+                if self._credentials is None:
+                    self._credentials = get_credentials()
+        return self._credentials
+
+    @property
+    def client(self) -> Any:
+        """
+        The discovery client leased to the current thread.
+
+        googleapiclient's httplib2 transport is not thread-safe, so each thread
+        gets its own client. Request threads hand theirs back with
+        release_client(), and up to pool_size idle clients are kept for the
+        next request instead of building one per new server thread.
+        Background threads keep their client for good.
+        """
+        client = getattr(self._local, "client", None)
+        if client is None:
+            with self._clients_lock:
+                client = self._idle_clients.pop() if self._idle_clients else None
+            if client is None:
+                client = discovery.build(
+                    "healthcare",
+                    "v1",
+                    model=FastJsonModel(),
+                    credentials=self.credentials,
+                    # Only overridden for a local FHIR stand-in; see script/function.py.
+                    client_options={"api_endpoint": HEALTHCARE_API_ENDPOINT} if os.environ.get("HEALTHCARE_API_ENDPOINT") else None,
+                )
+            self._local.client = client
+        return client
+
+    def release_client(self) -> None:
+        """Returns the current thread's client, if it has one, to the idle pool."""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            return
+        self._local.client = None
+        with self._clients_lock:
+            if len(self._idle_clients) < self.pool_size:
+                self._idle_clients.append(client)
+
+    @property
+    def session(self) -> requests.AuthorizedSession:
+        """A pooled, authorized session for this store's REST calls, shared by all threads."""
+        if self._session is None:
+            credentials = self.credentials
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.AuthorizedSession(credentials)
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def store_args(self) -> Dict[str, str]:
+        return {
+            "project_id": self.project_id,
+            "location": self.location,
+            "dataset_id": self.dataset_id,
+            "fhir_store_id": self.fhir_store_id,
+        }
+
+    def fetch_everything(self, mrn: str, params: Optional[Dict[str, str]] = None, raw: bool = False) -> Any:
+        return get_patient_everything_by_mrn(
+            **self.store_args(), mrn=mrn, params=params, raw=raw, session=self.session
+        )
+
+    def load_everything(self, mrn: str) -> Dict[str, Any]:
+        """
+        Returns the patient's $everything bundle, from this tenant's cache when possible.
+
+        A miss caches the upstream bytes along with the bundle, so a later
+        $everything request for the patient is served without serializing it.
+        """
+        bundle = self.cache.get("everything", self.cache.patient_id_for_mrn(mrn))
+        if bundle is None:
+            raw = self.fetch_everything(mrn, raw=True)
+            with span("parse"):
+                bundle = loads(raw)
+            self.cache.store_bundle(mrn, bundle, raw=raw)
+        return bundle
+
+    def admit(self) -> None:
+        """
+        Admits one request, or raises TenantBusyError.
+
+        Over-limit requests are rejected at once instead of queued, so they
+        do not hold server threads that other tenants need.
+        """
+        if self.limiter is not None:
+            wait = self.limiter.try_acquire()
+            if wait:
+                self.metrics.record_rejected()
+                raise TenantBusyError(f"Tenant {self.name} is over its rate limit", retry_after=wait)
+        if not self._slots.acquire(blocking=False):
+            self.metrics.record_rejected()
+            raise TenantBusyError(f"Tenant {self.name} has {self.max_concurrency} requests in flight")
+
+    def release(self) -> None:
+        self._slots.release()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "fhir_store": self.fhir_store_name,
+            "rate_per_second": self.limiter.rate if self.limiter else None,
+            "max_concurrency": self.max_concurrency,
+            "metrics": self.metrics.snapshot(),
+            "cache": self.cache.stats(),
+            "indexed_patients": len(self.patient_index),
+        }
+
+
+class TenantRegistry:
+    """The configured tenants, looked up by name with a default for untagged requests."""
+
+    def __init__(self, default: Tenant):
+        self.default = default
+        self.tenants: Dict[str, Tenant] = {default.name: default}
+
+    def add(self, tenant: Tenant) -> None:
+        self.tenants[tenant.name] = tenant
+
+    def get(self, name: Optional[str]) -> Tenant:
+        if not name:
+            return self.default
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            raise UnknownTenantError(f"Unknown tenant: {name}")
+        return tenant
+
+    def __iter__(self):
+        return iter(list(self.tenants.values()))
+
+
+def load_tenants(path: str) -> List[Tenant]:
+    """
+    Reads tenant configuration from a JSON file such as:
+
+        {"rs-harapan": {"project_id": "...", "location": "asia-southeast2",
+                        "dataset_id": "...", "fhir_store_id": "...",
+                        "rate_per_second": 20, "max_concurrency": 8}}
+
+    Any other Tenant argument (burst, pool_size, cache_max_entries, ...) may be
+    given as well.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    return [Tenant(name, **settings) for name, settings in config.items()]
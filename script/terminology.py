@@ -0,0 +1,283 @@
+# Import Library
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from array import array
+from bisect import bisect_left
+import csv
+import re
+
+# Code system URIs used by the create_* functions in script/function.py.
+SYSTEM_URIS = {
+    "snomed": "http://snomed.info/sct",
+    "loinc": "http://loinc.org",
+    "rxnorm": "http://www.nlm.nih.gov/research/umls/rxnorm",
+}
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+# Candidates checked one by one before search switches to set intersection.
+SCAN_LIMIT = 500
+
+
+class TerminologyError(ValueError):
+    """Raised when a code is not in a loaded code system."""
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CodeSystemIndex:
+    """
+    In-memory index of one code system for validation and typeahead.
+
+    Concepts are stored once in parallel code/display lists. Lookups by code
+    use a dict; prefix search bisects a sorted word list whose postings are
+    packed in arrays; a trigram index over the vocabulary corrects typos when
+    no word prefix matches.
+    """
+
+    def __init__(self, name: str, concepts: Iterable[Tuple[str, str]]):
+        self.name = name
+        self.system = SYSTEM_URIS.get(name, name)
+        self.codes: List[str] = []
+        self.displays: List[str] = []
+        self._by_code: Dict[str, int] = {}
+        for code, display in concepts:
+            if code in self._by_code:
+                continue
+            self._by_code[code] = len(self.codes)
+            self.codes.append(code)
+            self.displays.append(display)
+
+        # Word -> concept postings, stored as a sorted word list with offsets
+        # into one flat array so the index stays compact for large systems.
+        postings: Dict[str, List[int]] = {}
+        for number, display in enumerate(self.displays):
+            for word in set(_words(display)):
+                postings.setdefault(word, []).append(number)
+        self._words = sorted(postings)
+        self._offsets = array("I", [0])
+        self._postings = array("I")
+        for word in self._words:
+            self._postings.extend(postings[word])
+            self._offsets.append(len(self._postings))
+
+        self._sorted_codes = sorted(self._by_code)
+        self._trigram_index: Optional[Dict[str, array]] = None
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def display(self, code: str) -> Optional[str]:
+        number = self._by_code.get(code)
+        return None if number is None else self.displays[number]
+
+    def canonical_display(self, code: str, display: Optional[str] = None) -> str:
+        """
+        Returns the canonical display for a code.
+
+        Raises:
+            TerminologyError: If the code is not in this code system.
+        """
+        canonical = self.display(code)
+        if canonical is None:
+            raise TerminologyError(f"Unknown {self.name} code: {code}")
+        if display and display.strip().lower() != canonical.lower():
+            print(f"Replacing {self.name} display {display!r} for {code} with {canonical!r}")
+        return canonical
+
+    def _word_range(self, prefix: str) -> Tuple[int, int]:
+        start = bisect_left(self._words, prefix)
+        end = bisect_left(self._words, prefix + "\uffff", start)
+        return start, end
+
+    def _prefix_postings(self, prefix: str) -> array:
+        """Concept numbers of every display with a word starting with prefix (may repeat)."""
+        start, end = self._word_range(prefix)
+        return self._postings[self._offsets[start]:self._offsets[end]]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        """
+        Typeahead search by code prefix or by word prefixes of the display.
+
+        Every query word must prefix-match a word of the display, so "hear rat"
+        finds "Heart rate".
+        """
+        query = query.strip()
+        if not query:
+            return []
+        results: List[int] = []
+
+        start = bisect_left(self._sorted_codes, query)
+        while len(results) < limit and start < len(self._sorted_codes) and self._sorted_codes[start].startswith(query):
+            results.append(self._by_code[self._sorted_codes[start]])
+            start += 1
+
+        words = _words(query)
+        if words and len(results) < limit:
+            # The postings of all words sharing a prefix are one contiguous slice.
+            postings = [self._prefix_postings(word) for word in words]
+            driver = min(range(len(words)), key=lambda i: len(postings[i]))
+            others = [word for i, word in enumerate(words) if i != driver]
+            seen = set(results)
+            # Scan the most selective word's concepts first, which finds enough
+            # matches quickly for typical queries...
+            for number in postings[driver][:SCAN_LIMIT]:
+                if number in seen:
+                    continue
+                seen.add(number)
+                display = self.displays[number].lower()
+                # Cheap substring test first; only survivors are tokenized.
+                if any(other not in display for other in others):
+                    continue
+                display_words = _words(display)
+                if all(any(w.startswith(other) for w in display_words) for other in others):
+                    results.append(number)
+                    if len(results) >= limit:
+                        break
+            # ...and fall back to set intersection in C for unselective ones.
+            if len(results) < limit and len(postings[driver]) > SCAN_LIMIT:
+                remaining = set(postings[driver][SCAN_LIMIT:])
+                for i in sorted(range(len(words)), key=lambda i: len(postings[i])):
+                    if i != driver:
+                        remaining.intersection_update(postings[i])
+                results.extend(sorted(remaining - seen)[:limit - len(results)])
+            if not results:
+                corrected = self.correct_words(words)
+                if corrected != words:
+                    return self.search(" ".join(corrected), limit)
+
+        return [{"code": self.codes[n], "display": self.displays[n], "system": self.system} for n in results]
+
+    def correct_words(self, words: List[str]) -> List[str]:
+        """
+        Replaces query words that prefix no known word with the closest
+        vocabulary word by shared trigrams (e.g. "pnuemonia" -> "pneumonia").
+
+        The trigram index covers the vocabulary rather than every concept, so it
+        is small, and it is only built the first time a correction is needed.
+        """
+        if self._trigram_index is None:
+            index: Dict[str, List[int]] = {}
+            for number, word in enumerate(self._words):
+                for trigram in _trigrams(word):
+                    index.setdefault(trigram, []).append(number)
+            self._trigram_index = {trigram: array("I", numbers) for trigram, numbers in index.items()}
+
+        corrected = []
+        for word in words:
+            start, end = self._word_range(word)
+            if start < end or len(word) < 3:
+                corrected.append(word)
+                continue
+            query_trigrams = _trigrams(word)
+            scores: Dict[int, int] = {}
+            for trigram in query_trigrams:
+                for number in self._trigram_index.get(trigram, ()):
+                    scores[number] = scores.get(number, 0) + 1
+            # Jaccard similarity, so long words sharing a few trigrams do not win.
+            best = max(
+                scores,
+                key=lambda n: scores[n] / (len(query_trigrams) + len(self._words[n]) + 2 - scores[n]),
+                default=None,
+            )
+            if best is not None and scores[best] * 2 >= len(query_trigrams):
+                corrected.append(self._words[best])
+            else:
+                corrected.append(word)
+        return corrected
+
+
+## Loading code systems from local files
+
+def read_simple(path: str) -> Iterator[Tuple[str, str]]:
+    """Reads "code,display" CSV (or tab separated) files with a header row."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        dialect = "excel-tab" if "\t" in f.readline() else "excel"
+        f.seek(0)
+        reader = csv.reader(f, dialect)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 2 and row[0]:
+                yield row[0], row[1]
+
+
+def read_snomed_rf2(path: str) -> Iterator[Tuple[str, str]]:
+    """Reads active fully specified names from a SNOMED CT RF2 description file."""
+    fsn_type = "900000000000003001"
+    with open(path, "r", encoding="utf-8") as f:
+        next(f, None)
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) >= 8 and columns[2] == "1" and columns[6] == fsn_type:
+                # Drop the semantic tag, e.g. "Asthma (disorder)" -> "Asthma".
+                yield columns[4], re.sub(r"\s+\([^()]*\)$", "", columns[7])
+
+
+def read_loinc(path: str) -> Iterator[Tuple[str, str]]:
+    """Reads LOINC_NUM and LONG_COMMON_NAME from the LOINC table (Loinc.csv)."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            if row.get("STATUS", "ACTIVE") != "DEPRECATED":
+                yield row["LOINC_NUM"], row["LONG_COMMON_NAME"]
+
+
+def read_rxnorm(path: str) -> Iterator[Tuple[str, str]]:
+    """Reads RXCUI and name from RXNCONSO.RRF, preferring clinical drug names."""
+    preferred = {"SCD": 0, "SBD": 1, "IN": 2, "PIN": 3, "BN": 4}
+    best: Dict[str, Tuple[int, str]] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            columns = line.split("|")
+            if len(columns) < 15 or columns[11] != "RXNORM" or columns[12] not in preferred:
+                continue
+            rank = preferred[columns[12]]
+            if columns[0] not in best or rank < best[columns[0]][0]:
+                best[columns[0]] = (rank, columns[14])
+    for code, (_, display) in best.items():
+        yield code, display
+
+
+def load_code_system(name: str, path: str) -> CodeSystemIndex:
+    """Loads a code system file, picking the reader from its file name."""
+    filename = path.rsplit("/", 1)[-1].lower()
+    if name == "snomed" and filename.startswith("sct2_description"):
+        concepts = read_snomed_rf2(path)
+    elif name == "loinc" and filename == "loinc.csv":
+        concepts = read_loinc(path)
+    elif name == "rxnorm" and filename.endswith(".rrf"):
+        concepts = read_rxnorm(path)
+    else:
+        concepts = read_simple(path)
+    index = CodeSystemIndex(name, concepts)
+    print(f"Loaded {len(index)} {name} concepts from {path}")
+    return index
+
+
+class TerminologyService:
+    """
+    The loaded code systems. Systems that were not loaded are not validated,
+    so the create routes keep working without terminology files.
+    """
+
+    def __init__(self):
+        self.systems: Dict[str, CodeSystemIndex] = {}
+
+    def load(self, name: str, path: str) -> None:
+        self.systems[name] = load_code_system(name, path)
+
+    def canonical_display(self, name: str, code: str, display: Optional[str] = None) -> Optional[str]:
+        if name not in self.systems:
+            return display
+        return self.systems[name].canonical_display(code, display)
+
+    def search(self, name: str, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        if name not in self.systems:
+            raise TerminologyError(f"Code system {name} is not loaded")
+        return self.systems[name].search(query, limit)
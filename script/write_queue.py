@@ -0,0 +1,271 @@
+# Import Library
+
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from script.bulk_update import execute_bundle
+from script.jsonio import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Queued resources are tagged with their tracking id, and each batch entry is a
+# conditional create on that tag, so a batch that is retried after a timeout or
+# a crash does not create the same resource twice.
+TRACKING_TAG_SYSTEM = "urn:gcp-clinical-summarization:write-behind"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    resource_type TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    patient_id TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    resource_id TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS writes_pending ON writes (status, next_attempt);
+"""
+
+
+class WriteQueue:
+    """
+    Durable queue of pending creates, kept in a local SQLite database.
+
+    A write moves from "queued" to "sending" while a flusher holds it, and
+    ends as "created" or "failed". Writes still "sending" when the process
+    stopped are queued again on start.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL keeps enqueues fast while the flusher reads; FULL syncs every
+        # commit, so an acknowledged write survives a power loss.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(_SCHEMA)
+        with self._lock:
+            self._db.execute("UPDATE writes SET status = 'queued' WHERE status = 'sending'")
+
+    def enqueue(self, tenant: str, resource: Dict[str, Any], patient_id: Optional[str] = None) -> str:
+        """Persists a resource to create. Returns its tracking id."""
+        tracking_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO writes (id, tenant, resource_type, resource, patient_id, status, next_attempt, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (tracking_id, tenant, resource["resourceType"], dumps(resource), patient_id, now, now, now),
+            )
+        return tracking_id
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Marks up to limit due writes as "sending" and returns them, oldest first."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, tenant, resource_type, resource, patient_id, attempts FROM writes"
+                    " WHERE status = 'queued' AND next_attempt <= ? ORDER BY created LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE writes SET status = 'sending', updated = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [
+            {
+                "id": row[0],
+                "tenant": row[1],
+                "resource_type": row[2],
+                "resource": loads(row[3]),
+                "patient_id": row[4],
+                "attempts": row[5],
+            }
+            for row in rows
+        ]
+
+    def complete(self, tracking_id: str, resource_id: Optional[str]) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE writes SET status = 'created', resource_id = ?, error = NULL, updated = ? WHERE id = ?",
+                (resource_id, time.time(), tracking_id),
+            )
+
+    def fail(self, tracking_id: str, error: str, retry_in: Optional[float] = None) -> None:
+        """Records a failed attempt; with retry_in the write is queued again after that many seconds."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE writes SET status = ?, attempts = attempts + 1, next_attempt = ?, error = ?, updated = ? WHERE id = ?",
+                ("queued" if retry_in is not None else "failed", now + (retry_in or 0), error, now, tracking_id),
+            )
+
+    def status(self, tracking_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, tenant, resource_type, status, resource_id, attempts, error, created, updated"
+                " FROM writes WHERE id = ?",
+                (tracking_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("trackingId", "tenant", "resourceType", "status", "id", "attempts", "error", "created", "updated")
+        return dict(zip(keys, row))
+
+    def counts(self, tenant: Optional[str] = None) -> Dict[str, int]:
+        query = "SELECT status, COUNT(*) FROM writes"
+        args: tuple = ()
+        if tenant is not None:
+            query += " WHERE tenant = ?"
+            args = (tenant,)
+        with self._lock:
+            return dict(self._db.execute(query + " GROUP BY status", args).fetchall())
+
+
+def tagged_resource(resource: Dict[str, Any], tracking_id: str) -> Dict[str, Any]:
+    """Returns a copy of the resource carrying its tracking id as a meta tag."""
+    meta = dict(resource.get("meta", {}))
+    meta["tag"] = list(meta.get("tag", [])) + [{"system": TRACKING_TAG_SYSTEM, "code": tracking_id}]
+    return dict(resource, meta=meta)
+
+
+def build_create_bundle(writes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Builds a batch bundle of conditional creates, one per queued write."""
+    return {
+        "resourceType": "Bundle",
+        "type": "batch",
+        "entry": [
+            {
+                "resource": tagged_resource(write["resource"], write["id"]),
+                "request": {
+                    "method": "POST",
+                    "url": write["resource_type"],
+                    "ifNoneExist": f"_tag={TRACKING_TAG_SYSTEM}|{write['id']}",
+                },
+            }
+            for write in writes
+        ],
+    }
+
+
+def _created_id(entry: Dict[str, Any]) -> Optional[str]:
+    resource_id = entry.get("resource", {}).get("id")
+    if resource_id:
+        return resource_id
+    # Otherwise the location is "<type>/<id>/_history/<version>".
+    parts = entry.get("response", {}).get("location", "").split("/")
+    if "_history" in parts:
+        return parts[parts.index("_history") - 1]
+    return None
+
+
+class WriteBehindFlusher:
+    """
+    Sends queued writes to the FHIR store in batch bundles on a background thread.
+
+    Whatever is queued when the flusher wakes is sent together, up to
+    batch_size per bundle and one bundle per tenant, so a burst of writes
+    costs a few round trips. Entries rejected with a 4xx fail for good;
+    transport errors, 429 and 5xx are retried with exponential backoff up to
+    max_attempts.
+    """
+
+    def __init__(
+        self,
+        queue: WriteQueue,
+        get_tenant: Callable[[str], Any],
+        batch_size: int = 100,
+        interval: float = 0.2,
+        max_attempts: int = 8,
+        on_created: Optional[Callable[[Any, Dict[str, Any], Dict[str, Any]], None]] = None,
+    ):
+        self.queue = queue
+        self.get_tenant = get_tenant
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.on_created = on_created
+        self.bundles_sent = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _retry(self, write: Dict[str, Any], error: str) -> None:
+        if write["attempts"] + 1 >= self.max_attempts:
+            self.queue.fail(write["id"], error)
+            logger.warning(f"Write {write['id']} failed after {write['attempts'] + 1} attempts: {error}")
+        else:
+            self.queue.fail(write["id"], error, retry_in=min(60.0, 2.0 ** write["attempts"]))
+
+    def flush_once(self) -> int:
+        """Sends one round of due writes. Returns how many were claimed."""
+        writes = self.queue.claim(self.batch_size)
+        by_tenant: Dict[str, List[Dict[str, Any]]] = {}
+        for write in writes:
+            by_tenant.setdefault(write["tenant"], []).append(write)
+
+        for tenant_name, batch in by_tenant.items():
+            try:
+                tenant = self.get_tenant(tenant_name)
+                response = execute_bundle(tenant.client, tenant.fhir_store_name, build_create_bundle(batch))
+                self.bundles_sent += 1
+            except Exception as e:
+                for write in batch:
+                    self._retry(write, str(e))
+                logger.warning(f"Bundle of {len(batch)} queued writes for {tenant_name} failed: {e}")
+                continue
+
+            entries = response.get("entry", [])
+            for index, write in enumerate(batch):
+                entry = entries[index] if index < len(entries) else {}
+                status = entry.get("response", {}).get("status", "")
+                if status.startswith("2"):
+                    resource_id = _created_id(entry)
+                    self.queue.complete(write["id"], resource_id)
+                    if self.on_created is not None:
+                        # Batch responses carry the new id in the location but
+                        # usually not the resource, so rebuild it from the write.
+                        resource = entry.get("resource") or dict(write["resource"], id=resource_id)
+                        try:
+                            self.on_created(tenant, write, resource)
+                        except Exception as e:
+                            logger.warning(f"After-create hook for write {write['id']} failed: {e}")
+                elif status.startswith("4") and not status.startswith("429"):
+                    self.queue.fail(write["id"], status)
+                else:
+                    self._retry(write, status or "missing from batch response")
+        return len(writes)
+
+    def run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                claimed = self.flush_once()
+            except Exception as e:
+                logger.warning(f"Write-behind flush failed: {e}")
+                claimed = 0
+            # Go straight on while there is a backlog, otherwise wait for more.
+            if claimed < self.batch_size:
+                self._stop.wait(self.interval)
+
+    def start(self) -> threading.Thread:
+        self._thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self) -> None:
+        self._stop.set()
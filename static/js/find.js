@@ -5,6 +5,14 @@ document.addEventListener('DOMContentLoaded', function() {
     const findMrnForm = document.getElementById('find-mrn-form');
     const responseElement = document.getElementById('api-response');
 
+    // Only the elements the formatters below read; the server trims everything else.
+    const EVERYTHING_FIELDS = [
+        'name', 'identifier', 'gender', 'birthDate', 'status', 'intent', 'code', 'reasonCode',
+        'clinicalStatus', 'onsetDateTime', 'valueQuantity', 'valueCodeableConcept', 'effectiveDateTime',
+        'performedPeriod', 'medicationCodeableConcept', 'authoredOn', 'dosageInstruction', 'requester',
+        'issued', 'conclusion',
+    ].join(',');
+
     if (findResourceForm) {
         findResourceForm.addEventListener('submit', function(event) {
             event.preventDefault();
@@ -29,7 +37,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
         findEverythingBtn.addEventListener('click', () => {
             if (!mrnInput.value) { return; }
-            const apiUrl = `/api/patient/everything/mrn/${mrnInput.value}`;
+            const apiUrl = `/api/patient/everything/mrn/${mrnInput.value}?fields=${EVERYTHING_FIELDS}`;
             fetchData(apiUrl, 'Searching for all patient records...');
         });
     }
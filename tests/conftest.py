@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+# Lets the tests import the app's modules (script.*, benchmarks.*) from the repo root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STORE_PATH = "projects/p/locations/l/datasets/d/fhirStores/s"
+
+
+@pytest.fixture
+def fhir_standin(monkeypatch):
+    """
+    A local FHIR store stand-in (benchmarks/fhir_standin.py) on a free port.
+
+    Yields (fhir_url, store): the FHIR base URL of the stand-in's store and its
+    in-memory FhirStore, for seeding and checking resources directly.
+    """
+    from benchmarks.fhir_standin import start_standin
+
+    monkeypatch.setenv("HEALTHCARE_API_ANONYMOUS", "1")
+    server, store = start_standin()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/{STORE_PATH}/fhir", store
+    server.shutdown()
+    server.server_close()
+
+
+def mrn_patient(patient_id, mrn, **fields):
+    """A Patient resource with an MRN identifier the app and the stand-in recognise."""
+    return dict(
+        {
+            "resourceType": "Patient",
+            "id": patient_id,
+            "identifier": [{
+                "type": {"coding": [{"code": "MR"}]},
+                "system": "urn:oid:1.2.36.146.595.217.0.1",
+                "value": mrn,
+            }],
+        },
+        **fields,
+    )
+
+
+def patient_bundle(patient_id, mrn, *resources):
+    """An $everything bundle with an MRN patient followed by the given resources."""
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "entry": [{"resource": resource} for resource in (mrn_patient(patient_id, mrn), *resources)],
+    }
+
+
+@pytest.fixture
+def healthcare_client(fhir_standin):
+    """A Cloud Healthcare API discovery client pointed at the stand-in."""
+    from google.auth.credentials import AnonymousCredentials
+    from googleapiclient import discovery
+
+    from script.jsonio import FastJsonModel
+
+    fhir_url, _ = fhir_standin
+    return discovery.build(
+        "healthcare",
+        "v1",
+        model=FastJsonModel(),
+        credentials=AnonymousCredentials(),
+        client_options={"api_endpoint": fhir_url.split("/v1/")[0]},
+    )
@@ -0,0 +1,65 @@
+from benchmarks import fhir_standin as standin
+from conftest import mrn_patient
+from script.bulk_delete import bulk_delete, collect_compartment, collect_search, order_by_dependency
+
+
+def seed_chart(store, patient_id="p1", mrn="MRN1", observations=12):
+    store.create(mrn_patient(patient_id, mrn))
+    store.create({"resourceType": "Encounter", "id": f"{patient_id}-enc", "subject": {"reference": f"Patient/{patient_id}"}})
+    for i in range(observations):
+        store.create({
+            "resourceType": "Observation",
+            "id": f"{patient_id}-obs-{i}",
+            "subject": {"reference": f"Patient/{patient_id}"},
+            "encounter": {"reference": f"Encounter/{patient_id}-enc"},
+        })
+
+
+def test_order_by_dependency_deletes_patients_last():
+    tiers = order_by_dependency([
+        ("Patient", "p1"), ("Encounter", "e1"), ("Observation", "o1"), ("Condition", "c1"),
+    ])
+    assert tiers == [[("Observation", "o1"), ("Condition", "c1")], [("Encounter", "e1")], [("Patient", "p1")]]
+
+
+def test_collect_compartment_follows_every_page(fhir_standin, monkeypatch):
+    fhir_url, store = fhir_standin
+    monkeypatch.setattr(standin, "PAGE_SIZE", 5)
+    seed_chart(store, observations=12)
+    seed_chart(store, "p2", "MRN2", observations=3)
+    targets = collect_compartment(fhir_url, "MRN1")
+    assert len(targets) == 14
+    assert ("Patient", "p1") in targets and ("Observation", "p1-obs-11") in targets
+    assert not any(resource_id.startswith("p2") for _, resource_id in targets)
+
+
+def test_collect_search_drops_duplicates_and_filters(fhir_standin):
+    fhir_url, store = fhir_standin
+    seed_chart(store, observations=2)
+    targets = collect_search(f"{fhir_url}/Patient/p1/$everything", keep=lambda r: r["resourceType"] == "Observation")
+    assert targets == [("Observation", "p1-obs-0"), ("Observation", "p1-obs-1")]
+
+
+def test_dry_run_deletes_nothing(fhir_standin):
+    fhir_url, store = fhir_standin
+    seed_chart(store, observations=3)
+    lines = []
+    summary = bulk_delete(fhir_url, collect_compartment(fhir_url, "MRN1"), dry_run=True, progress=lines.append)
+    assert summary["planned"] == {"Patient": 1, "Encounter": 1, "Observation": 3}
+    assert len(lines) == 3
+    assert len(store.resources) == 5
+
+
+def test_bulk_delete_removes_the_compartment_in_tiers(fhir_standin, monkeypatch):
+    fhir_url, store = fhir_standin
+    seed_chart(store, observations=25)
+    seed_chart(store, "p2", "MRN2", observations=2)
+    deleted = []
+    delete = store.delete
+    monkeypatch.setattr(store, "delete", lambda *key: deleted.append(key) or delete(*key))
+
+    summary = bulk_delete(fhir_url, collect_compartment(fhir_url, "MRN1"), batch_size=10, progress=lambda line: None)
+
+    assert summary["deleted"] == 27 and summary["failed"] == []
+    assert deleted[-2:] == [("Encounter", "p1-enc"), ("Patient", "p1")]
+    assert sorted(key[1] for key in store.resources) == ["p2", "p2-enc", "p2-obs-0", "p2-obs-1"]
@@ -0,0 +1,85 @@
+import base64
+import json
+
+from conftest import STORE_PATH, mrn_patient
+from script.bulk_update import (
+    build_patch_bundle,
+    compartment_targets,
+    partial_update_to_patch,
+    patched_elements,
+    patch_resources,
+    version_from_etag,
+)
+
+
+def test_partial_update_escapes_json_pointer_characters():
+    assert partial_update_to_patch({"status": "inactive", "a/b~c": 1}) == [
+        {"op": "add", "path": "/status", "value": "inactive"},
+        {"op": "add", "path": "/a~1b~0c", "value": 1},
+    ]
+
+
+def test_patch_bundle_carries_patch_as_binary_with_if_match():
+    bundle = build_patch_bundle([
+        {"resourceType": "Observation", "id": "o1", "patch": [{"op": "remove", "path": "/note"}], "versionId": "3"},
+        {"resourceType": "Condition", "id": "c1", "patch": []},
+    ])
+    first, second = bundle["entry"]
+    assert bundle["type"] == "batch"
+    assert first["request"] == {"method": "PATCH", "url": "Observation/o1", "ifMatch": 'W/"3"'}
+    assert json.loads(base64.b64decode(first["resource"]["data"])) == [{"op": "remove", "path": "/note"}]
+    assert "ifMatch" not in second["request"]
+
+
+def test_version_from_etag():
+    assert version_from_etag('W/"12"') == "12"
+    assert version_from_etag('"7"') == "7"
+    assert version_from_etag(None) is None
+
+
+def test_compartment_targets_use_bundle_versions():
+    bundle = {"entry": [
+        {"resource": {"resourceType": "Observation", "id": "o1", "status": "final", "meta": {"versionId": "2"}}},
+        {"resource": {"resourceType": "Practitioner", "id": "dr", "status": "active"}},
+        {"resource": {"resourceType": "Encounter", "id": "e1", "status": "finished"}},
+    ]}
+    patch = partial_update_to_patch({"status": "entered-in-error"})
+    assert compartment_targets(bundle, patch) == [
+        {"resourceType": "Observation", "id": "o1", "patch": patch, "versionId": "2"},
+        {"resourceType": "Encounter", "id": "e1", "patch": patch, "versionId": None},
+    ]
+
+
+def test_compartment_targets_default_to_resources_with_the_patched_elements():
+    bundle = {"entry": [
+        {"resource": mrn_patient("p1", "MRN1")},
+        {"resource": {"resourceType": "Condition", "id": "c1", "clinicalStatus": {}}},
+        {"resource": {"resourceType": "Observation", "id": "o1", "status": "final"}},
+        {"resource": {"resourceType": "Observation", "id": "o2", "status": "final", "note": []}},
+    ]}
+    status = partial_update_to_patch({"status": "entered-in-error"})
+    assert [t["id"] for t in compartment_targets(bundle, status)] == ["o1", "o2"]
+    both = partial_update_to_patch({"status": "amended", "note": [{"text": "Corrected"}]})
+    assert [t["id"] for t in compartment_targets(bundle, both)] == ["o2"]
+    # Naming the types patches all of them, as asked.
+    assert [t["id"] for t in compartment_targets(bundle, status, ["Condition"])] == ["c1"]
+    assert patched_elements([{"op": "add", "path": "/a~1b/0"}, {"op": "test", "path": ""}]) == {"a/b"}
+
+
+def test_patch_resources_reports_versions_and_conflicts(fhir_standin, healthcare_client):
+    _, store = fhir_standin
+    store.create(mrn_patient("p1", "MRN1"))
+    for i in range(5):
+        store.create({"resourceType": "Observation", "id": f"o{i}", "status": "final", "subject": {"reference": "Patient/p1"}})
+    targets = [
+        {"resourceType": "Observation", "id": f"o{i}", "patch": partial_update_to_patch({"status": "amended"}),
+         "versionId": "1" if i != 3 else "0"}
+        for i in range(5)
+    ]
+
+    results = patch_resources(healthcare_client, STORE_PATH, targets, batch_size=2)
+
+    assert [r["status"] for r in results] == ["200 OK"] * 3 + ["412 Precondition Failed", "200 OK"]
+    assert results[0]["versionId"] == "2"
+    assert store.read("Observation", "o0")["status"] == "amended"
+    assert store.read("Observation", "o3")["status"] == "final"
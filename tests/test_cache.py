@@ -0,0 +1,97 @@
+import time
+
+from conftest import patient_bundle
+from script.cache import PatientCache, build_timeline_index, patient_id_for_resource, reference_id
+
+
+def everything(patient_id, mrn, observations=3):
+    return patient_bundle(patient_id, mrn, *[
+        {
+            "resourceType": "Observation",
+            "id": f"{patient_id}-obs-{i}",
+            "subject": {"reference": f"Patient/{patient_id}"},
+            "effectiveDateTime": f"2024-01-0{i + 1}T08:00:00Z",
+        }
+        for i in range(observations)
+    ])
+
+
+def test_reference_id_accepts_relative_and_full_urls():
+    assert reference_id({"reference": "Patient/123"}, "Patient") == "123"
+    assert reference_id({"reference": "https://fhir.example/Patient/123/"}, "Patient") == "123"
+    assert reference_id({"reference": "Group/123"}, "Patient") is None
+    assert reference_id(None, "Patient") is None
+
+
+def test_patient_id_for_resource():
+    assert patient_id_for_resource({"resourceType": "Patient", "id": "p1"}) == "p1"
+    assert patient_id_for_resource({"resourceType": "MedicationRequest", "subject": {"reference": "Patient/p2"}}) == "p2"
+    assert patient_id_for_resource({"resourceType": "Practitioner", "id": "dr"}) is None
+
+
+def test_timeline_is_newest_first_and_skips_undated():
+    bundle = everything("p1", "MRN1")
+    timeline = build_timeline_index(bundle)
+    assert [item["id"] for item in timeline] == ["p1-obs-2", "p1-obs-1", "p1-obs-0"]
+
+
+def test_store_bundle_indexes_mrn_and_resources():
+    cache = PatientCache()
+    assert cache.store_bundle("MRN1", everything("p1", "MRN1")) == "p1"
+    assert cache.patient_id_for_mrn("MRN1") == "p1"
+    assert cache.mrn_for_patient("p1") == "MRN1"
+    assert cache.patient_id_for_reference("Observation", "p1-obs-0") == "p1"
+    assert cache.get("everything", "p1")["entry"][0]["resource"]["id"] == "p1"
+
+
+def test_store_bundle_without_the_patient_is_not_cached():
+    cache = PatientCache()
+    assert cache.store_bundle("MRN2", everything("p1", "MRN1")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_eviction_of_last_entry_prunes_indexes():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", everything("p1", "MRN1"))
+    cache.evict_patient("p1")
+    assert cache.patient_id_for_reference("Observation", "p1-obs-0") is None
+    assert cache.patient_id_for_mrn("MRN1") is None
+    assert cache.stats()["indexed_resources"] == 0
+
+
+def test_partial_eviction_keeps_indexes():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", everything("p1", "MRN1"))
+    cache.evict_patient("p1", ("everything", "timeline"))
+    assert cache.patient_id_for_reference("Observation", "p1-obs-0") == "p1"
+
+
+def test_expiry_prunes_indexes():
+    cache = PatientCache(ttl_seconds=0.01)
+    cache.store_bundle("MRN1", everything("p1", "MRN1"))
+    time.sleep(0.02)
+    for kind in ("everything", "everything_raw", "timeline", "summary", "snapshot"):
+        assert cache.get(kind, "p1") is None
+    assert cache.stats()["indexed_resources"] == 0
+    assert cache.patient_id_for_mrn("MRN1") is None
+
+
+def test_lru_eviction_keeps_index_bounded():
+    cache = PatientCache(max_entries=6)
+    for i in range(50):
+        cache.store_bundle(f"MRN{i}", everything(f"p{i}", f"MRN{i}", observations=10))
+    stats = cache.stats()
+    assert stats["entries"] <= 6
+    # Only the patients that still have entries keep their resources indexed.
+    assert stats["indexed_resources"] <= 2 * 11
+    assert cache.patient_id_for_mrn("MRN0") is None
+    assert cache.patient_id_for_mrn("MRN49") == "p49"
+
+
+def test_new_bundle_replaces_resource_index():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", everything("p1", "MRN1", observations=5))
+    cache.store_bundle("MRN1", everything("p1", "MRN1", observations=2))
+    assert cache.patient_id_for_reference("Observation", "p1-obs-1") == "p1"
+    assert cache.patient_id_for_reference("Observation", "p1-obs-4") is None
+    assert cache.stats()["indexed_resources"] == 3
@@ -0,0 +1,97 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport import requests
+
+from benchmarks import fhir_standin as standin
+from conftest import mrn_patient
+from script import function
+from script.cache import PatientCache
+from script.jsonio import loads
+
+
+@pytest.fixture
+def everything(fhir_standin, monkeypatch):
+    """Fetches $everything by MRN from the stand-in, which pages every 5 entries."""
+    fhir_url, store = fhir_standin
+    monkeypatch.setattr(standin, "PAGE_SIZE", 5)
+    monkeypatch.setattr(function, "HEALTHCARE_API_ENDPOINT", fhir_url.split("/v1/")[0])
+    session = requests.AuthorizedSession(AnonymousCredentials())
+
+    def fetch(mrn, **kwargs):
+        return function.get_patient_everything_by_mrn("p", "l", "d", "s", mrn, session=session, **kwargs)
+
+    return store, fetch
+
+
+def seed_reports(store, patient_id, mrn, reports):
+    store.create(mrn_patient(patient_id, mrn, name=[{"family": "Santoso", "given": ["Budi"]}]))
+    for i in range(reports):
+        store.create({
+            "resourceType": "DiagnosticReport",
+            "id": f"{patient_id}-report-{i}",
+            "status": "final",
+            "subject": {"reference": f"Patient/{patient_id}"},
+            "issued": f"2024-01-{i + 1:02d}T08:00:00Z",
+        })
+    store.create({
+        "resourceType": "MedicationRequest",
+        "id": f"{patient_id}-med",
+        "status": "active",
+        "subject": {"reference": f"Patient/{patient_id}"},
+    })
+
+
+def test_everything_merges_every_page(everything):
+    store, fetch = everything
+    seed_reports(store, "p1", "MRN1", reports=12)
+    bundle = fetch("MRN1")
+    ids = [entry["resource"]["id"] for entry in bundle["entry"]]
+    assert len(ids) == 14 and len(set(ids)) == 14
+    assert not any(link["relation"] == "next" for link in bundle.get("link", []))
+
+    cache = PatientCache()
+    assert cache.store_bundle("MRN1", bundle) == "p1"
+    snapshot = cache.get("snapshot", "p1")
+    assert [report["id"] for report in snapshot["recent_reports"]] == [f"p1-report-{i}" for i in (11, 10, 9, 8, 7)]
+    assert [medication["id"] for medication in snapshot["active_medications"]] == ["p1-med"]
+
+
+def test_raw_everything_is_merged_when_paged(everything):
+    store, fetch = everything
+    seed_reports(store, "p1", "MRN1", reports=12)
+    seed_reports(store, "p2", "MRN2", reports=1)
+    assert len(loads(fetch("MRN1", raw=True))["entry"]) == 14
+    # A single page is passed through untouched.
+    raw = fetch("MRN2", raw=True)
+    assert isinstance(raw, bytes) and len(loads(raw)["entry"]) == 3
+
+
+class PagedSession:
+    """Serves canned bundle pages in order and records the requests made."""
+
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.requests = []
+
+    def get(self, url, headers=None, params=None):
+        self.requests.append((url, params))
+        return SimpleNamespace(content=json.dumps(self.pages.pop(0)).encode(), raise_for_status=lambda: None)
+
+
+def test_scheduled_mrns_follow_pages_and_match_the_mr_type():
+    encounter = {"resourceType": "Encounter", "id": "e1", "subject": {"reference": "Patient/p1"}}
+    other_system = mrn_patient("p3", "MRN3")
+    other_system["identifier"][0]["system"] = "urn:oid:2.16.840.1.113883.99"
+    not_mr = {"resourceType": "Patient", "id": "p4", "identifier": [{"system": "urn:oid:1.2.36.146.595.217.0.1", "value": "X4"}]}
+    session = PagedSession(
+        {"entry": [{"resource": encounter}, {"resource": mrn_patient("p1", "MRN1")}, {"resource": not_mr}],
+         "link": [{"relation": "next", "url": "https://fhir.example/next-page"}]},
+        {"entry": [{"resource": other_system}, {"resource": mrn_patient("p1", "MRN1")}]},
+    )
+    mrns = function.search_scheduled_patient_mrns("p", "l", "d", "s", "2024-05-01", session=session)
+    assert mrns == ["MRN1", "MRN3"]
+    assert session.requests[0][1]["date"] == "2024-05-01"
+    assert session.requests[1] == ("https://fhir.example/next-page", None)
@@ -0,0 +1,208 @@
+import json
+import queue
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import patient_bundle
+from script import invalidation
+from script.cache import PatientCache
+from script.jsonio import dumps_bytes
+from script.invalidation import (
+    InvalidationHandler,
+    parse_notification,
+    pubsub_notification_feed,
+    queue_notification_feed,
+    start_invalidation_worker,
+)
+
+STORE = "projects/p/locations/l/datasets/d/fhirStores/s"
+
+
+def bundle(patient_id="p1", mrn="MRN1"):
+    return patient_bundle(patient_id, mrn, {
+        "resourceType": "Condition",
+        "id": "c1",
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "clinicalStatus": {"coding": [{"code": "active"}]},
+        "code": {"text": "Hypertension"},
+    })
+
+
+def test_parse_name_only_notification():
+    change = parse_notification(
+        f"{STORE}/fhir/Observation/123".encode(), {"action": "DeleteResource", "resourceType": "Observation"}
+    )
+    assert change == {"action": "DeleteResource", "resource_type": "Observation", "resource_id": "123", "resource": None}
+
+
+def test_parse_full_resource_notification():
+    resource = {"resourceType": "Condition", "id": "c9", "subject": {"reference": "Patient/p1"}}
+    change = parse_notification(json.dumps(resource), {"action": "CreateResource"})
+    assert (change["resource_type"], change["resource_id"]) == ("Condition", "c9")
+    assert change["resource"] == resource
+
+
+def test_parse_defaults_to_update():
+    assert parse_notification(f"{STORE}/fhir/Patient/p1")["action"] == "UpdateResource"
+
+
+def test_update_evicts_only_that_patient():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", bundle("p1", "MRN1"))
+    cache.store_bundle("MRN2", bundle("p2", "MRN2"))
+    handler = InvalidationHandler(cache)
+    assert handler.handle(parse_notification(f"{STORE}/fhir/Patient/p1", {"action": "UpdateResource"})) == "p1"
+    assert cache.get("everything", "p1") is None
+    assert cache.get("snapshot", "p1") is None
+    assert cache.get("everything", "p2") is not None
+
+
+def test_change_mapped_through_reference_index():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", bundle())
+    handler = InvalidationHandler(cache)
+    assert handler.handle(parse_notification(f"{STORE}/fhir/Condition/c1", {"action": "PatchResource"})) == "p1"
+    assert cache.get("timeline", "p1") is None
+
+
+def test_unmapped_change_uses_fetch_resource_but_not_for_deletes():
+    cache = PatientCache()
+    fetched = []
+
+    def fetch(resource_type, resource_id):
+        fetched.append(resource_id)
+        return {"resourceType": resource_type, "id": resource_id, "subject": {"reference": "Patient/p7"}}
+
+    handler = InvalidationHandler(cache, fetch_resource=fetch)
+    assert handler.handle(parse_notification(f"{STORE}/fhir/Observation/o1", {"action": "UpdateResource"})) == "p7"
+    assert handler.handle(parse_notification(f"{STORE}/fhir/Observation/o2", {"action": "DeleteResource"})) is None
+    assert fetched == ["o1"]
+    assert handler.unmapped == 1
+
+
+def test_refresh_reloads_evicted_bundle():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", bundle())
+    handler = InvalidationHandler(cache, refresh=lambda mrn: dumps_bytes(bundle("p1", mrn)))
+    handler.handle(parse_notification(f"{STORE}/fhir/Condition/c1", {"action": "UpdateResource"}))
+    assert cache.get("everything", "p1") is not None
+    assert cache.get("everything_raw", "p1") is not None
+
+
+def test_worker_reopens_a_failed_feed():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", bundle())
+    handler = InvalidationHandler(cache)
+    notifications = queue.Queue()
+    opened = []
+
+    def open_feed():
+        opened.append(len(opened))
+        if len(opened) == 1:
+            def broken():
+                raise ConnectionError("subscription unavailable")
+                yield
+            return broken()
+        return queue_notification_feed(notifications)
+
+    start_invalidation_worker(open_feed, handler, retry_interval=0.01)
+    notifications.put((f"{STORE}/fhir/Patient/p1", {"action": "UpdateResource"}))
+    deadline = time.monotonic() + 5
+    while handler.processed == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(opened) == 2
+    assert handler.feed_errors == 1
+    assert cache.get("everything", "p1") is None
+
+
+def test_worker_fails_at_start_when_feed_cannot_open():
+    def open_feed():
+        raise ImportError("missing")
+
+    def workers():
+        return sum(thread.name == "cache-invalidation" for thread in threading.enumerate())
+
+    running = workers()
+    with pytest.raises(ImportError):
+        start_invalidation_worker(open_feed, InvalidationHandler(PatientCache()))
+    assert workers() == running
+
+
+def test_pubsub_feed_requires_package(monkeypatch):
+    monkeypatch.setattr(invalidation, "pubsub_v1", None)
+    with pytest.raises(ImportError):
+        pubsub_notification_feed("projects/p/subscriptions/s")
+
+
+class FakeSubscriber:
+    """Stands in for pubsub_v1.SubscriberClient, which is not needed to run the tests."""
+
+    def __init__(self, subscriptions=(), pulls=()):
+        self.subscriptions = subscriptions
+        self.pulls = list(pulls)
+        self.acked = []
+        self.closed = False
+
+    def get_subscription(self, request):
+        if request["subscription"] not in self.subscriptions:
+            raise PermissionError(f"cannot read {request['subscription']}")
+
+    def pull(self, request, timeout):
+        outcome = self.pulls.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def acknowledge(self, request):
+        self.acked.extend(request["ack_ids"])
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def pulled(*names):
+    return SimpleNamespace(received_messages=[
+        SimpleNamespace(ack_id=f"ack-{name}", message=SimpleNamespace(data=name.encode(), attributes={}))
+        for name in names
+    ])
+
+
+def test_pubsub_feed_checks_the_subscription_up_front(monkeypatch):
+    subscriber = FakeSubscriber()
+    monkeypatch.setattr(invalidation, "pubsub_v1", SimpleNamespace(SubscriberClient=lambda: subscriber))
+    with pytest.raises(PermissionError):
+        pubsub_notification_feed("projects/p/subscriptions/missing")
+    assert subscriber.closed
+
+
+def test_pubsub_feed_treats_a_pull_timeout_as_empty(monkeypatch):
+    subscription = "projects/p/subscriptions/s"
+    subscriber = FakeSubscriber([subscription], [invalidation.DeadlineExceeded("idle"), pulled("a", "b")])
+    monkeypatch.setattr(invalidation, "pubsub_v1", SimpleNamespace(SubscriberClient=lambda: subscriber))
+    feed = pubsub_notification_feed(subscription)
+    assert [next(feed)[0], next(feed)[0]] == [b"a", b"b"]
+    subscriber.pulls.append(pulled())
+    with pytest.raises(IndexError):
+        next(feed)
+    assert subscriber.acked == ["ack-a", "ack-b"]
+
+
+def test_file_feed_skips_malformed_lines(tmp_path):
+    path = tmp_path / "notifications.ndjson"
+    path.write_text(
+        "not json\n" + json.dumps({"data": f"{STORE}/fhir/Patient/p1", "attributes": {"action": "DeleteResource"}}) + "\n"
+    )
+    stop = threading.Event()
+    feed = invalidation.file_notification_feed(str(path), stop_event=stop, poll_interval=0.01)
+    data, attributes = next(feed)
+    stop.set()
+    assert data.endswith("Patient/p1") and attributes["action"] == "DeleteResource"
@@ -0,0 +1,68 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from googleapiclient.model import JsonModel
+
+from script.jsonio import FastJSONProvider, FastJsonModel, dumps, dumps_bytes, loads
+
+SAMPLE = {
+    "zeta": 1,
+    "alpha": {"when": datetime.datetime(2024, 5, 1, 8, 30, tzinfo=datetime.timezone.utc), "day": datetime.date(2024, 5, 2)},
+    "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+    "amount": decimal.Decimal("1.50"),
+    "name": "Siti Nurhaliza",
+}
+
+
+def test_dumps_and_loads_round_trip():
+    value = {"resourceType": "Observation", "valueQuantity": {"value": 36.6, "unit": "°C"}}
+    assert loads(dumps(value)) == value
+    assert loads(dumps_bytes(value)) == value
+
+
+def providers():
+    app = Flask(__name__)
+    return app, DefaultJSONProvider(app), FastJSONProvider(app)
+
+
+def test_provider_output_matches_flask_default():
+    app, default, fast = providers()
+    assert fast.dumps(SAMPLE) == default.dumps(SAMPLE, separators=(",", ":"))
+    with app.app_context():
+        assert fast.response(SAMPLE).get_data() == default.response(SAMPLE).get_data()
+
+
+def test_provider_respects_sort_keys():
+    app, default, fast = providers()
+    fast.sort_keys = False
+    assert fast.dumps({"b": 1, "a": 2}) == '{"b":1,"a":2}'
+
+
+def test_provider_leaves_pretty_printing_to_flask():
+    app, default, fast = providers()
+    default.compact = fast.compact = False
+    with app.app_context():
+        assert fast.response({"a": 1}).get_data() == default.response({"a": 1}).get_data()
+    assert fast.dumps({"a": 1}, indent=2) == default.dumps({"a": 1}, indent=2)
+
+
+def test_provider_rejects_unknown_types_like_flask():
+    app, default, fast = providers()
+    with pytest.raises(TypeError):
+        default.dumps({"x": object()})
+    with pytest.raises(TypeError):
+        fast.dumps({"x": object()})
+
+
+@pytest.mark.parametrize("content", [b"<html><body>Bad Gateway</body></html>", b"", "plain text"])
+def test_model_returns_non_json_bodies_as_text_like_json_model(content):
+    assert FastJsonModel().deserialize(content) == JsonModel().deserialize(content)
+
+
+def test_model_unwraps_data_wrapper():
+    assert FastJsonModel(data_wrapper=True).deserialize(b'{"data": {"id": "1"}}') == {"id": "1"}
+    assert FastJsonModel().deserialize(b'{"data": {"id": "1"}}') == {"data": {"id": "1"}}
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from benchmarks.loadtest import DEFAULT_MIX, compare, percentile, route_stats, scenario_request
+
+
+def result(throughput=100.0, **routes):
+    return {
+        "throughput": throughput,
+        "routes": {
+            name: {"p90_ms": p90, "error_rate": error_rate}
+            for name, (p90, error_rate) in (routes or {"everything": (50.0, 0.0), "timeline": (20.0, 0.0)}).items()
+        },
+    }
+
+
+def test_a_run_within_tolerance_passes():
+    assert compare(result(92.0, everything=(54.0, 0.005), timeline=(21.0, 0.0)), result(), 0.10) == []
+
+
+def test_throughput_drop_fails():
+    [failure] = compare(result(85.0), result(), 0.10)
+    assert failure.startswith("throughput 85.0 req/s")
+
+
+def test_p90_rise_over_tolerance_fails():
+    [failure] = compare(result(everything=(56.0, 0.0), timeline=(20.0, 0.0)), result(), 0.10)
+    assert failure.startswith("everything: p90 56.0 ms")
+
+
+def test_error_rate_rise_fails():
+    [failure] = compare(result(everything=(50.0, 0.02), timeline=(20.0, 0.0)), result(), 0.10)
+    assert failure.startswith("everything: error rate 2.00%")
+
+
+def test_route_missing_from_the_result_fails():
+    assert compare(result(everything=(50.0, 0.0)), result(), 0.10) == ["timeline: no requests in this run"]
+
+
+def test_nearest_rank_percentiles():
+    ordered = [float(n) for n in range(1, 11)]
+    assert [percentile(ordered, p) for p in (0.5, 0.9, 0.99)] == [5.0, 9.0, 10.0]
+    assert percentile([7.0], 0.9) == 7.0
+    stats = route_stats(list(reversed(ordered)) * 10, errors=5, elapsed=4.0)
+    assert (stats["requests"], stats["throughput"], stats["error_rate"]) == (100, 25.0, 0.05)
+    assert (stats["p50_ms"], stats["p90_ms"], stats["p99_ms"]) == (5.0, 9.0, 10.0)
+
+
+def test_every_scenario_in_the_default_mix_builds_a_request():
+    seeds = [{"mrn": "MRN1", "patient_id": "p1", "encounter_id": "e1"}]
+    for name in DEFAULT_MIX:
+        method, path, body = scenario_request(name, random.Random(0), seeds)
+        assert method in ("GET", "POST") and path.startswith("/api/")
+    with pytest.raises(ValueError):
+        scenario_request("unknown", random.Random(0), seeds)
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from conftest import mrn_patient
+from script.patient_index import PatientIndex, read_patient_ndjson, soundex
+
+
+def person(patient_id, family, given, birth_date="1970-01-01", gender="female", mrn=None):
+    return mrn_patient(
+        patient_id,
+        mrn or f"MRN-{patient_id}",
+        name=[{"family": family, "given": given.split()}],
+        birthDate=birth_date,
+        gender=gender,
+    )
+
+
+PATIENTS = [
+    person("1", "Smith", "John", "1970-01-15", "male", "MRN0001"),
+    person("2", "Smyth", "Joanna", "1970-03-02"),
+    person("3", "Santoso", "Budi", "1985-07-20", "male", "MRN0003"),
+    person("4", "Schmidt", "Johan", "1992-11-30", "male"),
+    person("5", "Wijaya", "Siti Rahma", "1970-01-09"),
+]
+
+
+def ids(results):
+    return [r["id"] for r in results]
+
+
+@pytest.fixture
+def index():
+    index = PatientIndex()
+    assert index.add_all(PATIENTS) == 5
+    return index
+
+
+def test_soundex():
+    assert soundex("Robert") == soundex("Rupert") == "R163"
+    assert soundex("Smith") == soundex("Smyth") == "S530"
+    assert soundex("Ashcraft") == "A261"
+    assert soundex("") == ""
+
+
+def test_exact_prefix_phonetic_and_typo_matches_rank_in_that_order(index):
+    # Smyth and Schmidt both sound like Smith; equal scores sort by name.
+    results = index.search("smith")
+    assert [(r["id"], r["score"]) for r in results] == [("1", 4), ("4", 2), ("2", 2)]
+    assert ids(index.search("smi")) == ["1"]
+    assert ids(index.search("santosa")) == ["3"]
+    assert ids(index.search("wijya")) == ["5"]
+
+
+def test_name_mrn_and_birth_date_combine(index):
+    assert ids(index.search("smith jo 1970")) == ["1", "2"]
+    assert ids(index.search("smith 1970-03")) == ["2"]
+    assert ids(index.search("mrn0003")) == ["3"]
+    assert ids(index.search("mrn000")) == ["3", "1"]
+    assert ids(index.search("1970-01")) and set(ids(index.search("1970-01"))) == {"1", "5"}
+    assert ids(index.search("smith", gender="female")) == ["2"]
+    assert len(index.search("s", limit=2)) == 2
+
+
+def test_replacing_a_patient_updates_every_index(index):
+    index.add(person("1", "Hartono", "Adi", "1990-05-05", "male", "MRN9999"))
+    assert len(index) == 5
+    assert "1" not in ids(index.search("smith"))
+    assert ids(index.search("hartono 1990")) == ["1"]
+    assert ids(index.search("mrn0001")) == []
+    assert ids(index.search("mrn9999")) == ["1"]
+    index.remove("1")
+    assert ids(index.search("hartono")) == []
+
+
+def test_bulk_load_with_repeated_ids_keeps_the_last_version():
+    # A bulk export may carry several versions of the same patient.
+    patients = [person(str(n), f"Family{n}", "Given", f"19{50 + n % 40}-01-01") for n in range(50)]
+    patients += [person("7", "Renamed", "Given", "1999-12-31", mrn="MRN-NEW"), patients[3]]
+    index = PatientIndex()
+    index.add_all(patients)
+    assert len(index) == 50
+    assert ids(index.search("renamed 1999")) == ["7"]
+    assert "7" not in ids(index.search("family7"))
+    assert ids(index.search("mrn-new")) == ["7"]
+    assert ids(index.search("mrn-3 1953")) == ["3"]
+    for n in range(50):
+        index.remove(str(n))
+    assert len(index) == 0
+    assert index._sorted_births == [] and index._sorted_mrns == []
+
+
+def test_read_patient_ndjson(tmp_path):
+    path = tmp_path / "Patient.ndjson"
+    path.write_text("".join(json.dumps(patient) + "\n" for patient in PATIENTS) + "\n")
+    index = PatientIndex()
+    assert index.add_all(read_patient_ndjson(str(path))) == 5
@@ -0,0 +1,96 @@
+import gzip
+
+from flask import Flask, Response
+
+from conftest import patient_bundle
+from script import payload
+from script.cache import PatientCache
+from script.payload import (
+    choose_encoding,
+    compress_body,
+    compress_response,
+    parse_fields,
+    project_bundle,
+    upstream_params,
+)
+
+BUNDLE = {
+    "resourceType": "Bundle",
+    "type": "searchset",
+    "entry": [
+        {"resource": {"resourceType": "Patient", "id": "p1", "name": [{"family": "Doe"}], "gender": "female"}},
+        {"resource": {"resourceType": "Observation", "id": "o1", "code": {"text": "Heart rate"},
+                      "valueQuantity": {"value": 72}, "status": "final"}},
+    ],
+}
+
+
+def test_parse_fields_splits_type_specific_elements():
+    assert parse_fields("code, status,Observation.valueQuantity,") == {
+        "*": {"code", "status"},
+        "Observation": {"valueQuantity"},
+    }
+    assert parse_fields(None) is None
+
+
+def test_project_bundle_keeps_ids_and_leaves_input_untouched():
+    projected = project_bundle(BUNDLE, parse_fields("code,Observation.valueQuantity"))
+    assert projected["entry"][0]["resource"] == {"resourceType": "Patient", "id": "p1"}
+    assert projected["entry"][1]["resource"] == {
+        "resourceType": "Observation", "id": "o1", "code": {"text": "Heart rate"}, "valueQuantity": {"value": 72},
+    }
+    assert BUNDLE["entry"][0]["resource"]["gender"] == "female"
+    assert project_bundle(BUNDLE, None) is BUNDLE
+
+
+def test_choose_encoding_honours_q_zero(monkeypatch):
+    assert choose_encoding("gzip;q=0, identity") is None
+    assert choose_encoding("deflate, *") == "gzip"
+    monkeypatch.setattr(payload, "brotli", None)
+    assert choose_encoding("br, gzip") == "gzip"
+
+
+def test_upstream_params_only_passes_fhir_parameters():
+    assert upstream_params({"_elements": "code", "fields": "x", "_summary": ""}) == {"_elements": "code"}
+
+
+def test_compress_response_compresses_large_json_only():
+    app = Flask(__name__)
+    with app.app_context():
+        body = b'{"entry": [' + b'{"a": 1},' * 500 + b'{}]}'
+        response = compress_response(Response(body, mimetype="application/json"), "gzip")
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(response.get_data()) == body
+        assert "Accept-Encoding" in response.vary
+
+        small = compress_response(Response(b"{}", mimetype="application/json"), "gzip")
+        assert "Content-Encoding" not in small.headers
+
+        image = compress_response(Response(body, mimetype="image/png"), "gzip")
+        assert "Content-Encoding" not in image.headers
+
+
+def test_encoded_raw_bytes_are_compressed_once():
+    cache = PatientCache()
+    raw = b'{"resourceType": "Bundle"}' * 100
+    cache.store_bundle("MRN1", patient_bundle("p1", "MRN1"), raw=raw)
+    calls = []
+
+    def encode(body, encoding):
+        calls.append(encoding)
+        return compress_body(body, encoding)
+
+    first = cache.get_encoded_raw("p1", "gzip", encode)
+    assert cache.get_encoded_raw("p1", "gzip", encode) is first
+    assert gzip.decompress(first) == raw
+    assert calls == ["gzip"]
+
+
+def test_encoded_raw_bytes_follow_the_bundle():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", patient_bundle("p1", "MRN1"), raw=b"old" * 100)
+    cache.get_encoded_raw("p1", "gzip", compress_body)
+    cache.store_bundle("MRN1", patient_bundle("p1", "MRN1"), raw=b"new" * 100)
+    assert gzip.decompress(cache.get_encoded_raw("p1", "gzip", compress_body)) == b"new" * 100
+    cache.evict_patient("p1")
+    assert cache.get_encoded_raw("p1", "gzip", compress_body) is None
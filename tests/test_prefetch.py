@@ -0,0 +1,83 @@
+import time
+from datetime import datetime
+
+from conftest import patient_bundle
+from script import prefetch
+from script.cache import PatientCache
+from script.jsonio import dumps_bytes
+from script.prefetch import PrefetchScheduler, in_window, parse_window, read_mrn_file
+
+
+def bundle(mrn, raw=False):
+    return dumps_bytes(patient_bundle(f"id-{mrn}", mrn))
+
+
+def test_read_mrn_file_skips_comments_and_blanks(tmp_path):
+    path = tmp_path / "mrns.txt"
+    path.write_text("# clinic list\nMRN1\n\nMRN2  # follow-up\n")
+    assert read_mrn_file(str(path)) == ["MRN1", "MRN2"]
+
+
+def test_windows_may_wrap_midnight():
+    assert parse_window("22-5") == (22, 5)
+    assert parse_window("") is None
+    assert in_window((22, 5), datetime(2024, 1, 1, 23))
+    assert in_window((22, 5), datetime(2024, 1, 1, 4))
+    assert not in_window((22, 5), datetime(2024, 1, 1, 12))
+    assert in_window((1, 6), datetime(2024, 1, 1, 1))
+    assert not in_window((1, 6), datetime(2024, 1, 1, 6))
+    assert in_window(None)
+
+
+def test_schedule_dedupes_queued_mrns():
+    scheduler = PrefetchScheduler(PatientCache(), fetch_everything=bundle)
+    assert scheduler.schedule(["MRN1", "MRN2", "MRN1"]) == 2
+    assert scheduler.schedule(["MRN2"]) == 0
+    assert scheduler.report()["pending"] == 2
+
+
+def test_prefetch_one_caches_and_counts_warm_hits():
+    cache = PatientCache()
+    fetched = []
+    scheduler = PrefetchScheduler(cache, fetch_everything=lambda mrn, raw: fetched.append(mrn) or bundle(mrn))
+    assert scheduler.prefetch_one("MRN1")
+    assert scheduler.prefetch_one("MRN1")
+    assert fetched == ["MRN1"]
+    assert cache.get("everything", "id-MRN1") is not None
+    assert cache.get("everything_raw", "id-MRN1") == bundle("MRN1")
+
+    scheduler.record_request("MRN1", hit=True)
+    scheduler.record_request("MRN1", hit=False)
+    scheduler.record_request("MRN9", hit=False)
+    report = scheduler.report()
+    assert (report["warm_hits"], report["cold_misses"], report["warm_hit_ratio"]) == (1, 1, 0.5)
+
+
+def test_failed_prefetch_is_counted():
+    def fail(mrn, raw):
+        raise RuntimeError("upstream down")
+
+    scheduler = PrefetchScheduler(PatientCache(), fetch_everything=fail)
+    assert not scheduler.prefetch_one("MRN1")
+    assert scheduler.report()["failed"] == 1
+    assert "MRN1" not in scheduler.prefetched
+
+
+def test_prefetched_mrns_are_bounded():
+    scheduler = PrefetchScheduler(PatientCache(max_entries=10000), fetch_everything=bundle, max_tracked=5)
+    for i in range(20):
+        scheduler.prefetch_one(f"MRN{i}")
+    assert list(scheduler.prefetched) == [f"MRN{i}" for i in range(15, 20)]
+
+
+def test_prefetched_mrns_reset_when_a_new_window_opens(monkeypatch):
+    scheduler = PrefetchScheduler(PatientCache(), fetch_everything=bundle, rate_per_second=0, window=(1, 6))
+    scheduler.prefetch_one("MRN1")
+    monkeypatch.setattr(prefetch, "in_window", lambda window, now=None: True)
+    scheduler.schedule(["MRN2"])
+    scheduler.start()
+    deadline = time.monotonic() + 5
+    while scheduler.report()["prefetched"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+    assert list(scheduler.prefetched) == ["MRN2"]
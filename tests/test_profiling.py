@@ -0,0 +1,96 @@
+import sys
+import time
+from collections import Counter
+
+import pytest
+
+from script import profiling
+from script.profiling import ProfileStore, StackSampler, begin_request, collapse, end_request, format_spans, server_timing, span
+
+
+@pytest.fixture
+def profile():
+    profile = begin_request()
+    yield profile
+    end_request()
+
+
+def test_span_is_a_shared_no_op_outside_a_request():
+    assert span("upstream") is span("parse") is profiling._NO_SPAN
+    with span("upstream"):
+        pass
+    assert profiling.current_profile() is None
+
+
+def test_nested_spans_are_exclusive(profile):
+    with span("handler"):
+        time.sleep(0.01)
+        with span("upstream"):
+            time.sleep(0.02)
+        with span("upstream"):
+            time.sleep(0.02)
+    assert profile.spans["upstream"] >= 40
+    assert 10 <= profile.spans["handler"] < 30
+    assert sum(profile.spans.values()) <= profile.elapsed_ms()
+    assert profile.open_spans == []
+
+
+def test_end_request_detaches_the_profile(profile):
+    assert profiling.current_profile() is profile
+    assert end_request() is profile
+    assert span("late") is profiling._NO_SPAN
+
+
+def test_header_and_log_formats():
+    spans = {"upstream": 12.345, "serialize": 0.5}
+    assert server_timing(spans) == "upstream;dur=12.3, serialize;dur=0.5"
+    assert format_spans(spans) == "upstream=12.3ms serialize=0.5ms"
+
+
+def stack(*names):
+    # Stacks are innermost-first, as StackSampler records them.
+    return tuple(compile("pass", f"{name}.py", "exec").replace(co_name=name) for name in names)
+
+
+def test_collapse_writes_root_first_stacks():
+    samples = Counter({stack("leaf", "root"): 3, stack("root"): 1})
+    lines = collapse(samples)
+    assert lines[0].startswith("root (root.py:1);leaf (leaf.py:1)") and lines[0].endswith(" 3")
+    assert lines[1] == "root (root.py:1) 1"
+
+
+def test_store_buckets_stacks_past_max_stacks():
+    store = ProfileStore(max_stacks=2, max_requests=2)
+    for n in range(4):
+        profile = profiling.RequestProfile(sampled=True)
+        profile.samples[stack(f"f{n}")] += 2
+        store.add("/api/patient", profile, {"n": n})
+    collapsed = store.collapsed("/api/patient").splitlines()
+    assert "[other] 4" in collapsed
+    assert len(collapsed) == 3
+    summary = store.summary()
+    assert summary["routes"]["/api/patient"] == {"profiled_requests": 4, "samples": 8}
+    assert [record["n"] for record in summary["recent"]] == [2, 3]
+    store.clear()
+    assert store.collapsed("/api/patient") == ""
+
+
+def test_sampler_samples_registered_threads_and_parks_when_idle():
+    sampler = StackSampler(interval=0.001)
+    profile = begin_request(sampler)
+    deadline = time.monotonic() + 5
+    while not profile.samples and time.monotonic() < deadline:
+        time.sleep(0.005)
+    end_request(sampler)
+    assert profile.samples
+
+    # With nothing registered the sampler blocks on the event instead of polling.
+    while time.monotonic() < deadline:
+        frame = sys._current_frames()[sampler._thread.ident]
+        if frame.f_code.co_name == "wait" and frame.f_back.f_code.co_name == "wait":
+            break
+        time.sleep(0.005)
+    assert frame.f_back.f_back.f_code is StackSampler._run.__code__
+    samples = sum(profile.samples.values())
+    time.sleep(0.02)
+    assert sum(profile.samples.values()) == samples
@@ -0,0 +1,109 @@
+from conftest import mrn_patient
+from script.cache import PatientCache
+from script.snapshot import RECENT_REPORTS, apply_resource, build_snapshot
+
+
+def bundle(*resources):
+    return {"resourceType": "Bundle", "entry": [{"resource": resource} for resource in resources]}
+
+
+def heart_rate(resource_id, effective, value, status="final"):
+    return {
+        "resourceType": "Observation",
+        "id": resource_id,
+        "status": status,
+        "code": {"coding": [{"system": "http://loinc.org", "code": "8867-4", "display": "Heart rate"}]},
+        "subject": {"reference": "Patient/p1"},
+        "effectiveDateTime": effective,
+        "valueQuantity": {"value": value, "unit": "/min"},
+    }
+
+
+def condition(resource_id, onset, clinical="active"):
+    return {
+        "resourceType": "Condition",
+        "id": resource_id,
+        "clinicalStatus": {"coding": [{"code": clinical}]},
+        "code": {"coding": [{"code": resource_id}]},
+        "subject": {"reference": "Patient/p1"},
+        "onsetDateTime": onset,
+    }
+
+
+def report(resource_id, issued):
+    return {"resourceType": "DiagnosticReport", "id": resource_id, "status": "final", "issued": issued,
+            "subject": {"reference": "Patient/p1"}}
+
+
+PATIENT = mrn_patient("p1", "MRN1", name=[{"family": "Santoso", "given": ["Budi"]}], gender="male")
+
+
+def test_build_snapshot_keeps_active_and_latest_items():
+    snapshot = build_snapshot(bundle(
+        PATIENT,
+        condition("c-old", "2020-03-01"),
+        condition("c-new", "2023"),
+        condition("c-resolved", "2024-01-01", clinical="resolved"),
+        heart_rate("hr-1", "2024-05-01T08:00:00Z", 80),
+        heart_rate("hr-2", "2024-05-01T09:00:00Z", 95),
+        *[report(f"r{i}", f"2024-02-{i + 1:02d}") for i in range(RECENT_REPORTS + 2)],
+    ))
+    assert snapshot["patient"] == {"id": "p1", "name": "Budi Santoso", "gender": "male", "birthDate": None}
+    assert [c["id"] for c in snapshot["active_conditions"]] == ["c-new", "c-old"]
+    assert snapshot["latest_vitals"]["8867-4"]["value"] == 95
+    assert [r["id"] for r in snapshot["recent_reports"]] == ["r6", "r5", "r4", "r3", "r2"]
+
+
+def test_times_in_other_offsets_compare_as_instants():
+    # 08:00+07:00 is 01:00Z, so it is older than 01:30Z despite sorting later as text.
+    snapshot = build_snapshot(bundle(
+        PATIENT,
+        heart_rate("hr-utc", "2024-05-01T01:30:00Z", 70),
+        heart_rate("hr-wib", "2024-05-01T08:00:00+07:00", 110),
+        report("r-wib", "2024-05-01T08:00:00+07:00"),
+        report("r-utc", "2024-05-01T01:30:00Z"),
+        report("r-day", "2024-05-01"),
+    ))
+    assert snapshot["latest_vitals"]["8867-4"]["id"] == "hr-utc"
+    assert [r["id"] for r in snapshot["recent_reports"]] == ["r-utc", "r-wib", "r-day"]
+
+
+def test_apply_resource_is_idempotent_and_handles_retractions():
+    snapshot = build_snapshot(bundle(PATIENT, heart_rate("hr-1", "2024-05-01T08:00:00Z", 80)))
+    newer = heart_rate("hr-2", "2024-05-02T08:00:00Z", 90)
+    once = apply_resource(snapshot, newer)
+    assert apply_resource(once, newer) == once
+    assert snapshot["latest_vitals"]["8867-4"]["id"] == "hr-1"
+    assert apply_resource(once, heart_rate("hr-0", "2024-04-01", 60)) == once
+    retracted = apply_resource(once, heart_rate("hr-2", "2024-05-02T08:00:00Z", 90, status="entered-in-error"))
+    assert "8867-4" not in retracted["latest_vitals"]
+    assert apply_resource(once, condition("c-1", "2024-01-01", clinical="resolved")) == once
+
+
+def cached_patient():
+    cache = PatientCache()
+    cache.store_bundle("MRN1", bundle(PATIENT, heart_rate("hr-1", "2024-05-01T08:00:00Z", 80)))
+    return cache
+
+
+def test_apply_create_patches_the_snapshot_and_drops_bundle_entries():
+    cache = cached_patient()
+    expires = cache._entries[("snapshot", "p1")][0]
+    evicted = cache.apply_create("p1", "Observation", "hr-2", heart_rate("hr-2", "2024-05-02T08:00:00Z", 90))
+    assert "everything" in evicted and "snapshot" not in evicted
+    assert cache.get("snapshot", "p1")["latest_vitals"]["8867-4"]["id"] == "hr-2"
+    assert cache._entries[("snapshot", "p1")][0] == expires
+    # The notification for the same create later finds it already applied.
+    assert cache.apply_create("p1", "Observation", "hr-2") == []
+    assert cache.get("snapshot", "p1") is not None
+
+
+def test_apply_create_drops_the_snapshot_when_it_cannot_be_patched():
+    cache = cached_patient()
+    assert cache.apply_create("p1", "Observation", "unknown") == ["everything", "timeline", "snapshot"]
+    cache = cached_patient()
+    assert "snapshot" in cache.apply_create("p1", "Observation", None, heart_rate(None, "2024-05-02", 90))
+    cache = cached_patient()
+    cache.store_bundle("MRN2", bundle(mrn_patient("p2", "MRN2"), heart_rate("hr-p2", "2024-05-02", 90)))
+    assert "snapshot" in cache.apply_create("p1", "Observation", "hr-p2")
+    assert cache.get("snapshot", "p2") is not None
@@ -0,0 +1,77 @@
+import io
+import json
+
+import pytest
+
+from benchmarks.synthetic_data import ChartSizes, iter_json, iter_resources, write_bundles, write_ndjson
+from script import function
+
+# Every chart gets procedures and reports, so one small population covers all types.
+SIZES = ChartSizes(procedures_max=4, reports_per_encounter=1.0)
+
+
+def ndjson(seed, patients=10):
+    stream = io.StringIO()
+    write_ndjson(iter_json(patients, seed, SIZES, practitioners=5), stream=stream)
+    return stream.getvalue()
+
+
+def test_same_seed_gives_identical_output():
+    assert ndjson(7) == ndjson(7)
+    assert ndjson(7) != ndjson(8)
+
+
+def test_every_ndjson_and_bundle_line_parses(tmp_path):
+    counts = write_ndjson(iter_json(10, 3, SIZES, practitioners=5), out_dir=str(tmp_path))
+    for resource_type, count in counts.items():
+        lines = (tmp_path / f"{resource_type}.ndjson").read_text(encoding="utf-8").splitlines()
+        assert len(lines) == count
+        assert {json.loads(line)["resourceType"] for line in lines} == {resource_type}
+
+    stream = io.StringIO()
+    assert write_bundles(iter_json(10, 3, SIZES, practitioners=5), stream) == 11
+    for line in stream.getvalue().splitlines():
+        bundle = json.loads(line)
+        for entry in bundle["entry"]:
+            resource = entry["resource"]
+            assert entry["request"] == {"method": "PUT", "url": f"{resource['resourceType']}/{resource['id']}"}
+
+
+def test_references_resolve_within_the_population():
+    resources = list(iter_resources(10, 5, SIZES, practitioners=5))
+    ids = {f"{r['resourceType']}/{r['id']}" for r in resources}
+    assert len(ids) == len(resources)
+    for resource in resources:
+        for field in ("subject", "encounter", "requester"):
+            if field in resource:
+                assert resource[field]["reference"] in ids
+        for performer in resource.get("performer", []):
+            assert performer["reference"] in ids
+
+
+def shape(value):
+    """The nested keys of a resource, with lists reduced to their first item's shape."""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(value[0])] if value else []
+    return None
+
+
+BUILT = {
+    "Patient": function.build_patient("Family", "Given", "female", "1970-01-01", "MRN1"),
+    "Practitioner": function.build_practitioner("1000000000", "Family", "Given"),
+    "Encounter": function.build_encounter("p1", "finished", "Admission"),
+    "Condition": function.build_condition("p1", "Active", "Confirmed", "38341003", "Hypertension", "2024-01-01"),
+    "Procedure": function.build_procedure("p1", "e1", "completed", "80146002", "Appendectomy", "2024-01-01", "2024-01-01", "Indicated"),
+    "MedicationRequest": function.build_medication_request("p1", "dr", "active", "order", "860975", "Metformin", "Dr. X", "Daily"),
+    "DiagnosticReport": function.build_diagnostic_report("final", "58410-2", "CBC", "Normal.", "p1", "e1", "dr"),
+    "Observation": function.build_observation("p1", "e1", "final", "8867-4", "Heart rate", 72, "/min", "2024-01-01T08:00:00Z"),
+}
+
+
+@pytest.mark.parametrize("resource_type", sorted(BUILT))
+def test_resources_have_the_shape_the_app_creates(resource_type):
+    generated = next(r for r in iter_resources(10, 9, SIZES, practitioners=5) if r["resourceType"] == resource_type)
+    del generated["id"]
+    assert shape(generated) == shape(BUILT[resource_type])
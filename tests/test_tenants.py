@@ -0,0 +1,136 @@
+import json
+import threading
+
+import pytest
+
+from conftest import mrn_patient
+from script import function
+from script import tenants as tenants_module
+from script.jsonio import loads
+from script.tenants import (
+    DEFAULT_TENANT,
+    Tenant,
+    TenantBusyError,
+    TenantRegistry,
+    TokenBucket,
+    UnknownTenantError,
+    load_tenants,
+)
+
+
+def tenant(name=DEFAULT_TENANT, **settings):
+    return Tenant(name, "p", "l", "d", "s", **settings)
+
+
+def test_token_bucket_allows_a_burst_then_reports_the_wait(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(tenants_module.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(2, burst=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.try_acquire() == 0.0
+    now[0] += 60
+    assert [bucket.try_acquire() for _ in range(4)][-1] > 0
+
+
+def test_admit_enforces_the_rate_limit_and_concurrency_cap():
+    limited = tenant(rate_per_second=1, burst=1)
+    limited.admit()
+    limited.release()
+    with pytest.raises(TenantBusyError) as busy:
+        limited.admit()
+    assert busy.value.retry_after > 0
+
+    capped = tenant(max_concurrency=2)
+    capped.admit()
+    capped.admit()
+    with pytest.raises(TenantBusyError):
+        capped.admit()
+    capped.release()
+    capped.admit()
+    assert capped.metrics.snapshot()["rejected"] == 1
+
+
+def test_registry_resolves_names_and_the_default():
+    default, other = tenant(), tenant("rs-harapan")
+    registry = TenantRegistry(default)
+    registry.add(other)
+    assert registry.get(None) is default and registry.get("") is default
+    assert registry.get("rs-harapan") is other
+    with pytest.raises(UnknownTenantError):
+        registry.get("rs-unknown")
+    assert [t.name for t in registry] == [DEFAULT_TENANT, "rs-harapan"]
+
+
+def test_load_tenants(tmp_path):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps({
+        "rs-harapan": {"project_id": "p1", "location": "asia-southeast2", "dataset_id": "d1",
+                       "fhir_store_id": "s1", "rate_per_second": 20, "max_concurrency": 8},
+    }))
+    [loaded] = load_tenants(str(path))
+    assert loaded.fhir_store_name == "projects/p1/locations/asia-southeast2/datasets/d1/fhirStores/s1"
+    assert loaded.describe()["rate_per_second"] == 20
+    assert loaded.max_concurrency == 8
+
+
+@pytest.fixture
+def credential_calls(monkeypatch):
+    calls = []
+    get_credentials = tenants_module.get_credentials
+    monkeypatch.setenv("HEALTHCARE_API_ANONYMOUS", "1")
+    monkeypatch.setattr(tenants_module, "get_credentials", lambda: calls.append(1) or get_credentials())
+    return calls
+
+
+def in_thread(fn):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_request_threads_reuse_pooled_clients(credential_calls):
+    shared = tenant(pool_size=1)
+
+    def request():
+        client = shared.client
+        assert shared.client is client
+        shared.release_client()
+        return client
+
+    first = in_thread(request)
+    assert in_thread(request) is first
+    assert shared.session is shared.session
+    assert len(credential_calls) == 1
+
+
+def test_idle_pool_is_bounded(credential_calls):
+    shared = tenant(pool_size=1)
+    leased = threading.Barrier(3)
+
+    def request():
+        client = shared.client
+        leased.wait()
+        shared.release_client()
+        return client
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(shared._idle_clients) == 1
+    assert len(credential_calls) == 1
+
+
+def test_load_everything_caches_the_upstream_bytes(fhir_standin, monkeypatch):
+    fhir_url, store = fhir_standin
+    monkeypatch.setattr(function, "HEALTHCARE_API_ENDPOINT", fhir_url.split("/v1/")[0])
+    store.create(mrn_patient("p1", "MRN1"))
+    shared = tenant()
+    bundle = shared.load_everything("MRN1")
+    assert shared.load_everything("MRN1") is bundle
+    assert loads(shared.cache.get("everything_raw", "p1")) == bundle
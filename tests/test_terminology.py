@@ -0,0 +1,108 @@
+import random
+
+import pytest
+
+from script import terminology
+from script.terminology import (
+    CodeSystemIndex,
+    TerminologyError,
+    TerminologyService,
+    load_code_system,
+    read_snomed_rf2,
+)
+
+LOINC = [
+    ("8867-4", "Heart rate"),
+    ("9279-1", "Respiratory rate"),
+    ("8310-5", "Body temperature"),
+    ("8480-6", "Systolic blood pressure"),
+    ("8462-4", "Diastolic blood pressure"),
+    ("2345-7", "Glucose [Mass/volume] in Serum or Plasma"),
+]
+
+
+def matches(concepts, query):
+    """Brute-force reference for CodeSystemIndex.search, ignoring order and limit."""
+    words = terminology._words(query)
+    found = set()
+    for code, display in concepts:
+        display_words = terminology._words(display)
+        if code.startswith(query.strip()) or (
+            words and all(any(w.startswith(word) for w in display_words) for word in words)
+        ):
+            found.add(code)
+    return found
+
+
+def test_lookup_and_canonical_display():
+    index = CodeSystemIndex("loinc", LOINC)
+    assert index.system == "http://loinc.org"
+    assert index.display("8867-4") == "Heart rate"
+    assert index.canonical_display("8867-4", "heart RATE") == "Heart rate"
+    assert index.canonical_display("8867-4", "Pulse") == "Heart rate"
+    with pytest.raises(TerminologyError):
+        index.canonical_display("0000-0")
+
+
+def test_duplicate_codes_keep_the_first_display():
+    index = CodeSystemIndex("loinc", LOINC + [("8867-4", "Pulse")])
+    assert len(index) == len(LOINC)
+    assert index.display("8867-4") == "Heart rate"
+
+
+def test_word_prefix_search():
+    index = CodeSystemIndex("loinc", LOINC)
+    assert [r["code"] for r in index.search("hear rat")] == ["8867-4"]
+    assert {r["code"] for r in index.search("blood pres")} == {"8480-6", "8462-4"}
+    assert [r["code"] for r in index.search("8867")] == ["8867-4"]
+    assert index.search("  ") == []
+
+
+def test_typos_are_corrected_from_the_vocabulary():
+    index = CodeSystemIndex("snomed", [("233604007", "Pneumonia"), ("195967001", "Asthma")])
+    assert [r["code"] for r in index.search("pnuemonia")] == ["233604007"]
+    assert index.search("zzzzzz") == []
+
+
+@pytest.mark.parametrize("query", ["ca", "ca ac", "acute ca", "chronic b", "b c", "x", "acu", "1"])
+def test_postings_match_brute_force_on_large_systems(query):
+    # Enough concepts per word that search goes past SCAN_LIMIT and
+    # intersects postings, including displays that repeat a word prefix.
+    rng = random.Random(7)
+    vocabulary = ["acute", "chronic", "cardiac", "carcinoma", "bone", "blood", "cell", "acid", "xanthoma", "calcium"]
+    concepts = [
+        (str(100000 + n), " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 4))))
+        for n in range(5000)
+    ]
+    index = CodeSystemIndex("snomed", concepts)
+    results = index.search(query, limit=10000)
+    codes = [r["code"] for r in results]
+    assert len(codes) == len(set(codes))
+    assert set(codes) == matches(concepts, query)
+    limited = index.search(query, limit=7)
+    assert len(limited) == min(7, len(codes))
+    assert {r["code"] for r in limited} <= set(codes)
+
+
+def test_snomed_rf2_reader_keeps_active_fully_specified_names(tmp_path):
+    path = tmp_path / "sct2_Description_Snapshot-en_INT_20240101.txt"
+    header = "id\teffectiveTime\tactive\tmoduleId\tconceptId\tlanguageCode\ttypeId\tterm\tcaseSignificanceId\n"
+    rows = [
+        "1\t20240101\t1\tm\t195967001\ten\t900000000000003001\tAsthma (disorder)\tc\n",
+        "2\t20240101\t1\tm\t195967001\ten\t900000000000013009\tAsthma\tc\n",
+        "3\t20240101\t0\tm\t233604007\ten\t900000000000003001\tPneumonia (disorder)\tc\n",
+    ]
+    path.write_text(header + "".join(rows))
+    assert list(read_snomed_rf2(str(path))) == [("195967001", "Asthma")]
+    assert load_code_system("snomed", str(path)).display("195967001") == "Asthma"
+
+
+def test_service_passes_unloaded_systems_through(tmp_path):
+    path = tmp_path / "loinc.tsv"
+    path.write_text("code\tdisplay\n" + "".join(f"{code}\t{display}\n" for code, display in LOINC))
+    service = TerminologyService()
+    service.load("loinc", str(path))
+    assert service.canonical_display("loinc", "8867-4", "pulse") == "Heart rate"
+    assert service.canonical_display("rxnorm", "123", "Anything") == "Anything"
+    with pytest.raises(TerminologyError):
+        service.search("rxnorm", "amox")
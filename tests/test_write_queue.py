@@ -0,0 +1,93 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import STORE_PATH, mrn_patient
+from script.write_queue import TRACKING_TAG_SYSTEM, WriteBehindFlusher, WriteQueue, build_create_bundle
+
+OBSERVATION = {
+    "resourceType": "Observation",
+    "status": "final",
+    "code": {"coding": [{"system": "http://loinc.org", "code": "8867-4"}]},
+    "subject": {"reference": "Patient/p1"},
+}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WriteQueue(str(tmp_path / "writes.db"))
+
+
+def test_writes_move_from_queued_to_created(queue):
+    tracking_id = queue.enqueue("default", OBSERVATION, "p1")
+    [write] = queue.claim(10)
+    assert write["id"] == tracking_id and write["resource"] == OBSERVATION and write["patient_id"] == "p1"
+    assert queue.claim(10) == []
+    queue.complete(tracking_id, "obs-1")
+    assert queue.status(tracking_id)["status"] == "created"
+    assert queue.status(tracking_id)["id"] == "obs-1"
+    assert queue.counts() == {"created": 1}
+    assert queue.counts("other") == {}
+
+
+def test_failed_writes_back_off_or_fail_for_good(queue):
+    retried = queue.enqueue("default", OBSERVATION)
+    rejected = queue.enqueue("default", OBSERVATION)
+    queue.claim(10)
+    queue.fail(retried, "503 Service Unavailable", retry_in=60)
+    queue.fail(rejected, "400 Bad Request")
+    assert queue.claim(10) == []
+    assert queue.status(retried)["status"] == "queued" and queue.status(retried)["attempts"] == 1
+    assert queue.status(rejected)["status"] == "failed" and queue.status(rejected)["error"] == "400 Bad Request"
+
+
+def test_writes_in_flight_are_queued_again_after_a_restart(tmp_path):
+    path = str(tmp_path / "writes.db")
+    tracking_id = WriteQueue(path).enqueue("default", OBSERVATION)
+    WriteQueue(path).claim(10)
+    [write] = WriteQueue(path).claim(10)
+    assert write["id"] == tracking_id
+
+
+def test_batch_entries_are_conditional_on_their_tracking_tag():
+    [entry] = build_create_bundle([{"id": "abc", "resource_type": "Observation", "resource": OBSERVATION}])["entry"]
+    assert entry["request"] == {"method": "POST", "url": "Observation", "ifNoneExist": f"_tag={TRACKING_TAG_SYSTEM}|abc"}
+    assert entry["resource"]["meta"]["tag"] == [{"system": TRACKING_TAG_SYSTEM, "code": "abc"}]
+    assert "meta" not in OBSERVATION
+
+
+def test_flush_reports_the_created_ids_from_the_batch_response(queue, fhir_standin, healthcare_client):
+    _, store = fhir_standin
+    tenant = SimpleNamespace(client=healthcare_client, fhir_store_name=STORE_PATH)
+    created = []
+    flusher = WriteBehindFlusher(
+        queue, get_tenant=lambda name: tenant, on_created=lambda *args: created.append(args)
+    )
+    new_patient = mrn_patient("unused", "MRN9")
+    del new_patient["id"]
+    observation = queue.enqueue("default", OBSERVATION, "p1")
+    patient = queue.enqueue("default", new_patient)
+
+    assert flusher.flush_once() == 2
+
+    assert [resource["resourceType"] for _, _, resource in created] == ["Observation", "Patient"]
+    for tracking_id, (_, write, resource) in zip((observation, patient), created):
+        assert write["id"] == tracking_id
+        assert resource["id"] and resource["id"] == queue.status(tracking_id)["id"]
+        assert store.read(resource["resourceType"], resource["id"]) is not None
+    assert created[0][2]["code"] == OBSERVATION["code"]
+    assert store.patients_by_mrn["MRN9"] == created[1][2]["id"]
+
+
+def test_transport_errors_are_retried(queue):
+    def unreachable(name):
+        raise ConnectionError("connection refused")
+
+    flusher = WriteBehindFlusher(queue, get_tenant=unreachable, max_attempts=2)
+    tracking_id = queue.enqueue("default", OBSERVATION)
+    flusher.flush_once()
+    assert queue.status(tracking_id)["status"] == "queued"
+    queue._db.execute("UPDATE writes SET next_attempt = ?", (time.time(),))
+    flusher.flush_once()
+    assert queue.status(tracking_id)["status"] == "failed"